@@ -1,9 +1,30 @@
 from django.contrib import admin
 
-from backend.models import AgendaItem, Bulletin, ContactItem, Newsletter
+from backend.models import AgendaItem, Bulletin, ContactItem, Enrollment, Newsletter, School
+
+
+class SchoolContentAdmin(admin.ModelAdmin):
+    """
+    Shows staff only the content of the school they're enrolled at, like IsSchoolStaff in the API. Superusers see the
+    content of every school.
+    """
+
+    def get_queryset(self, request):
+        queryset = super(SchoolContentAdmin, self).get_queryset(request)
+        if request.user.is_superuser:
+            return queryset
+        return queryset.filter(school__enrollment__user=request.user)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'school' and not request.user.is_superuser:
+            kwargs['queryset'] = School.objects.filter(enrollment__user=request.user)
+        return super(SchoolContentAdmin, self).formfield_for_foreignkey(db_field, request, **kwargs)
+
 
 # Register your models here.
-admin.site.register(AgendaItem)
-admin.site.register(Bulletin)
-admin.site.register(ContactItem)
-admin.site.register(Newsletter)
+admin.site.register(AgendaItem, SchoolContentAdmin)
+admin.site.register(Bulletin, SchoolContentAdmin)
+admin.site.register(ContactItem, SchoolContentAdmin)
+admin.site.register(Newsletter, SchoolContentAdmin)
+admin.site.register(School)
+admin.site.register(Enrollment)
@@ -0,0 +1,136 @@
+"""
+Load shedding. When a worker process is saturated, extra requests only wait until their clients give up, and the
+work done for them is wasted. AdmissionMiddleware answers them at once with a 503 and Retry-After instead, so the
+requests it does take finish in time.
+
+Requests are counted per route class while their view runs:
+- `read`: GET and HEAD of the public API, mostly served from cache;
+- `enrollment`: enrollment and push settings, which hash or check a PBKDF2 password;
+- `admin`: other writes, the admin site and admin-only endpoints.
+
+A worker takes at most `settings.ADMISSION_MAX_IN_FLIGHT` requests at once. Enrollment and admin requests each have a
+lower limit in `settings.ADMISSION_LIMITS`, and also aren't taken once fewer than `settings.ADMISSION_READ_RESERVE`
+places are left, so under load the expensive writes are refused first and the reads keep being served.
+
+Requests that waited in the web server's queue for longer than `settings.ADMISSION_MAX_QUEUE_SECONDS` are refused
+too, the enrollment and admin ones after half that time. The wait is known when the server tells when a request
+arrived: mod_wsgi always does, and proxies can in an X-Request-Start header. Clients can send that header too, so it's
+only read with `settings.ADMISSION_TRUST_REQUEST_START` on, behind a proxy that overwrites it.
+
+A request is counted out by AdmissionMiddleware, and failing that, when Django signals that it has finished: a
+middleware that raises in `process_response` keeps those before it from seeing the response.
+"""
+from __future__ import division, unicode_literals
+
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.http import HttpResponse
+
+ROUTE_CLASSES = ('read', 'enrollment', 'admin')
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+DEVICE_PATHS = ('/api/enrollment', '/api/push-settings')
+ADMIN_PREFIXES = ('/admin/', '/api-auth/', '/api/profiles', '/metrics')
+
+
+def route_class(request):
+    path = request.path_info
+    if path in DEVICE_PATHS:
+        return 'enrollment'
+    if path.startswith(ADMIN_PREFIXES) or request.method not in SAFE_METHODS:
+        return 'admin'
+    return 'read'
+
+
+class Gate(object):
+    """
+    Counts the requests of each route class in progress in this process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = dict.fromkeys(ROUTE_CLASSES, 0)
+
+    def enter(self, route_class):
+        """
+        Counts a request in, unless that would exceed the limits. Returns whether it did.
+        """
+        limit = settings.ADMISSION_MAX_IN_FLIGHT
+        with self.lock:
+            if route_class != 'read':
+                if self.in_flight[route_class] >= settings.ADMISSION_LIMITS[route_class]:
+                    return False
+                limit -= settings.ADMISSION_READ_RESERVE
+            if sum(self.in_flight.values()) >= limit:
+                return False
+            self.in_flight[route_class] += 1
+            return True
+
+    def leave(self, route_class):
+        with self.lock:
+            self.in_flight[route_class] -= 1
+
+
+gate = Gate()
+_local = threading.local()
+
+
+def track():
+    # Like Django's close_old_connections: also on request_started, for a request of which the end was never signaled.
+    request_started.connect(release, dispatch_uid='admission-release')
+    request_finished.connect(release, dispatch_uid='admission-release')
+
+
+def admit(route_class):
+    """
+    Counts the request of this thread in, unless that would exceed the limits. Returns whether it did.
+    """
+    if not gate.enter(route_class):
+        return False
+    _local.route_class = route_class
+    return True
+
+
+def release(**kwargs):
+    """
+    Counts the request of this thread out, if it's counted in still.
+    """
+    route_class = getattr(_local, 'route_class', None)
+    if route_class is not None:
+        del _local.route_class
+        gate.leave(route_class)
+
+
+def max_queue_seconds(route_class):
+    return settings.ADMISSION_MAX_QUEUE_SECONDS / (1 if route_class == 'read' else 2)
+
+
+def queued_for(request, now=None):
+    """
+    Seconds between the arrival of `request` at the web server and `now`, or None when the server doesn't say.
+    """
+    arrived = request.META.get('mod_wsgi.request_start')
+    if arrived is None and settings.ADMISSION_TRUST_REQUEST_START:
+        arrived = request.META.get('HTTP_X_REQUEST_START')
+    if not arrived:
+        return None
+    try:
+        arrived = float(arrived[2:] if arrived.startswith('t=') else arrived)
+    except ValueError:
+        return None
+    if not 0 < arrived < 10 ** 17:
+        return None    # Also not infinite or NaN.
+    # In microseconds (mod_wsgi, Heroku), milliseconds or seconds (nginx) since the epoch.
+    while arrived > 10 ** 11:
+        arrived /= 1000
+    return max((now or time.time()) - arrived, 0)
+
+
+def overloaded():
+    response = HttpResponse(json.dumps({'detail': 'Too busy, try again later.'}), status=503,
+                            content_type='application/json')
+    response['Retry-After'] = '%d' % settings.ADMISSION_RETRY_AFTER
+    return response
@@ -5,3 +5,14 @@ from django.apps import AppConfig
 
 class BackendConfig(AppConfig):
     name = 'backend'
+
+    def ready(self):
+        from backend import admission, cache, expansion, metrics, search, tenancy
+        admission.track()
+        # Receivers run in the order they're connected: rewrite an agenda item's occurrences before its cache version
+        # changes, so a request for the new version can't cache the old occurrences.
+        expansion.track()
+        cache.track(*cache.TRACKED_MODELS)
+        metrics.track()
+        search.track()
+        tenancy.track()
@@ -0,0 +1,190 @@
+"""
+Caching of rendered responses, invalidated by table versions.
+
+Every tracked table has a version token per school in the database that is replaced after each save or delete of one
+of the school's rows. Cache keys include the school and the tokens of the tables a value was built from, so a change
+makes readers look up a new key and the stale entries expire by themselves, and a change at one school leaves the
+entries of the others alone. Because the tokens live in the database, all worker processes notice a change at once,
+whatever cache backend is configured. The tokens also make good ETags.
+
+Bulk writes that bypass model signals, like `QuerySet.update()` or `backend.synthetic`, must call `bump()`
+themselves.
+
+After a change, or at midnight, every worker misses the same entry at once. `fetch()` lets only one of them rebuild it
+(single flight): on one host, threads and processes coordinate with file locks, and the others serve the previous
+version meanwhile or wait for the new one. The default cache is file-based for the same reason, so every process on
+the host sees what one of them built.
+"""
+from __future__ import unicode_literals
+
+import errno
+import fcntl
+import os
+import time
+from hashlib import sha1
+from timeit import default_timer
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from backend import metrics
+from backend.models import AgendaItem, Bulletin, ContactItem, Newsletter, TableVersion
+
+TRACKED_MODELS = (AgendaItem, Bulletin, ContactItem, Newsletter)
+KEY_PREFIX = 'sebastiaanschool'
+REBUILD_WAIT = 5.0
+LOCK_STRIPES = 64
+LOCK_POLL_INTERVAL = 0.02
+
+
+def track(*models):
+    """
+    Bumps the version of each model's table for a school whenever one of its instances of that school is saved or
+    deleted, and of the school it leaves when it moves to another.
+    """
+    for model in models:
+        pre_save.connect(_remember_school, sender=model, dispatch_uid='cache-version-move')
+        post_save.connect(_bump_on_change, sender=model, dispatch_uid='cache-version-save')
+        post_delete.connect(_bump_on_change, sender=model, dispatch_uid='cache-version-delete')
+
+
+def version(school_id, *models):
+    """
+    A token that changes whenever the rows of the school with primary key `school_id` in one of the tables of `models`
+    change.
+    """
+    tokens = versions(school_id, *models)
+    return '-'.join(tokens[model] for model in models)
+
+
+def versions(school_id, *models):
+    """
+    The version token of each of `models` for one school, by model, read in one query.
+    """
+    tables = [_table(model, school_id) for model in models]
+    tokens = dict(TableVersion.objects.filter(table__in=tables).values_list('table', 'token'))
+    for table in tables:
+        if table not in tokens:
+            # A fresh random token rather than a fixed initial one, so a new database never matches old entries.
+            tokens[table] = TableVersion.objects.get_or_create(table=table, defaults={'token': uuid4().hex})[0].token
+    return dict((model, tokens[table]) for model, table in zip(models, tables))
+
+
+def bump(school_id, *models):
+    for model in models:
+        table = _table(model, school_id)
+        if not TableVersion.objects.filter(table=table).update(token=uuid4().hex):
+            TableVersion.objects.get_or_create(table=table, defaults={'token': uuid4().hex})
+
+
+def key(school_id, name, token):
+    return '%s:%d:%s:%s' % (KEY_PREFIX, school_id, name, token)
+
+
+def lookup(school_id, name, token):
+    """
+    The value cached under `name` for one school and version `token`, or None.
+    """
+    value = cache.get(key(school_id, name, token))
+    metrics.record_cache_lookup(name, value is not None)
+    return value
+
+
+def store(school_id, name, token, value, timeout=None):
+    cache.set(key(school_id, name, token), value, timeout)
+
+
+def fetch(school_id, name, variant, token, build, timeout=None):
+    """
+    (token, value) of the entry cached under `name` and `variant` for version `token`, calling `build()` for its value
+    when it's missing. Of all threads and processes on this host that miss it at once, only one builds it. Meanwhile
+    the others get the last version that was built, with its own token, or wait up to REBUILD_WAIT seconds for this
+    one when there's none.
+    """
+    versioned = '%s-%s' % (variant, token)
+    value = lookup(school_id, name, versioned)
+    if value is not None:
+        return token, value
+    latest = key(school_id, name, '%s-latest' % variant)
+    lock = RebuildLock(key(school_id, name, versioned))
+    try:
+        if not lock.acquire():
+            previous = cache.get(latest)
+            value = cache.get(key(school_id, name, '%s-%s' % (variant, previous))) if previous else None
+            if value is not None:
+                return previous, value
+            lock.acquire(REBUILD_WAIT)
+        # Whoever held the lock may have just built it.
+        value = cache.get(key(school_id, name, versioned))
+        if value is None:
+            value = build()
+            metrics.inc('cache_rebuilds_total', cache=name)
+            store(school_id, name, versioned, value, timeout)
+            cache.set(latest, token, timeout)
+        return token, value
+    finally:
+        lock.release()
+
+
+class RebuildLock(object):
+    """
+    An exclusive lock on one of LOCK_STRIPES files in `settings.CACHE_LOCK_DIR`, picked by cache key. Unrelated keys
+    that share a file only wait for each other now and then; it keeps the number of files fixed.
+    """
+
+    def __init__(self, cache_key):
+        stripe = int(sha1(cache_key.encode('utf-8')).hexdigest(), 16) % LOCK_STRIPES
+        self.path = os.path.join(settings.CACHE_LOCK_DIR, '%02d.lock' % stripe)
+        self.file = None
+
+    def acquire(self, wait=0):
+        """
+        Takes the lock, waiting for up to `wait` seconds. Returns whether it got it.
+        """
+        if self.file is None:
+            _directory(settings.CACHE_LOCK_DIR)
+            self.file = open(self.path, 'a')
+        deadline = default_timer() + wait
+        while True:
+            try:
+                fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if default_timer() >= deadline:
+                return False
+            # Polls rather than blocking in flock(), which would stall all greenlets of a gevent worker.
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()    # Closing releases the lock.
+            self.file = None
+
+
+def _directory(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _table(model, school_id):
+    return '%s:%d' % (model._meta.db_table, school_id)
+
+
+def _remember_school(sender, instance, raw=False, update_fields=None, **kwargs):
+    if instance.pk is None or raw or (update_fields is not None and 'school' not in update_fields):
+        return
+    instance._previous_school_id = sender.objects.filter(pk=instance.pk).values_list('school', flat=True).first()
+
+
+def _bump_on_change(sender, instance, **kwargs):
+    bump(instance.school_id, sender)
+    previous = instance.__dict__.pop('_previous_school_id', None)
+    if previous is not None and previous != instance.school_id:
+        bump(previous, sender)
@@ -0,0 +1,183 @@
+"""
+A local copy of the documents that newsletters link to, so parents don't depend on the origin that hosts them.
+
+Each document is downloaded on its first request and kept in `settings.DOCUMENT_CACHE_DIR`, under a name derived from
+its URL: changing a newsletter's `documentUrl` makes the next request fetch the new document. A copy older than
+`settings.DOCUMENT_MAX_AGE` is downloaded anew, in case the origin replaced the document under the same URL; the old
+copy is served until that succeeds.
+
+A document is downloaded by one request at a time, across processes, under a RebuildLock (see backend/cache.py).
+Requests that find no copy wait for it; those that find an old one serve that meanwhile. Downloads go to a temporary
+file that's renamed into place when complete, so a failed download never leaves a partial document behind.
+"""
+from __future__ import unicode_literals
+
+import errno
+import logging
+import mimetypes
+import os
+import re
+import time
+from hashlib import sha1
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+from django.utils.six.moves.urllib.error import URLError
+from django.utils.six.moves.urllib.parse import urlparse
+from django.utils.six.moves.urllib.request import urlopen
+
+from backend import cache
+
+DEFAULT_CONTENT_TYPE = 'application/pdf'
+BLOCK_SIZE = 64 * 1024
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentUnavailable(Exception):
+    pass
+
+
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def path(url):
+    """
+    Where the document at `url` is kept, whether or not it has been fetched.
+    """
+    return os.path.join(settings.DOCUMENT_CACHE_DIR, sha1(url.encode('utf-8')).hexdigest())
+
+
+def fetch(url):
+    """
+    The path of the local copy of the document at `url`, downloading it first if there's none or it's outdated.
+    Raises DocumentUnavailable when there's no copy and the origin can't deliver one.
+    """
+    destination = path(url)
+    modified = _modified(destination)
+    if modified is not None and time.time() - modified < settings.DOCUMENT_MAX_AGE:
+        return destination
+    if urlparse(url).scheme not in ('http', 'https'):
+        raise DocumentUnavailable('Not an HTTP URL: %s' % url)
+    lock = cache.RebuildLock('document:%s' % url)
+    try:
+        if not lock.acquire(wait=settings.DOCUMENT_FETCH_TIMEOUT if modified is None else 0):
+            if modified is not None:
+                return destination
+            # The download in progress takes long; rather than wait longer, try on our own.
+        elif _modified(destination) != modified:
+            return destination    # Downloaded while this request waited.
+        try:
+            _download(url, destination)
+        except DocumentUnavailable:
+            if modified is None:
+                raise
+            logger.warning('Serving an old copy of %s', url, exc_info=True)
+            os.utime(destination, None)    # Try again after DOCUMENT_MAX_AGE.
+        return destination
+    finally:
+        lock.release()
+
+
+def content_type(url):
+    return mimetypes.guess_type(urlparse(url).path)[0] or DEFAULT_CONTENT_TYPE
+
+
+def byte_range(header, size):
+    """
+    (first, last) byte position, both inclusive, requested by Range header `header` for a document of `size` bytes.
+    None when the whole document should be sent: without a header, or with one this doesn't support, like multiple
+    ranges. Raises UnsatisfiableRange when the range lies beyond the end of the document.
+    """
+    match = RANGE.match(header.replace(' ', '')) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # A suffix: the last `last` bytes.
+        if int(last) == 0:
+            raise UnsatisfiableRange()
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if last < first:
+        if first < size:
+            return None    # Syntactically invalid, to be ignored.
+        raise UnsatisfiableRange()
+    return first, last
+
+
+class FileRange(object):
+    """
+    The bytes of an open file from its current position up to `length` bytes further. Keeps `fileno()`, so WSGI servers
+    whose file wrapper uses sendfile(), like gunicorn, still send it without copying; they limit it to the
+    Content-Length.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def _download(url, destination):
+    directory = _directory()
+    try:
+        response = urlopen(url, timeout=settings.DOCUMENT_FETCH_TIMEOUT)
+        try:
+            with NamedTemporaryFile(dir=directory, prefix='.download-', delete=False) as download:
+                try:
+                    _copy(response, download)
+                except Exception:
+                    os.remove(download.name)
+                    raise
+        finally:
+            response.close()
+    except (URLError, IOError, OSError) as e:
+        raise DocumentUnavailable('Could not fetch %s: %s' % (url, e))
+    os.rename(download.name, destination)
+
+
+def _copy(response, download):
+    copied = 0
+    while True:
+        block = response.read(BLOCK_SIZE)
+        if not block:
+            break
+        copied += len(block)
+        if copied > settings.DOCUMENT_MAX_BYTES:
+            raise IOError('Larger than %d bytes' % settings.DOCUMENT_MAX_BYTES)
+        download.write(block)
+
+
+def _directory():
+    directory = settings.DOCUMENT_CACHE_DIR
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return directory
+
+
+def _modified(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
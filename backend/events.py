@@ -0,0 +1,177 @@
+"""
+Tells connected clients when bulletins and newsletters become visible: at their publishedAt, or when they're saved
+with a publishedAt that has just passed.
+
+Each worker process has one `Hub`. While clients are connected, its thread polls the database every POLL_INTERVAL
+seconds for publications that became visible since the previous poll, and hands them to the queue of every connection.
+The database is all that the workers share, so that's how a bulletin saved in one worker reaches the clients of every
+other, without a message broker. It costs one indexed range query per table per poll per process, however many clients
+are connected.
+
+The hub polls for all schools at once; each connection only passes on the publications of its own school.
+
+Events are identified by the publishedAt and key of their publication, so a client that reconnects with the last ID
+it saw can be sent what it missed. Publications saved more than LATE_WINDOW after their publishedAt aren't announced.
+A client that falls QUEUE_SIZE polls behind is dropped: its stream ends, and it reconnects for what it missed.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.six.moves.queue import Full, Queue
+
+from backend.models import Bulletin, Newsletter, School
+
+MODELS = (Bulletin, Newsletter)
+POLL_INTERVAL = 1.0
+LATE_WINDOW = timedelta(minutes=5)
+QUEUE_SIZE = 100
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription(Queue):
+    """
+    The queue of one connection. `dropped` is set when it overflowed, after which it gets no more events.
+    """
+    dropped = False
+
+
+class Hub(object):
+    """
+    Broadcasts newly visible publications to subscribed queues. Each poll puts one list of (publishedAt, key,
+    publication) tuples, in order, on every queue.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.thread = None
+        self.started = self.checked_until = None
+        self.announced = {}
+
+    def subscribe(self):
+        queue = Subscription(QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.add(queue)
+            if self.thread is None:
+                self.started = self.checked_until = timezone.now()
+                self.thread = threading.Thread(target=self.run, name='timeline-events')
+                self.thread.daemon = True
+                self.thread.start()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self.lock:
+            self.subscribers.discard(queue)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.subscribers:
+                    # Stop polling until the next client connects.
+                    self.thread = None
+                    return
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Polling for timeline events failed')
+                connection.close()
+
+    def poll(self, now=None):
+        """
+        Publishes the publications that became visible since the previous poll. Returns them.
+        """
+        now = now or timezone.now()
+        # Not what was already visible before the hub started.
+        since = max(self.checked_until - LATE_WINDOW, self.started)
+        found = [event for event in visible(since, now) if event[1] not in self.announced]
+        for published_at, key, _ in found:
+            self.announced[key] = published_at
+        # Only what's still inside the window can show up again.
+        self.announced = dict((key, published_at) for key, published_at in self.announced.items()
+                              if published_at > now - LATE_WINDOW)
+        self.checked_until = now
+        if found:
+            self.publish(found)
+        return found
+
+    def publish(self, found):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for queue in subscribers:
+            try:
+                queue.put_nowait(found)
+            except Full:
+                # A stalled client. Later events would leave a gap, so end its stream instead: it reconnects with
+                # the last event ID it got and is sent what it missed.
+                queue.dropped = True
+                self.unsubscribe(queue)
+
+
+def visible(after, until, limit=None, school_id=None):
+    """
+    (publishedAt, key, publication) of bulletins and newsletters published after `after` up to and including `until`,
+    in order. `after` is a moment or the (publishedAt, key) of an event. With `limit`, the first `limit` of them. With
+    `school_id`, only those of that school.
+    """
+    found = []
+    for index, model in enumerate(MODELS):
+        selection = model.objects.filter(_after(after, index), publishedAt__lte=until).order_by('publishedAt', 'pk')
+        if school_id is not None:
+            selection = selection.filter(school=school_id)
+        else:
+            # A range of the (school, publishedAt) index per school; publishedAt has no index of its own.
+            selection = selection.filter(school__in=School.objects.values('pk'))
+        found.extend((publication.publishedAt, key(publication), publication)
+                     for publication in (selection[:limit] if limit else selection))
+    found.sort(key=lambda event: event[:2])
+    return found[:limit] if limit else found
+
+
+def missed(school_id, last, until, limit):
+    """
+    Up to `limit` events of a school after event ID `last`, as returned by `parse_id()`, in order. The second value
+    tells whether there were more.
+    """
+    found = visible(last, until, limit + 1, school_id)
+    return found[:limit], len(found) > limit
+
+
+def key(publication):
+    return 2 * publication.pk + MODELS.index(type(publication))
+
+
+def event_id(published_at, publication_key):
+    delta = published_at - EPOCH
+    return '%d-%d' % ((delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds, publication_key)
+
+
+def parse_id(text):
+    """
+    The (publishedAt, key) of an event ID, or None when it isn't one.
+    """
+    microseconds, _, publication_key = text.partition('-')
+    if not (microseconds.isdigit() and publication_key.isdigit()):
+        return None
+    return EPOCH + timedelta(microseconds=int(microseconds)), int(publication_key)
+
+
+def _after(after, model_index):
+    if not isinstance(after, tuple):
+        return Q(publishedAt__gt=after)
+    published_at, last_key = after
+    # Equal publishedAt but a higher key also comes after the event. Keys of this model are 2 * pk + model_index.
+    return Q(publishedAt__gt=published_at) | Q(publishedAt=published_at, pk__gt=(last_key - model_index) // 2)
+
+
+hub = Hub()
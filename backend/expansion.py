@@ -0,0 +1,107 @@
+"""
+Materializes the occurrences of agenda items into `AgendaOccurrence`, so date-range queries on the agenda are index
+range scans over concrete rows, however the items repeat.
+
+Single items get one occurrence. Recurring items get their occurrences up to a rolling horizon, HORIZON from now.
+Saving an item re-expands just that item. The daily `expand_agenda` job moves the horizon forward for recurring items,
+adding only their new occurrences, and expands items that were inserted without signals, like fixtures.
+
+Range queries beyond the horizon miss recurring occurrences. The calendar feed isn't affected, it carries the rules.
+"""
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from backend import recurrence
+from backend.models import AgendaItem, AgendaOccurrence
+
+HORIZON = timedelta(days=400)
+
+
+def track():
+    post_save.connect(_expand_on_save, sender=AgendaItem, dispatch_uid='agenda-expansion')
+
+
+def horizon(now=None):
+    return (now or timezone.now()) + HORIZON
+
+
+def expand(item, until=None):
+    """
+    Replaces all occurrences of `item` by those starting before `until`. Returns the number created.
+    """
+    until = until or horizon()
+    with transaction.atomic():
+        AgendaOccurrence.objects.filter(item=item).delete()
+        occurrences = AgendaOccurrence.objects.bulk_create(_occurrences(item, until))
+        AgendaItem.objects.filter(pk=item.pk).update(expandedUntil=until)
+    item.expandedUntil = until
+    return len(occurrences)
+
+
+def extend(item, until):
+    """
+    Adds the occurrences of recurring `item` from its `expandedUntil` up to `until`. Returns the number created.
+    """
+    with transaction.atomic():
+        occurrences = AgendaOccurrence.objects.bulk_create(
+            occurrence for occurrence in _occurrences(item, until) if occurrence.start >= item.expandedUntil)
+        AgendaItem.objects.filter(pk=item.pk).update(expandedUntil=until)
+    item.expandedUntil = until
+    return len(occurrences)
+
+
+def expand_all(now=None):
+    """
+    Expands all items that were never expanded and extends recurring items up to the current horizon. Returns the
+    number of occurrences created.
+    """
+    until = horizon(now)
+    created = 0
+    single = AgendaItem.objects.filter(expandedUntil__isnull=True, recurrence='')
+    last = single.aggregate(last=Max('pk'))['last']
+    if last is not None:
+        # One INSERT ... SELECT, as there may be millions of them after a bulk import.
+        single = single.filter(pk__lte=last)
+        with transaction.atomic():
+            created += insert_single_occurrences(last)
+            single.update(expandedUntil=until)
+    recurring = (AgendaItem.objects.exclude(recurrence='')
+                 .filter(Q(expandedUntil__isnull=True) | Q(expandedUntil__lt=until)))
+    for item in recurring.iterator():
+        created += expand(item, until) if item.expandedUntil is None else extend(item, until)
+    return created
+
+
+def insert_single_occurrences(last):
+    """
+    Gives every non-recurring item up to primary key `last` that was never expanded its one occurrence.
+    """
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {occurrence} ({item_id}, {school_id}, {start}, {end}) '
+            'SELECT {id}, {school_id}, {start}, {end} FROM {item} '
+            'WHERE {expanded_until} IS NULL AND {recurrence} = %s AND {id} <= %s'.format(
+                occurrence=quote(AgendaOccurrence._meta.db_table), item=quote(AgendaItem._meta.db_table),
+                item_id=quote('item_id'), school_id=quote('school_id'), id=quote('id'), start=quote('start'),
+                end=quote('end'), expanded_until=quote('expandedUntil'), recurrence=quote('recurrence')),
+            ['', last])
+        return cursor.rowcount
+
+
+def _occurrences(item, until):
+    if not item.recurrence:
+        return [AgendaOccurrence(item=item, school_id=item.school_id, start=item.start, end=item.end)]
+    return [AgendaOccurrence(item=item, school_id=item.school_id, start=start, end=end)
+            for start, end in recurrence.occurrences(item.start, item.end, item.recurrence, until)]
+
+
+def _expand_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        expand(instance)
@@ -0,0 +1,89 @@
+"""
+Renders agenda items as an iCalendar (RFC 5545) feed that calendar apps can subscribe to.
+"""
+from __future__ import unicode_literals
+
+from datetime import time, timedelta
+
+from django.utils import timezone
+
+CONTENT_TYPE = 'text/calendar; charset=utf-8'
+EVENTS_PER_CHUNK = 100
+MAX_LINE_OCTETS = 75
+
+
+def feed(items, stamp, school, events_per_chunk=EVENTS_PER_CHUNK):
+    """
+    Yields the calendar of `school` as UTF-8 encoded chunks of `events_per_chunk` events, so large calendars can be
+    streamed. `stamp` is the moment of rendering.
+    """
+    yield lines((
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//%s//Agenda//NL' % school.name.replace('//', '/'),
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        'X-WR-CALNAME:%s' % escape(school.name),
+        'X-WR-TIMEZONE:%s' % timezone.get_current_timezone_name(),
+    ))
+    chunk = []
+    for count, item in enumerate(items, 1):
+        chunk.extend(event(item, stamp, school))
+        if count % events_per_chunk == 0:
+            yield lines(chunk)
+            chunk = []
+    chunk.append('END:VCALENDAR')
+    yield lines(chunk)
+
+
+def event(item, stamp, school):
+    """
+    The content lines of one VEVENT. Items that start and end at midnight are all-day events, from the start date up
+    to and including the end date. Their UIDs are unique through the slug of the school, which keeps them when the
+    school changes hosts.
+    """
+    start, end = timezone.localtime(item.start), timezone.localtime(item.end)
+    if start.time() == time(0) and end.time() == time(0):
+        dates = ('DTSTART;VALUE=DATE:%s' % start.strftime('%Y%m%d'),
+                 'DTEND;VALUE=DATE:%s' % (end.date() + timedelta(days=1)).strftime('%Y%m%d'))
+    else:
+        dates = ('DTSTART:%s' % utc(item.start), 'DTEND:%s' % utc(item.end))
+    if item.recurrence:
+        dates += ('RRULE:%s' % item.recurrence,)
+    return (('BEGIN:VEVENT',
+             'UID:agendaitem-%d@%s' % (item.pk, school.slug),
+             'DTSTAMP:%s' % utc(stamp)) + dates +
+            ('SUMMARY:%s' % escape(item.title),
+             'CATEGORIES:%s' % escape(item.type),
+             'END:VEVENT'))
+
+
+def utc(moment):
+    return moment.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def escape(text):
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def lines(content_lines):
+    return ''.join(fold(line) + '\r\n' for line in content_lines).encode('utf-8')
+
+
+def fold(line):
+    """
+    Splits lines longer than 75 octets, continuing them on lines that start with a space. Never splits a character.
+    """
+    if len(line.encode('utf-8')) <= MAX_LINE_OCTETS:
+        return line
+    parts, part, octets = [], '', 0
+    for character in line:
+        size = len(character.encode('utf-8'))
+        if octets + size > MAX_LINE_OCTETS - (1 if parts else 0):
+            parts.append(part)
+            part, octets = '', 0
+        part += character
+        octets += size
+    parts.append(part)
+    return '\r\n '.join(parts)
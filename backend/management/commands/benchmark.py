@@ -0,0 +1,226 @@
+from __future__ import division, unicode_literals
+
+import base64
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import uuid
+from io import BytesIO
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from push_notifications.models import GCMDevice
+
+from backend import synthetic
+from backend.testing import temporary_data
+
+# Relative weights of the requests the app makes. Launch fetches the timeline, agenda and contacts and checks push
+# settings; enrollment and push registration happen once per install.
+MIX = (
+    ('timeline', 40),
+    ('agendaItems', 20),
+    ('agendaItems?all', 5),
+    ('contactItems', 10),
+    ('bulletins', 5),
+    ('newsletters', 5),
+    ('push-settings GET', 10),
+    ('push-settings POST', 3),
+    ('enrollment', 2),
+)
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class Command(BaseCommand):
+    help = """
+    Load-tests the WSGI application against a throwaway database seeded with synthetic data, and reports throughput
+    and latency percentiles per endpoint as JSON. Pass --baseline to fail when an endpoint got slower than in an
+    earlier report.
+
+    Example:
+    $ python manage.py benchmark --items 5000 --requests 2000 --output bench.json
+    $ python manage.py benchmark --items 5000 --requests 2000 --baseline bench.json
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000,
+                            help='Number of agenda items, bulletins and newsletters to seed.')
+        parser.add_argument('--users', type=int, default=100,
+                            help='Number of enrolled devices to seed.')
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Total number of requests to send.')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Number of threads sending requests.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed for data and request mix.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+        parser.add_argument('--baseline', help='JSON report of an earlier run to compare against.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative p95 slowdown per endpoint when comparing (default 0.2 = 20%%).')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        if connection.vendor == 'sqlite':
+            # A file rather than the in-memory default, so worker threads share it and it performs like production.
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+        # Keeps the synthetic responses out of the snapshots, cache, metrics and profiles of the deployment.
+        with temporary_data():
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                rng = random.Random(options['seed'])
+                usernames = synthetic.seed(options['items'], options['users'], rng)
+                report = self.run(usernames, options['requests'], options['concurrency'], rng)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report['parameters'] = dict((k, options[k]) for k in ('items', 'users', 'requests', 'concurrency', 'seed'))
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = compare(baseline, report, options['tolerance'])
+            for line in regressions:
+                self.stderr.write(line)
+            if regressions:
+                raise CommandError('%d endpoint(s) regressed against %s' % (len(regressions), options['baseline']))
+
+    def run(self, usernames, total, concurrency, rng):
+        from sebastiaanschool.wsgi import application
+
+        names = [name for name, weight in MIX for _ in range(weight)]
+        plan = [(rng.choice(names), rng.choice(usernames) if usernames else None) for _ in range(total)]
+        gcm_users = set(GCMDevice.objects.filter(user__username__in=usernames).values_list('user__username', flat=True))
+        timings = dict((name, []) for name, weight in MIX)
+        errors = dict((name, 0) for name, weight in MIX)
+        lock = threading.Lock()
+
+        def worker(requests):
+            for name, username in requests:
+                environ = build_environ(name, username, 'gcm' if username in gcm_users else 'apns')
+                started = default_timer()
+                status = call(application, environ)
+                elapsed = default_timer() - started
+                with lock:
+                    timings[name].append(elapsed)
+                    if status >= 500 or (status >= 400 and name != 'enrollment'):
+                        errors[name] += 1
+            connection.close()
+
+        started = default_timer()
+        threads = [threading.Thread(target=worker, args=(plan[i::concurrency],)) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = default_timer() - started
+
+        endpoints = {}
+        for name, values in timings.items():
+            if not values:
+                continue
+            values.sort()
+            endpoints[name] = {
+                'requests': len(values),
+                'errors': errors[name],
+                'throughput': len(values) / wall_time,
+                'mean': sum(values) / len(values),
+                'p50': percentile(values, 0.50),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99),
+            }
+        return {
+            'wall_time': wall_time,
+            'throughput': total / wall_time,
+            'endpoints': endpoints,
+        }
+
+
+def build_environ(name, username, service):
+    path, _, method = name.partition(' ')
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': method or 'GET',
+        'PATH_INFO': '/api/%s%s' % (path, '' if path in ('push-settings', 'enrollment') else '/'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': settings.ALLOWED_HOSTS[0],
+        'SERVER_PORT': '443',
+        'HTTP_HOST': settings.ALLOWED_HOSTS[0],
+        'HTTP_ACCEPT': 'application/json',
+        'HTTPS': 'on',
+        'REMOTE_ADDR': '10.%d.%d.%d' % tuple(random.randint(0, 255) for _ in range(3)),
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'https',
+        'wsgi.errors': BytesIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    body = b''
+    if name == 'enrollment':
+        environ['REQUEST_METHOD'] = 'POST'
+        body = json.dumps({'username': str(uuid.uuid4()), 'password': str(uuid.uuid4())}).encode('utf-8')
+    elif name.startswith('push-settings'):
+        credentials = '%s:%s' % (username, synthetic.PASSWORD)
+        environ['HTTP_AUTHORIZATION'] = 'Basic %s' % base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+        if method == 'POST':
+            body = json.dumps({'service': service,
+                               'active': True,
+                               'registration_id': 'synthetic-registration-%s' % username}).encode('utf-8')
+    environ['CONTENT_TYPE'] = 'application/json' if body else ''
+    environ['CONTENT_LENGTH'] = str(len(body))
+    environ['wsgi.input'] = BytesIO(body)
+    return environ
+
+
+def call(application, environ):
+    status = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append(int(status_line.split(' ', 1)[0]))
+
+    result = application(environ, start_response)
+    try:
+        for _ in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return status[0]
+
+
+def compare(baseline, report, tolerance):
+    """
+    Returns a description of every endpoint whose p95 latency grew by more than `tolerance` since `baseline`.
+    """
+    regressions = []
+    for name, current in sorted(report['endpoints'].items()):
+        previous = baseline.get('endpoints', {}).get(name)
+        if previous is None or not previous['p95']:
+            continue
+        change = current['p95'] / previous['p95'] - 1
+        if change > tolerance:
+            regressions.append('%s: p95 %.1f ms -> %.1f ms (+%d%%)'
+                               % (name, previous['p95'] * 1000, current['p95'] * 1000, change * 100))
+    return regressions
@@ -0,0 +1,150 @@
+from __future__ import division, unicode_literals
+
+import json
+import resource
+import socket
+import ssl
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.six.moves import http_client
+from django.utils.six.moves.urllib.parse import urlsplit
+
+from backend.management.commands.benchmark import percentile
+
+
+class Command(BaseCommand):
+    help = """
+    Measures how many slow clients a running server can hold at once. Opens --connections connections that send their
+    request headers one line at a time over --hold seconds, like phones on a bad network, and meanwhile times requests
+    from one well-connected client. Run it against the mod_wsgi deployment and against sebastiaanschool.gevent_wsgi to
+    compare the two.
+
+    Example:
+    $ python -m sebastiaanschool.gevent_wsgi &
+    $ python manage.py benchmark_connections http://127.0.0.1:8080/api/timeline --connections 2000 --hold 20
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='A GET endpoint of a running server.')
+        parser.add_argument('--connections', type=int, default=1000, help='Slow clients to open.')
+        parser.add_argument('--hold', type=float, default=10.0,
+                            help='Seconds each slow client takes to send its request.')
+        parser.add_argument('--timeout', type=float, default=5.0,
+                            help='Seconds to wait for a response before counting a request as failed.')
+        parser.add_argument('--output', help='Also write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme not in ('http', 'https'):
+            raise CommandError('Expected an http or https URL, got %r.' % options['url'])
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < options['connections'] + 100:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        timeout = options['timeout']
+        target = (url.hostname, url.port or (443 if url.scheme == 'https' else 80), url.scheme == 'https')
+        path = (url.path or '/') + ('?' + url.query if url.query else '')
+
+        slow, refused = [], 0
+        for _ in range(options['connections']):
+            try:
+                client = connect(target, timeout)
+                client.sendall(('GET %s HTTP/1.1\r\nHost: %s\r\n' % (path, url.netloc)).encode('ascii'))
+                slow.append(client)
+            except (socket.error, ssl.SSLError):
+                refused += 1
+
+        latencies, probe_errors = [], 0
+        started = default_timer()
+        deadline = started + options['hold']
+        trickle_interval = options['hold'] / 10
+        next_trickle = started + trickle_interval
+        while default_timer() < deadline:
+            if default_timer() >= next_trickle:
+                slow = trickle(slow, b'X-Slow-Client: 1\r\n')
+                next_trickle += trickle_interval
+            probe_started = default_timer()
+            if probe(target, url.netloc, path, timeout) == 200:
+                latencies.append(default_timer() - probe_started)
+            else:
+                probe_errors += 1
+        held = len(slow)
+
+        slow = trickle(slow, b'Connection: close\r\n\r\n')
+        completed = 0
+        deadline = default_timer() + timeout
+        for client in slow:
+            client.settimeout(max(deadline - default_timer(), 0.01))
+            completed += read_status(client) == 200
+            client.close()
+
+        latencies.sort()
+        report = {
+            'url': options['url'],
+            'connections': options['connections'],
+            'refused': refused,
+            'held': held,
+            'completed': completed,
+            'probes': len(latencies) + probe_errors,
+            'probe_errors': probe_errors,
+            'probe_p50': percentile(latencies, 0.50),
+            'probe_p95': percentile(latencies, 0.95),
+            'probe_max': latencies[-1] if latencies else None,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+
+
+def connect(target, timeout):
+    host, port, secure = target
+    client = socket.create_connection((host, port), timeout)
+    return ssl.wrap_socket(client) if secure else client
+
+
+def trickle(clients, data):
+    """
+    Sends `data` on each connection and returns those that are still open.
+    """
+    remaining = []
+    for client in clients:
+        try:
+            client.sendall(data)
+            remaining.append(client)
+        except (socket.error, ssl.SSLError):
+            client.close()
+    return remaining
+
+
+def probe(target, netloc, path, timeout):
+    """
+    The status of one complete request, or None when it failed or timed out.
+    """
+    host, port, secure = target
+    connection_class = http_client.HTTPSConnection if secure else http_client.HTTPConnection
+    connection = connection_class(host, port, timeout=timeout)
+    try:
+        connection.request('GET', path, headers={'Host': netloc})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    except (socket.error, ssl.SSLError, http_client.HTTPException):
+        return None
+    finally:
+        connection.close()
+
+
+def read_status(client):
+    data = b''
+    try:
+        while b'\r\n' not in data:
+            chunk = client.recv(1024)
+            if not chunk:
+                break
+            data += chunk
+    except (socket.error, ssl.SSLError):
+        pass
+    parts = data.split(b'\r\n', 1)[0].split()
+    return int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
@@ -0,0 +1,16 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from backend import expansion
+
+
+class Command(BaseCommand):
+    help = """
+    Materializes agenda occurrences: expands items that were never expanded (e.g. loaded from a fixture) and moves the
+    horizon of recurring items forward. Run daily; the deploy hook and a daily cron job do so on OpenShift.
+    """
+
+    def handle(self, *args, **options):
+        created = expansion.expand_all()
+        self.stdout.write('Created %d agenda occurrences up to %s' % (created, expansion.horizon().date()))
@@ -0,0 +1,72 @@
+from __future__ import division, unicode_literals
+
+import random
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from backend import expansion, synthetic
+from backend.models import DEFAULT_SCHOOL_ID, AgendaItem, Bulletin, ContactItem, Newsletter, School
+
+
+class Command(BaseCommand):
+    help = """
+    Bulk inserts synthetic agenda items, bulletins, newsletters, contacts and self-enrolled users with push
+    registrations, for scale testing. Never run this against production data. Run it once per --school to fill
+    several schools.
+
+    Example:
+    $ python manage.py generate_load_data --agenda-items 1000000 --bulletins 1000000 --newsletters 100000 \\
+          --users 500000
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agenda-items', type=int, default=0)
+        parser.add_argument('--bulletins', type=int, default=0)
+        parser.add_argument('--newsletters', type=int, default=0)
+        parser.add_argument('--contacts', type=int, default=0)
+        parser.add_argument('--users', type=int, default=0,
+                            help='Self-enrolled users, each with one APNS or GCM registration.')
+        parser.add_argument('--years', type=int, default=5,
+                            help='How many years of history to spread content over.')
+        parser.add_argument('--batch-size', type=int, default=synthetic.BATCH_SIZE,
+                            help='Rows per INSERT batch and transaction.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+        parser.add_argument('--school', help='Slug of the school to add content to, created if needed. By default the '
+                                             'first school.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        batch_size = options['batch_size']
+        years = options['years']
+        school_id = DEFAULT_SCHOOL_ID
+        if options['school']:
+            school, created = School.objects.get_or_create(slug=options['school'], defaults={'name': options['school']})
+            school_id = school.pk
+        tables = (
+            ('agenda items', AgendaItem, synthetic.AGENDA_ITEM_FIELDS,
+             synthetic.agenda_items(options['agenda_items'], rng, now, years)),
+            ('bulletins', Bulletin, synthetic.BULLETIN_FIELDS,
+             synthetic.bulletins(options['bulletins'], rng, now, years)),
+            ('newsletters', Newsletter, ('title', 'documentUrl', 'publishedAt'),
+             synthetic.newsletters(options['newsletters'], rng, now, years)),
+            ('contacts', ContactItem, ('displayName', 'email', 'order', 'detailText'),
+             synthetic.contact_items(options['contacts'], rng)),
+        )
+        for name, model, fields, rows in tables:
+            started = default_timer()
+            count = synthetic.insert(model, fields, rows, batch_size, school_id)
+            self.report(name, count, started)
+        started = default_timer()
+        self.report('agenda occurrences', expansion.expand_all(), started)
+        if options['users']:
+            started = default_timer()
+            synthetic.seed_users(options['users'], rng, batch_size, school_id)
+            self.report('users with devices', options['users'], started)
+
+    def report(self, name, count, started):
+        if count:
+            elapsed = default_timer() - started
+            self.stdout.write('Inserted %d %s in %.1f s (%d rows/s)' % (count, name, elapsed, count / elapsed))
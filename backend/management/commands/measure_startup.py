@@ -0,0 +1,66 @@
+from __future__ import division, unicode_literals
+
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter: imports the WSGI application, then sends each request twice.
+PROBE = """
+import json
+import sys
+from timeit import default_timer
+
+started = default_timer()
+from sebastiaanschool.wsgi import application
+result = {'import': default_timer() - started}
+
+from backend.management.commands.benchmark import build_environ, call
+for name in sys.argv[1:]:
+    for attempt in ('first', 'second'):
+        started = default_timer()
+        status = call(application, build_environ(name, None, None))
+        result['%s %s' % (attempt, name)] = default_timer() - started
+        if status != 200:
+            result['status %s' % name] = status
+sys.stdout.write(json.dumps(result))
+"""
+
+
+class Command(BaseCommand):
+    help = """
+    Measures how long a fresh worker takes to import the WSGI application and to serve its first requests, with and
+    without the boot-time warm-up. Reports the median of several runs as JSON. Uses the configured database.
+
+    Example:
+    $ python manage.py measure_startup --runs 10
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to start per mode.')
+        parser.add_argument('requests', nargs='*', default=['timeline', 'agendaItems', 'contactItems'],
+                            help='Public GET endpoints to request, as named in the benchmark mix.')
+
+    def handle(self, *args, **options):
+        report = {}
+        for mode in ('on', 'off'):
+            runs = [self.probe(mode, options['requests']) for _ in range(options['runs'])]
+            report['warmup %s' % mode] = dict((key, median([run[key] for run in runs])) for key in runs[0])
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+
+    @staticmethod
+    def probe(mode, requests):
+        environment = dict(os.environ, SEBASTIAAN_WARMUP=mode, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'sebastiaanschool.settings'))
+        output = subprocess.check_output([sys.executable, '-c', PROBE] + list(requests), env=environment,
+                                         cwd=settings.BASE_DIR)
+        return json.loads(output.decode('utf-8'))
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
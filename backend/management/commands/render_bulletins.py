@@ -0,0 +1,40 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend import cache
+from backend.models import Bulletin, render_markdown
+
+
+class Command(BaseCommand):
+    help = """
+    Renders the Markdown body of bulletins that have no HTML yet, like those saved before the HTML was stored or
+    inserted with raw SQL. With --all, re-renders every bulletin, e.g. after a change to the renderer. Saving a
+    bulletin renders it by itself.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-render all bulletins.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Bulletins per transaction.')
+
+    def handle(self, *args, **options):
+        selection = Bulletin.objects.all()
+        if not options['all']:
+            selection = selection.filter(bodyHtml='').exclude(body='')
+        rendered = last = 0
+        schools = set()
+        while True:
+            batch = list(selection.filter(pk__gt=last).order_by('pk')
+                         .values_list('pk', 'body', 'school')[:options['batch_size']])
+            if not batch:
+                break
+            with transaction.atomic():
+                for pk, body, school_id in batch:
+                    Bulletin.objects.filter(pk=pk).update(bodyHtml=render_markdown(body))
+                    schools.add(school_id)
+            rendered += len(batch)
+            last = batch[-1][0]
+        for school_id in schools:
+            cache.bump(school_id, Bulletin)    # update() sends no signals.
+        self.stdout.write('Rendered %d bulletins' % rendered)
@@ -0,0 +1,17 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from backend import search
+
+
+class Command(BaseCommand):
+    help = """
+    Adds bulletins and newsletters that are missing from the search index, e.g. after importing them with raw SQL.
+    Saving and deleting through Django keeps the index up to date by itself.
+    """
+
+    def handle(self, *args, **options):
+        for model in search.INDEXED_MODELS:
+            count = search.index_missing(model)
+            self.stdout.write('Indexed %d %s' % (count, model._meta.verbose_name_plural))
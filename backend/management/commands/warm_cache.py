@@ -0,0 +1,24 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from backend import warmer
+
+
+class Command(BaseCommand):
+    help = """
+    Renders the cached public responses that are missing, like after an edit, and within ten minutes of midnight
+    those of the coming day, so that requests don't have to. A cron job runs it every minute on OpenShift. With
+    --watch, keeps doing so every --interval seconds.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', action='store_true', help='Keep running.')
+        parser.add_argument('--interval', type=float, default=warmer.WATCH_INTERVAL,
+                            help='Seconds between runs with --watch.')
+
+    def handle(self, *args, **options):
+        if options['watch']:
+            warmer.watch(options['interval'])
+        else:
+            self.stdout.write('Rendered %d cached responses' % warmer.warm())
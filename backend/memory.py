@@ -0,0 +1,103 @@
+"""
+Memory use of worker processes, to find what makes them grow and to size them, without attaching a debugger.
+
+MetricsMiddleware counts by how much each request raised the peak resident set size of its process, per route, and
+logs the requests that raised it by more than `settings.MEMORY_LOG_GROWTH_MB`. Requests that run at the same time in
+one process may each be charged for the same growth.
+
+Admins can also track what a worker allocates, through /api/memory: `start()` takes a baseline, `report()` compares
+the present against it. On Python 3 that's done with tracemalloc, by allocation site. Python 2 has no tracemalloc, so
+there the baseline is the number of live objects of each type that the garbage collector tracks, which leaves out
+strings and numbers. Counting them walks all objects, so it's only done on request.
+"""
+from __future__ import division, unicode_literals
+
+import gc
+import os
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+
+try:
+    import tracemalloc
+except ImportError:    # Python 2
+    tracemalloc = None
+
+TRACE_FRAMES = 1
+TOP = 20
+
+_lock = threading.Lock()
+_tracking = {}
+
+
+def peak_rss():
+    """
+    Highest resident set size this process has had, in bytes.
+    """
+    # Kilobytes on Linux, bytes on macOS.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def rss():
+    """
+    Resident set size of this process in bytes, or None where there's no /proc.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return None
+
+
+def start():
+    with _lock:
+        if tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACE_FRAMES)
+            baseline = tracemalloc.take_snapshot()
+        else:
+            baseline = type_counts()
+        _tracking.update(baseline=baseline, started=time.time())
+
+
+def stop():
+    with _lock:
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        _tracking.clear()
+
+
+def report(limit=TOP):
+    """
+    The memory use of this process and, while tracking, the `limit` allocation sites or types that grew most since
+    `start()`.
+    """
+    data = {'pid': os.getpid(), 'rss': rss(), 'peakRss': peak_rss(), 'tracking': False}
+    with _lock:
+        if not _tracking:
+            return data
+        data.update(tracking=True, seconds=time.time() - _tracking['started'],
+                    growth=_growth(_tracking['baseline'], limit))
+    return data
+
+
+def type_counts():
+    counts = Counter()
+    for obj in gc.get_objects():
+        cls = type(obj)
+        counts['%s.%s' % (cls.__module__, cls.__name__)] += 1
+    return counts
+
+
+def _growth(baseline, limit):
+    if tracemalloc is not None:
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        return [{'site': '%s:%d' % (stat.traceback[0].filename, stat.traceback[0].lineno),
+                 'sizeDiff': stat.size_diff, 'size': stat.size, 'countDiff': stat.count_diff, 'count': stat.count}
+                for stat in snapshot.compare_to(baseline, 'lineno')[:limit]]
+    counts = type_counts()
+    grown = sorted(((counts[name] - baseline.get(name, 0), name) for name in counts), reverse=True)[:limit]
+    return [{'type': name, 'countDiff': difference, 'count': counts[name]}
+            for difference, name in grown if difference > 0]
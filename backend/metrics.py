@@ -0,0 +1,257 @@
+"""
+Process-local metrics, shared between worker processes through a directory of files.
+
+Every worker keeps its counters in memory and writes them to its own file in `settings.METRICS_DIR` every few seconds.
+A scrape merges the files of all workers, so it never has to talk to another process. Files of workers that have
+exited are folded into a single archive file, so counters keep increasing across worker restarts.
+
+SQL is counted from Django's query log. `log_queries()` turns it on for the request of the current thread; it's
+turned back off when the request finishes, even when a middleware failed on the way out.
+"""
+from __future__ import division, unicode_literals
+
+import errno
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connections
+
+PREFIX = 'sebastiaanschool_'
+ARCHIVE = 'archive.json'
+FLUSH_INTERVAL = 5    # seconds
+
+# Upper bounds of the latency histogram buckets, in seconds. The implicit last bucket is +Inf.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'http_requests_total': ('counter', 'HTTP requests by route, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time spent handling a request, by route.'),
+    'db_queries_total': ('counter', 'SQL queries executed, by route.'),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in SQL queries, by route.'),
+    'cache_lookups_total': ('counter', 'Cache lookups by cache and result (hit or miss).'),
+    'cache_rebuilds_total': ('counter', 'Cache entries built after a miss, by cache. Concurrent misses build once.'),
+    'http_requests_shed_total': ('counter', 'Requests refused with a 503 by load shedding, by route class and reason.'),
+    'http_requests_degraded_total': ('counter', 'Requests that failed to reach the database, by result (snapshot '
+                                     'served or unavailable).'),
+    'peak_rss_growth_bytes_total': ('counter', 'Growth of the peak resident memory of workers during requests, by '
+                                    'route.'),
+    'enrollments_total': ('counter', 'Self-enrollments created and deleted.'),
+    'push_devices': ('gauge', 'Registered push devices by service and active flag.'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_last_flush = [default_timer()]
+_file = {}
+_local = threading.local()
+
+
+def track():
+    request_finished.connect(stop_logging_queries, dispatch_uid='metrics-queries')
+
+
+def log_queries():
+    """
+    Makes the database connections of this thread keep the text and time of their queries, until
+    `stop_logging_queries()`.
+    """
+    if not hasattr(_local, 'logging_queries'):
+        _local.logging_queries = [(connection, connection.force_debug_cursor) for connection in connections.all()]
+    for connection in connections.all():
+        connection.force_debug_cursor = True
+
+
+def stop_logging_queries(**kwargs):
+    for connection, logging_queries in _local.__dict__.pop('logging_queries', ()):
+        connection.force_debug_cursor = logging_queries
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+def inc(name, amount=1, **labels):
+    """
+    Adds `amount` to the counter `name` with the given labels.
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """
+    Records `value` in the histogram `name` with the given labels.
+    """
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # One count per bucket plus +Inf, then the sum of all values.
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[len(BUCKETS)] += 1
+        histogram[-1] += value
+
+
+def record_cache_lookup(cache, hit):
+    inc('cache_lookups_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def maybe_flush():
+    """
+    Writes this process' metrics to disk if the last write was more than FLUSH_INTERVAL seconds ago.
+    """
+    if default_timer() - _last_flush[0] >= FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    with _lock:
+        data = {'counters': dict(_counters), 'histograms': dict((k, list(v)) for k, v in _histograms.items())}
+        _last_flush[0] = default_timer()
+    _write(os.path.join(_directory(), _own_filename()), data)
+
+
+def collect():
+    """
+    Returns the metrics of all worker processes, merged, as {'counters': {...}, 'histograms': {...}}.
+    """
+    flush()
+    directory = _directory()
+    with open(os.path.join(directory, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            total = _read(os.path.join(directory, ARCHIVE))
+            archive = _read(os.path.join(directory, ARCHIVE))
+            exited = []
+            for filename in os.listdir(directory):
+                if not filename.endswith('.json') or filename == ARCHIVE:
+                    continue
+                data = _read(os.path.join(directory, filename))
+                _merge(total, data)
+                if not _is_running(int(filename.split('-', 1)[0])):
+                    _merge(archive, data)
+                    exited.append(filename)
+            if exited:
+                _write(os.path.join(directory, ARCHIVE), archive)
+                for filename in exited:
+                    os.remove(os.path.join(directory, filename))
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return total
+
+
+def render(data, gauges=()):
+    """
+    Formats merged metrics plus `gauges` (an iterable of (name, labels, value)) in the Prometheus text format.
+    """
+    families = {}
+    for key, value in data['counters'].items():
+        name, labels = json.loads(key)
+        families.setdefault(name, []).append((name, labels, value))
+    for key, histogram in data['histograms'].items():
+        name, labels = json.loads(key)
+        samples = families.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram[:-1]):
+            cumulative += count
+            samples.append((name + '_bucket', labels + [['le', _format_bound(bound)]], cumulative))
+        samples.append((name + '_sum', labels, histogram[-1]))
+        samples.append((name + '_count', labels, cumulative))
+    for name, labels, value in gauges:
+        families.setdefault(name, []).append((name, sorted(labels.items()), value))
+
+    lines = []
+    for name in sorted(families):
+        kind, description = HELP.get(name, ('untyped', name))
+        lines.append('# HELP %s%s %s' % (PREFIX, name, description))
+        lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+        for sample, labels, value in families[name]:
+            lines.append('%s%s%s %s' % (PREFIX, sample, _format_labels(labels), _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _own_filename():
+    # Computed on first use rather than at import, so preforked workers don't share a file. Process IDs get reused,
+    # so the start time is part of the name.
+    pid = os.getpid()
+    if _file.get('pid') != pid:
+        _file['pid'] = pid
+        _file['name'] = '%d-%d.json' % (pid, int(time.time() * 1000))
+    return _file['name']
+
+
+def _directory():
+    directory = settings.METRICS_DIR
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return directory
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        # Missing, or a worker died halfway through its very first write.
+        return {'counters': {}, 'histograms': {}}
+
+
+def _write(path, data):
+    # Write-then-rename, so readers never see half a file.
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.rename(temporary, path)
+
+
+def _merge(total, data):
+    for key, value in data['counters'].items():
+        total['counters'][key] = total['counters'].get(key, 0) + value
+    for key, histogram in data['histograms'].items():
+        if key in total['histograms']:
+            total['histograms'][key] = [a + b for a, b in zip(total['histograms'][key], histogram)]
+        else:
+            total['histograms'][key] = list(histogram)
+
+
+def _is_running(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _format_bound(bound):
+    return bound if bound == '+Inf' else repr(float(bound))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = ('%s="%s"' % (k, ('%s' % v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in labels)
+    return '{%s}' % ','.join(escaped)
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else '%d' % value
@@ -0,0 +1,181 @@
+from __future__ import division, unicode_literals
+
+import cProfile
+import logging
+import os
+import random
+import threading
+from timeit import default_timer
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connections
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+
+from backend import admission, memory, metrics, presence, profiling, snapshots, tenancy
+
+logger = logging.getLogger(__name__)
+
+
+def route_name(request):
+    """
+    Name of the URL pattern that handled `request`, for use as a low-cardinality metrics label.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.view_name
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Counts requests and records request and SQL latency and growth of peak memory per route, see `backend.memory`. Put
+    it first, so it times all other middleware.
+
+    SQL time comes from Django's query log, which is reset at the start of every request. The log holds the text of
+    every query until the request ends, so `settings.METRICS_SQL` turns it off, for profiles too.
+    """
+
+    def process_request(self, request):
+        request._metrics_started = default_timer()
+        request._metrics_peak_rss = memory.peak_rss()
+        if settings.METRICS_SQL:
+            metrics.log_queries()
+
+    def process_response(self, request, response):
+        started = getattr(request, '_metrics_started', None)
+        if started is None:
+            return response
+        route = route_name(request)
+        metrics.observe('http_request_duration_seconds', default_timer() - started, route=route)
+        metrics.inc('http_requests_total', route=route, method=request.method, status='%d' % response.status_code)
+        queries = [query for connection in connections.all() for query in connection.queries_log
+                   if settings.METRICS_SQL]
+        metrics.stop_logging_queries()
+        if queries:
+            metrics.inc('db_queries_total', len(queries), route=route)
+            metrics.inc('db_query_duration_seconds_total', sum(float(query['time']) for query in queries),
+                        route=route)
+        growth = memory.peak_rss() - request._metrics_peak_rss
+        if growth > 0:
+            metrics.inc('peak_rss_growth_bytes_total', growth, route=route)
+            if growth >= settings.MEMORY_LOG_GROWTH_MB * 2 ** 20:
+                logger.warning('%s %s raised the peak memory of process %d by %.1f MB to %.1f MB', request.method,
+                               route, os.getpid(), growth / 2 ** 20, memory.peak_rss() / 2 ** 20)
+        metrics.maybe_flush()
+        return response
+
+
+class AdmissionMiddleware(MiddlewareMixin):
+    """
+    Answers 503 with Retry-After at once when this worker is too busy for a request, see `backend.admission`. Put it
+    right after MetricsMiddleware, so refusing costs next to nothing and refusals are counted.
+    """
+
+    def process_request(self, request):
+        route_class = admission.route_class(request)
+        waited = admission.queued_for(request) if settings.ADMISSION_MAX_QUEUE_SECONDS else None
+        if waited is not None and waited > admission.max_queue_seconds(route_class):
+            reason = 'queued'
+        elif not settings.ADMISSION_MAX_IN_FLIGHT or admission.admit(route_class):
+            return None
+        else:
+            reason = 'busy'
+        metrics.inc('http_requests_shed_total', route_class=route_class, reason=reason)
+        return admission.overloaded()
+
+    def process_response(self, request, response):
+        # Streaming responses are counted out when streaming starts; a server-sent event stream doesn't hold a place.
+        admission.release()
+        return response
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    Saves a profile of every request slower than `PROFILE_SLOW_REQUEST_SECONDS`, and of one in every
+    `PROFILE_SAMPLE_RATE` requests. Under gevent, only the latter. See `backend.profiling`. The profiles include the
+    queries that MetricsMiddleware logs, so none with `settings.METRICS_SQL` off.
+    """
+    sampler = profiling.StackSampler()
+    greenlets = profiling.greenlets()
+
+    def process_request(self, request):
+        if settings.PROFILE_SAMPLE_RATE and random.randrange(settings.PROFILE_SAMPLE_RATE) == 0:
+            request._profiler = cProfile.Profile()
+            request._profiler.enable()
+        elif settings.PROFILE_SLOW_REQUEST_SECONDS is not None and not self.greenlets:
+            request._profile_thread = threading.current_thread().ident
+            self.sampler.start(request._profile_thread)
+        else:
+            return
+        request._profile_started = default_timer()
+
+    def process_response(self, request, response):
+        started = getattr(request, '_profile_started', None)
+        if started is None:
+            return response
+        elapsed = default_timer() - started
+        if hasattr(request, '_profiler'):
+            request._profiler.disable()
+            kind, profile = 'sampled', profiling.format_cprofile(request._profiler)
+        elif hasattr(request, '_profile_thread'):
+            samples = self.sampler.stop(request._profile_thread)
+            if elapsed < settings.PROFILE_SLOW_REQUEST_SECONDS:
+                return response
+            kind, profile = 'slow', profiling.format_samples(samples)
+        else:
+            return response
+        queries = [query for connection in connections.all() for query in connection.queries_log]
+        profiling.save(request, response, elapsed, kind, profile, queries)
+        return response
+
+
+class SchoolMiddleware(MiddlewareMixin):
+    """
+    Sets `request.school`, resolved when first used, see `backend.tenancy`.
+    """
+
+    def process_request(self, request):
+        request.school = SimpleLazyObject(lambda: tenancy.resolve(request))
+
+    def process_response(self, request, response):
+        # The X-School header picks the school, so shared caches must tell its values apart.
+        patch_vary_headers(response, ('X-School',))
+        return response
+
+
+class LastSeenMiddleware(MiddlewareMixin):
+    """
+    Records when authenticated users, that is enrolled devices, call the API, see `backend.presence`. Put it after
+    AuthenticationMiddleware.
+    """
+
+    def process_response(self, request, response):
+        # REST framework views put the user they authenticated here too. For anonymous requests without a session
+        # this costs no query.
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            presence.seen(user.pk)
+        presence.maybe_flush()
+        return response
+
+
+class SnapshotMiddleware(MiddlewareMixin):
+    """
+    Serves the last good snapshot of public list responses while the database can't be reached, and a 503 for
+    everything else, instead of a 500. See `backend.snapshots`. Put it last, so it sees the exceptions of views first.
+    """
+
+    def process_response(self, request, response):
+        if snapshots.keep(request, response):
+            snapshots.save(request, response)
+        return response
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, (OperationalError, InterfaceError)):
+            return None
+        logger.error('Database unavailable', exc_info=True)
+        response = snapshots.load(request)
+        metrics.inc('http_requests_degraded_total', result='unavailable' if response is None else 'snapshot')
+        return response or snapshots.unavailable()
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 07:07
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_auto_20161016_2046'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='agendaitem',
+            index_together=set([('end', 'start')]),
+        ),
+    ]
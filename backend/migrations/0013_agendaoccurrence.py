@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 07:13
+from __future__ import unicode_literals
+
+import backend.recurrence
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def expand_existing_items(apps, schema_editor):
+    # Existing items don't repeat, so each gets one occurrence with its own start and end.
+    AgendaItem = apps.get_model('backend', 'AgendaItem')
+    AgendaOccurrence = apps.get_model('backend', 'AgendaOccurrence')
+    quote = schema_editor.connection.ops.quote_name
+    schema_editor.execute(
+        'INSERT INTO {occurrence} ({item_id}, {start}, {end}) SELECT {id}, {start}, {end} FROM {item}'.format(
+            occurrence=quote(AgendaOccurrence._meta.db_table), item=quote(AgendaItem._meta.db_table),
+            item_id=quote('item_id'), id=quote('id'), start=quote('start'), end=quote('end')))
+    AgendaItem.objects.update(expandedUntil=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_tableversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgendaOccurrence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['-start'],
+            },
+        ),
+        migrations.AddField(
+            model_name='agendaitem',
+            name='expandedUntil',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='agendaitem',
+            name='recurrence',
+            field=models.CharField(blank=True, default='', help_text='iCalendar RRULE, e.g. FREQ=WEEKLY;BYDAY=MO,TH or FREQ=MONTHLY;BYDAY=1FR', max_length=200, validators=[backend.recurrence.validate]),
+        ),
+        migrations.AddField(
+            model_name='agendaoccurrence',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='backend.AgendaItem'),
+        ),
+        migrations.AlterIndexTogether(
+            name='agendaoccurrence',
+            index_together=set([('end', 'start')]),
+        ),
+        migrations.RunPython(expand_existing_items, migrations.RunPython.noop),
+    ]
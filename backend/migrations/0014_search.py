@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# See backend/search.py. Documents are keyed 2 * id for bulletins and 2 * id + 1 for newsletters.
+SQLITE = [
+    "CREATE VIRTUAL TABLE backend_search USING fts5(title, body, publishedAt UNINDEXED)",
+    "INSERT INTO backend_search (rowid, title, body, publishedAt) "
+    "SELECT 2 * id, title, body, publishedAt FROM backend_bulletin",
+    "INSERT INTO backend_search (rowid, title, body, publishedAt) "
+    "SELECT 2 * id + 1, title, '', publishedAt FROM backend_newsletter",
+]
+POSTGRESQL = [
+    'CREATE TABLE backend_search (id bigint PRIMARY KEY, document tsvector NOT NULL, '
+    '"publishedAt" timestamp with time zone NOT NULL)',
+    'CREATE INDEX backend_search_document ON backend_search USING GIN (document)',
+    'INSERT INTO backend_search (id, document, "publishedAt") '
+    "SELECT 2 * id, setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', body), 'D'), "
+    '"publishedAt" FROM backend_bulletin',
+    'INSERT INTO backend_search (id, document, "publishedAt") '
+    "SELECT 2 * id + 1, setweight(to_tsvector('simple', title), 'A'), \"publishedAt\" FROM backend_newsletter",
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for statement in POSTGRESQL:
+            schema_editor.execute(statement)
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(SQLITE[0])
+        except OperationalError:
+            return    # No FTS5 in this SQLite build; search falls back to LIKE queries.
+        for statement in SQLITE[1:]:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute('DROP TABLE IF EXISTS backend_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_agendaoccurrence'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
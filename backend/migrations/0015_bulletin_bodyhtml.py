@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 07:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulletin',
+            name='bodyHtml',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 07:41
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# The search index gets the school of every document, see backend/search.py. An FTS5 table can't be altered, so on
+# SQLite it's created anew.
+SQLITE = [
+    "DROP TABLE backend_search",
+    "CREATE VIRTUAL TABLE backend_search USING fts5(title, body, publishedAt UNINDEXED, school UNINDEXED)",
+    "INSERT INTO backend_search (rowid, title, body, publishedAt, school) "
+    "SELECT 2 * id, title, body, publishedAt, school_id FROM backend_bulletin",
+    "INSERT INTO backend_search (rowid, title, body, publishedAt, school) "
+    "SELECT 2 * id + 1, title, '', publishedAt, school_id FROM backend_newsletter",
+]
+POSTGRESQL = [
+    'ALTER TABLE backend_search ADD COLUMN school integer NOT NULL DEFAULT 1',
+    'ALTER TABLE backend_search ALTER COLUMN school DROP DEFAULT',
+]
+
+
+def create_first_school(apps, schema_editor):
+    # Everything that exists already is of this school, the one with primary key 1 that the new columns default to.
+    School = apps.get_model('backend', 'School')
+    School.objects.create(slug='sebastiaanschool', name='Sebastiaanschool')
+
+
+def enroll_existing_users(apps, schema_editor):
+    Enrollment = apps.get_model('backend', 'Enrollment')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    quote = schema_editor.connection.ops.quote_name
+    schema_editor.execute('INSERT INTO {enrollment} ({user_id}, {school_id}) SELECT {id}, 1 FROM {user}'.format(
+        enrollment=quote(Enrollment._meta.db_table), user=quote(User._meta.db_table), user_id=quote('user_id'),
+        school_id=quote('school_id'), id=quote('id')))
+
+
+def has_search_table(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'backend_search'")
+        return cursor.fetchone() is not None
+
+
+def add_school_to_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        statements = POSTGRESQL
+    elif vendor == 'sqlite':
+        if not has_search_table(schema_editor):
+            return    # No FTS5 in this SQLite build, so no index.
+        statements = SQLITE
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def remove_school_from_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE backend_search DROP COLUMN school')
+    elif vendor == 'sqlite':
+        if not has_search_table(schema_editor):
+            return
+        schema_editor.execute(SQLITE[0])
+        schema_editor.execute("CREATE VIRTUAL TABLE backend_search USING fts5(title, body, publishedAt UNINDEXED)")
+        for statement in SQLITE[2:]:
+            schema_editor.execute(statement.replace(', school)', ')').replace(', school_id FROM', ' FROM'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('backend', '0016_publishedat_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='School',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(help_text='Identifies the school in the X-School header.', unique=True)),
+                ('name', models.CharField(max_length=140)),
+                ('host', models.CharField(blank=True, help_text='Host name whose requests are for this school, e.g. api.sebastiaanschool.nl', max_length=253, null=True, unique=True)),
+            ],
+        ),
+        migrations.RunPython(create_first_school, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='Enrollment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('school', models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, to='backend.School')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='enrollment', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='agendaitem',
+            name='school',
+            field=models.ForeignKey(db_index=False, default=1, on_delete=django.db.models.deletion.CASCADE, to='backend.School'),
+        ),
+        migrations.AddField(
+            model_name='agendaoccurrence',
+            name='school',
+            field=models.ForeignKey(db_index=False, default=1, on_delete=django.db.models.deletion.CASCADE, to='backend.School'),
+        ),
+        migrations.AddField(
+            model_name='bulletin',
+            name='school',
+            field=models.ForeignKey(db_index=False, default=1, on_delete=django.db.models.deletion.CASCADE, to='backend.School'),
+        ),
+        migrations.AddField(
+            model_name='contactitem',
+            name='school',
+            field=models.ForeignKey(db_index=False, default=1, on_delete=django.db.models.deletion.CASCADE, to='backend.School'),
+        ),
+        migrations.AddField(
+            model_name='newsletter',
+            name='school',
+            field=models.ForeignKey(db_index=False, default=1, on_delete=django.db.models.deletion.CASCADE, to='backend.School'),
+        ),
+        migrations.AlterIndexTogether(
+            name='agendaitem',
+            index_together=set([('school', 'end', 'start')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='agendaoccurrence',
+            index_together=set([('school', 'end', 'start')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='bulletin',
+            index_together=set([('school', 'publishedAt')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='contactitem',
+            index_together=set([('school', 'order')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='newsletter',
+            index_together=set([('school', 'publishedAt')]),
+        ),
+        migrations.RunPython(enroll_existing_users, migrations.RunPython.noop),
+        migrations.RunPython(add_school_to_search_index, remove_school_from_search_index),
+    ]
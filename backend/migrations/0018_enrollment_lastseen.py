@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 07:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0017_school'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enrollment',
+            name='lastSeen',
+            field=models.DateTimeField(blank=True, help_text='When the device last called the API, give or take a minute.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='enrollment',
+            name='school',
+            field=models.ForeignKey(db_index=False, default=1, on_delete=django.db.models.deletion.CASCADE, to='backend.School'),
+        ),
+        migrations.AlterIndexTogether(
+            name='enrollment',
+            index_together=set([('school', 'lastSeen')]),
+        ),
+    ]
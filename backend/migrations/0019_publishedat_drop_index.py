@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 09:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0018_enrollment_lastseen'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bulletin',
+            name='publishedAt',
+            field=models.DateTimeField(),
+        ),
+        migrations.AlterField(
+            model_name='newsletter',
+            name='publishedAt',
+            field=models.DateTimeField(),
+        ),
+    ]
@@ -1,42 +1,121 @@
 from __future__ import unicode_literals
 
+import markdown
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.http.request import validate_host
 from django.utils.encoding import python_2_unicode_compatible
 
+from backend import recurrence
+
+
+def render_markdown(text):
+    """
+    HTML of a Markdown text. Raw HTML in the text is passed through, so only use this for text written by staff.
+    """
+    return markdown.markdown(text, output_format='html5')
+
+
+# The school that all content belonged to before there were several, created by migration 0017.
+DEFAULT_SCHOOL_ID = 1
+
+
+@python_2_unicode_compatible
+class School(models.Model):
+    """
+    One of the schools served by this backend, see `backend.tenancy`. All content belongs to exactly one school.
+    """
+    slug = models.SlugField(unique=True, help_text='Identifies the school in the X-School header.')
+    name = models.CharField(max_length=140)
+    host = models.CharField(max_length=253, unique=True, null=True, blank=True,
+                            help_text='Host name whose requests are for this school, e.g. api.sebastiaanschool.nl')
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        # Django refuses requests for hosts outside ALLOWED_HOSTS before they get to a school.
+        if self.host and not validate_host(self.host.lower(), settings.ALLOWED_HOSTS):
+            raise ValidationError({'host': 'Add this host to ALLOWED_HOSTS first, or its requests are refused.'})
+
+
+def school_field():
+    # Not indexed on its own: the tables that have one lead their composite indexes with it.
+    return models.ForeignKey(School, on_delete=models.CASCADE, default=DEFAULT_SCHOOL_ID, db_index=False)
+
 
 class Publication(models.Model):
+    school = school_field()
     title = models.CharField(max_length=140)
     publishedAt = models.DateTimeField()
 
     class Meta:
         abstract = True
         ordering = ['-publishedAt']
+        # Every list is of one school; its publications are a range of this index.
+        index_together = [('school', 'publishedAt')]
 
 
 @python_2_unicode_compatible
 class AgendaItem(models.Model):
+    school = school_field()
     title = models.CharField(max_length=140)
     type = models.CharField(max_length=140)
     start = models.DateTimeField()
     end = models.DateTimeField()
+    recurrence = models.CharField(max_length=200, blank=True, default='', validators=[recurrence.validate],
+                                  help_text='iCalendar RRULE, e.g. FREQ=WEEKLY;BYDAY=MO,TH or FREQ=MONTHLY;BYDAY=1FR')
+    # Up to when occurrences have been materialized, see `backend.expansion`. Null until the first expansion.
+    expandedUntil = models.DateTimeField(null=True, editable=False)
 
     def __str__(self):
         return self.title
 
     class Meta:
         ordering = ['-start']
+        index_together = [('school', 'end', 'start')]
+
+
+@python_2_unicode_compatible
+class AgendaOccurrence(models.Model):
+    """
+    One occurrence of an agenda item. Single items have one, recurring items one per repetition.
+    """
+    item = models.ForeignKey(AgendaItem, on_delete=models.CASCADE, related_name='occurrences')
+    # The school of the item, copied so range queries on one school's agenda need no join.
+    school = school_field()
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+
+    def __str__(self):
+        return '%s %s' % (self.item, self.start)
+
+    class Meta:
+        ordering = ['-start']
+        index_together = [('school', 'end', 'start')]
 
 
 @python_2_unicode_compatible
 class Bulletin(Publication):
     body = models.TextField()
+    # `body` rendered from Markdown on every save, so clients don't have to render it on each view.
+    bodyHtml = models.TextField(blank=True, default='', editable=False)
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.render_body()
+        super(Bulletin, self).save(*args, **kwargs)
+
+    def render_body(self):
+        self.bodyHtml = render_markdown(self.body)
+
 
 @python_2_unicode_compatible
 class ContactItem(models.Model):
+    school = school_field()
     displayName = models.CharField(max_length=140)
     email = models.CharField(max_length=500)
     order = models.IntegerField()
@@ -47,6 +126,7 @@ class ContactItem(models.Model):
 
     class Meta:
         ordering = ['order']
+        index_together = [('school', 'order')]
 
 
 @python_2_unicode_compatible
@@ -64,6 +144,7 @@ class TimelineItem(Publication):
     """
     type = models.TextField(max_length=10)
     body = models.TextField(null=True)
+    bodyHtml = models.TextField(null=True)
     documentUrl = models.CharField(max_length=500, null=True)
 
     def __str__(self):
@@ -71,3 +152,35 @@ class TimelineItem(Publication):
 
     class Meta:
         managed = False    # This model class has no table of its own.
+
+
+@python_2_unicode_compatible
+class Enrollment(models.Model):
+    """
+    The school a user belongs to: for a self-enrolled device, the one whose pushes it gets; for staff, the one whose
+    content they may edit. Superusers may edit the content of every school.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='enrollment')
+    school = school_field()
+    lastSeen = models.DateTimeField(null=True, blank=True,
+                                    help_text='When the device last called the API, give or take a minute.')
+
+    class Meta:
+        # Push fan-out and purges pick a school's devices by when they were last seen, see backend/presence.py.
+        index_together = [('school', 'lastSeen')]
+
+    def __str__(self):
+        return '%s %s' % (self.user, self.school)
+
+
+@python_2_unicode_compatible
+class TableVersion(models.Model):
+    """
+    A random token that is replaced whenever a row of one school in the named table is saved or deleted, see
+    `backend.cache`. `table` is the table name and the school's primary key.
+    """
+    table = models.CharField(max_length=100, primary_key=True)
+    token = models.CharField(max_length=32)
+
+    def __str__(self):
+        return '%s %s' % (self.table, self.token)
@@ -0,0 +1,88 @@
+"""
+When each enrolled device last called the API, so push fan-out and purges can tell active devices from abandoned ones.
+
+Requests don't write it. `seen()` adds the user to a set in memory, and `maybe_flush()`, called after every response,
+writes that set in batched UPDATEs once FLUSH_INTERVAL seconds have passed since the previous write. A user written
+by this process less than RESOLUTION seconds ago isn't added again, so a device that keeps polling costs one row update
+per RESOLUTION. `lastSeen` is therefore accurate to about a minute, and what a process has buffered when it's killed
+is lost.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+from timeit import default_timer
+
+from django.db import DatabaseError
+from django.utils import timezone
+
+from backend.models import Enrollment
+
+FLUSH_INTERVAL = 5    # seconds
+RESOLUTION = 60    # seconds
+BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pending = set()
+_written = {}
+_last_flush = [0]
+
+
+def seen(user_id):
+    with _lock:
+        written = _written.get(user_id)
+        if written is None or default_timer() - written >= RESOLUTION:
+            _pending.add(user_id)
+
+
+def maybe_flush():
+    """
+    Writes the buffered users if the last write was more than FLUSH_INTERVAL seconds ago. A failed write is logged
+    rather than failing the request it happens in.
+    """
+    if _pending and default_timer() - _last_flush[0] >= FLUSH_INTERVAL:
+        try:
+            flush()
+        except DatabaseError:
+            logger.exception('Writing when devices were last seen failed')
+
+
+def flush(now=None):
+    """
+    Sets `lastSeen` of the enrollments of the buffered users to `now`, by default the current time. Returns their
+    number.
+    """
+    now = now or timezone.now()
+    with _lock:
+        users = sorted(_pending)
+        _pending.clear()
+        _last_flush[0] = clock = default_timer()
+        for user_id in users:
+            _written[user_id] = clock
+        # Only those written within RESOLUTION are skipped, so the rest needn't be remembered.
+        for user_id, written in list(_written.items()):
+            if clock - written >= RESOLUTION:
+                del _written[user_id]
+    for start in range(0, len(users), BATCH_SIZE):
+        Enrollment.objects.filter(user__in=users[start:start + BATCH_SIZE]).update(lastSeen=now)
+    return len(users)
+
+
+def forget():
+    """
+    Drops what's buffered and starts a new FLUSH_INTERVAL, like after a write.
+    """
+    with _lock:
+        _pending.clear()
+        _written.clear()
+        _last_flush[0] = default_timer()
+
+
+def active_users(school_id, since):
+    """
+    Primary keys of the users of a school's enrolled devices that were seen since `since`, e.g. to send a push message
+    to. A range scan of the (school, lastSeen) index.
+    """
+    return Enrollment.objects.filter(school=school_id, lastSeen__gte=since).values_list('user', flat=True)
@@ -0,0 +1,193 @@
+"""
+Profiles of individual requests, written to `settings.PROFILE_DIR` for later inspection.
+
+One in every `PROFILE_SAMPLE_RATE` requests runs under cProfile. All other requests are watched by a stack sampler
+thread, which is cheap enough to leave on; its samples are only kept when the request turns out slower than
+`PROFILE_SLOW_REQUEST_SECONDS`. Either way the file also holds the route and, unless `settings.METRICS_SQL` is off,
+the SQL queries of the request.
+
+The sampler finds a request's stack by the thread it runs in. Under gevent (sebastiaanschool/gevent_wsgi.py) all
+requests share one thread, so there are no slow-request profiles there; the cProfile samples then also count the
+time spent in other requests' greenlets while the profiled one waits.
+"""
+from __future__ import division, unicode_literals
+
+import atexit
+import errno
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+SAMPLE_INTERVAL = 0.01    # seconds between stack samples
+MAX_STACK_DEPTH = 100
+
+
+def greenlets():
+    """
+    Whether gevent has replaced the threads of this process by greenlets.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+class StackSampler(object):
+    """
+    Background thread that periodically records the call stack of every registered thread.
+
+    The thread sleeps while no request is registered.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid = None
+        self.stopping = False
+        atexit.register(self.shutdown)
+
+    def start(self, ident):
+        with self.lock:
+            self.samples[ident] = Counter()
+            if self.pid != os.getpid():
+                # First use in this (possibly forked) process: threads don't survive a fork.
+                self.pid = os.getpid()
+                thread = threading.Thread(target=self.run, name='stack-sampler')
+                thread.daemon = True
+                thread.start()
+        self.wakeup.set()
+
+    def stop(self, ident):
+        with self.lock:
+            samples = self.samples.pop(ident, Counter())
+            if not self.samples:
+                self.wakeup.clear()
+        return samples
+
+    def shutdown(self):
+        # Python 2 tears down modules under running daemon threads, so ask the thread to finish first.
+        self.stopping = True
+        self.wakeup.set()
+
+    def run(self):
+        current_frames, sleep = sys._current_frames, time.sleep
+        while True:
+            self.wakeup.wait()
+            if self.stopping:
+                return
+            sleep(self.interval)
+            frames = current_frames()
+            with self.lock:
+                for ident, samples in self.samples.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[collapse(frame)] += 1
+            del frames
+
+
+def collapse(frame):
+    """
+    Formats a stack as `outermost;...;innermost`, the input format of flame graph tools.
+    """
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append('%s:%s:%d' % (os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def format_cprofile(profiler, limit=60):
+    """
+    The top of a cProfile run, by cumulative time, as text.
+    """
+    stream = io.BytesIO() if sys.version_info[0] == 2 else io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(limit)
+    value = stream.getvalue()
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else value
+
+
+def format_samples(samples, interval=SAMPLE_INTERVAL):
+    """
+    Collapsed stacks with their sample counts, most frequent first.
+    """
+    lines = ['# %d samples, one every %d ms' % (sum(samples.values()), interval * 1000)]
+    lines.extend('%s %d' % (stack, count) for stack, count in samples.most_common())
+    return '\n'.join(lines)
+
+
+def save(request, response, elapsed, kind, profile, queries):
+    """
+    Writes a profile of `request` and removes the oldest ones beyond `settings.PROFILE_KEEP`.
+    """
+    directory = _directory()
+    now = time.time()
+    match = getattr(request, 'resolver_match', None)
+    name = '%d-%d-%d.json' % (now * 1000, os.getpid(), threading.current_thread().ident)
+    data = {
+        'name': name[:-len('.json')],
+        'timestamp': now,
+        'kind': kind,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'route': (match.url_name or match.view_name) if match else None,
+        'status': response.status_code,
+        'elapsed': elapsed,
+        'queries': queries,
+        'profile': profile,
+    }
+    with open(os.path.join(directory, name), 'w') as f:
+        json.dump(data, f)
+    for old in _names(directory)[settings.PROFILE_KEEP:]:
+        try:
+            os.remove(os.path.join(directory, old + '.json'))
+        except OSError:
+            pass    # Another worker pruned it first.
+
+
+def recent(limit=50):
+    """
+    Summaries of the most recent profiles, newest first.
+    """
+    summaries = []
+    for name in _names(_directory())[:limit]:
+        data = load(name)
+        if data is not None:
+            del data['profile'], data['queries']
+            summaries.append(data)
+    return summaries
+
+
+def load(name):
+    path = os.path.join(_directory(), os.path.basename(name) + '.json')
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _names(directory):
+    # Names start with a millisecond timestamp of equal length, so they sort chronologically.
+    return sorted((name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json')), reverse=True)
+
+
+def _directory():
+    directory = settings.PROFILE_DIR
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return directory
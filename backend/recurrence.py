@@ -0,0 +1,169 @@
+"""
+Recurrence rules for agenda items, in the RRULE syntax of iCalendar (RFC 5545), so they can go into the calendar feed
+unchanged.
+
+Supported is the subset a school agenda needs:
+
+- FREQ=DAILY, WEEKLY, MONTHLY or YEARLY, with INTERVAL, and COUNT or UNTIL.
+- BYDAY with weekdays for WEEKLY (`FREQ=WEEKLY;BYDAY=MO,TH`), and with weekdays, optionally numbered, for MONTHLY
+  (`FREQ=MONTHLY;BYDAY=1FR` is the first Friday of each month, `-1FR` the last one).
+
+The item's own start is always the first occurrence. Occurrences keep the item's local time of day across daylight
+saving time changes.
+"""
+from __future__ import unicode_literals
+
+import calendar
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+
+Rule = namedtuple('Rule', 'freq interval count until byday')
+
+
+def parse(text):
+    """
+    Parses an RRULE value into a `Rule`. Raises ValueError when it's malformed or outside the supported subset.
+    """
+    parts = {}
+    for part in text.strip().upper().split(';'):
+        name, separator, value = part.partition('=')
+        if not separator or not value or name in parts:
+            raise ValueError('Expected NAME=VALUE pairs separated by ";", got "%s".' % text)
+        parts[name] = value
+    freq = parts.pop('FREQ', None)
+    if freq not in FREQUENCIES:
+        raise ValueError('FREQ must be one of %s.' % ', '.join(FREQUENCIES))
+    interval = _positive_int(parts.pop('INTERVAL', '1'), 'INTERVAL')
+    count = _positive_int(parts.pop('COUNT'), 'COUNT') if 'COUNT' in parts else None
+    until = _until(parts.pop('UNTIL')) if 'UNTIL' in parts else None
+    if count and until:
+        raise ValueError('Use either COUNT or UNTIL, not both.')
+    byday = tuple(_weekday(value, freq) for value in parts.pop('BYDAY').split(',')) if 'BYDAY' in parts else ()
+    if byday and freq not in ('WEEKLY', 'MONTHLY'):
+        raise ValueError('BYDAY is only supported with FREQ=WEEKLY or FREQ=MONTHLY.')
+    if parts:
+        raise ValueError('Unsupported: %s.' % ', '.join(sorted(parts)))
+    return Rule(freq, interval, count, until, byday)
+
+
+def validate(text):
+    """
+    Model field validator: accepts an empty value or a supported rule.
+    """
+    if text:
+        try:
+            parse(text)
+        except ValueError as e:
+            raise ValidationError('Invalid recurrence rule: %s' % e)
+
+
+def occurrences(start, end, text, horizon):
+    """
+    Yields (start, end) of every occurrence of an item from `start` to `end` that repeats by rule `text`, in order,
+    for occurrences that start before `horizon`.
+    """
+    rule = parse(text)
+    tz = timezone.get_current_timezone()
+    first = timezone.localtime(start, tz).replace(tzinfo=None)
+    duration = timezone.localtime(end, tz).replace(tzinfo=None) - first
+    limit = timezone.localtime(horizon, tz).replace(tzinfo=None)
+    if rule.until:
+        limit = min(limit, timezone.localtime(rule.until, tz).replace(tzinfo=None) + timedelta(microseconds=1))
+    count = 0
+    for moment in _starts(first, rule, limit):
+        if moment >= limit or (rule.count and count == rule.count):
+            return
+        count += 1
+        yield timezone.make_aware(moment, tz, is_dst=False), timezone.make_aware(moment + duration, tz, is_dst=False)
+
+
+def _starts(first, rule, limit):
+    yield first
+    for moment in _candidates(first, rule, limit):
+        if moment > first:
+            yield moment
+
+
+def _candidates(first, rule, limit):
+    """
+    Moments matching the rule, in order, from the period (day, week, month or year) that contains `first` up to the
+    one that contains `limit`.
+    """
+    period = 0
+    while True:
+        if rule.freq == 'DAILY':
+            period_start = first + timedelta(days=period * rule.interval)
+            moments = [period_start]
+        elif rule.freq == 'WEEKLY':
+            period_start = first - timedelta(days=first.weekday()) + timedelta(weeks=period * rule.interval)
+            weekdays = sorted(weekday for _, weekday in rule.byday) or [first.weekday()]
+            moments = [period_start + timedelta(days=weekday) for weekday in weekdays]
+        elif rule.freq == 'MONTHLY':
+            year, month = divmod(first.month - 1 + period * rule.interval, 12)
+            period_start = datetime(first.year + year, month + 1, 1)
+            moments = _month(first, period_start.year, period_start.month, rule.byday)
+        else:
+            period_start = datetime(first.year + period * rule.interval, 1, 1)
+            moments = _month(first, period_start.year, first.month, ())
+        if period_start >= limit:
+            return
+        for moment in moments:
+            yield moment
+        period += 1
+
+
+def _month(first, year, month, byday):
+    days_in_month = calendar.monthrange(year, month)[1]
+    if not byday:
+        # Months without this day, like the 31st in April, are skipped.
+        return [first.replace(year=year, month=month, day=first.day)] if first.day <= days_in_month else []
+    days = set()
+    for ordinal, weekday in byday:
+        matching = [day for day in range(1, days_in_month + 1) if calendar.weekday(year, month, day) == weekday]
+        if ordinal is None:
+            days.update(matching)
+        elif abs(ordinal) <= len(matching):
+            days.add(matching[ordinal - 1 if ordinal > 0 else ordinal])
+    return [first.replace(year=year, month=month, day=day) for day in sorted(days)]
+
+
+def _positive_int(value, name):
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError('%s must be a positive number.' % name)
+    return int(value)
+
+
+def _until(value):
+    for format in ('%Y%m%dT%H%M%SZ', '%Y%m%d'):
+        try:
+            moment = datetime.strptime(value, format)
+        except ValueError:
+            continue
+        if format.endswith('Z'):
+            return timezone.make_aware(moment, timezone.utc)
+        # A date means up to and including that day, in local time.
+        return timezone.make_aware(moment + timedelta(days=1) - timedelta(microseconds=1), is_dst=False)
+    raise ValueError('UNTIL must be a date (YYYYMMDD) or a UTC date-time (YYYYMMDDTHHMMSSZ).')
+
+
+def _weekday(value, freq):
+    ordinal, weekday = value[:-2], value[-2:]
+    if weekday not in WEEKDAYS:
+        raise ValueError('BYDAY takes weekdays like MO or 1FR, got "%s".' % value)
+    if not ordinal:
+        return None, WEEKDAYS.index(weekday)
+    if freq != 'MONTHLY':
+        raise ValueError('Numbered weekdays like "%s" need FREQ=MONTHLY.' % value)
+    try:
+        number = int(ordinal)
+    except ValueError:
+        number = 0
+    if not 1 <= abs(number) <= 5:
+        raise ValueError('BYDAY takes weekdays like MO or 1FR, got "%s".' % value)
+    return number, WEEKDAYS.index(weekday)
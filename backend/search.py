@@ -0,0 +1,186 @@
+"""
+Full-text search over bulletins (title and body) and newsletters (title).
+
+The index is the `backend_search` table, created by migration 0014: an FTS5 virtual table on SQLite and a table with
+a GIN-indexed tsvector on PostgreSQL. Model signals update it on every save and delete, so it's never rebuilt.
+Documents are keyed by `2 * id` for bulletins and `2 * id + 1` for newsletters, and carry their school, as every
+search is within one school. Title matches weigh more than body matches.
+
+Other databases, and SQLite builds without FTS5, fall back to unranked, unindexed LIKE queries.
+"""
+from __future__ import unicode_literals
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+
+from backend.models import Bulletin, Newsletter
+
+TABLE = 'backend_search'
+MAX_TERMS = 8
+TITLE_WEIGHT = 10.0
+INDEXED_MODELS = (Bulletin, Newsletter)
+TSVECTOR = "setweight(to_tsvector('simple', {title}), 'A') || setweight(to_tsvector('simple', {body}), 'D')"
+
+_fts5 = {}
+
+
+def track():
+    for model in INDEXED_MODELS:
+        post_save.connect(_index_on_save, sender=model, dispatch_uid='search-index')
+        post_delete.connect(_unindex_on_delete, sender=model, dispatch_uid='search-index')
+
+
+def terms(query):
+    """
+    The words of a query, lowercased, at most MAX_TERMS. Everything but letters and digits is dropped, so the
+    result is safe to put in a full-text query.
+    """
+    return [word.lower() for word in re.findall(r'\w+', query, re.UNICODE)][:MAX_TERMS]
+
+
+def search(school_id, query, published_before, offset, limit):
+    """
+    (model, id) of documents of a school that contain all words of `query`, each as a word or word prefix, best
+    matches first. Only returns publications from before `published_before`.
+    """
+    words = terms(query)
+    if not words:
+        return []
+    adapted_before = connection.ops.adapt_datetimefield_value(published_before)
+    if connection.vendor == 'postgresql':
+        tsquery = ' & '.join('%s:*' % word for word in words)
+        sql = ('SELECT id FROM {table} WHERE document @@ to_tsquery(\'simple\', %s) AND "publishedAt" < %s '
+               'AND school = %s ORDER BY ts_rank(document, to_tsquery(\'simple\', %s)) DESC, id DESC '
+               'LIMIT %s OFFSET %s')
+        params = [tsquery, adapted_before, school_id, tsquery, limit, offset]
+    elif _has_fts5():
+        match = ' '.join('"%s"*' % word for word in words)
+        sql = ('SELECT rowid FROM {table} WHERE {table} MATCH %s AND publishedAt < %s AND school = %s '
+               'ORDER BY bm25({table}, %s, 1.0), rowid DESC LIMIT %s OFFSET %s')
+        params = [match, adapted_before, school_id, TITLE_WEIGHT, limit, offset]
+    else:
+        return _search_unindexed(school_id, words, published_before, offset, limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(table=TABLE), params)
+        return [_document(key) for key, in cursor.fetchall()]
+
+
+def index(instance):
+    """
+    Adds or replaces the document of a bulletin or newsletter.
+    """
+    key = _key(instance)
+    body = getattr(instance, 'body', '')
+    published_at = connection.ops.adapt_datetimefield_value(instance.publishedAt)
+    if connection.vendor == 'postgresql':
+        sql = ('INSERT INTO {table} (id, document, "publishedAt", school) VALUES (%s, ' +
+               TSVECTOR.format(title='%s', body='%s') + ', %s, %s) '
+               'ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document, "publishedAt" = EXCLUDED."publishedAt", '
+               'school = EXCLUDED.school')
+        params = [key, instance.title, body, published_at, instance.school_id]
+    elif _has_fts5():
+        unindex(instance)
+        sql = 'INSERT INTO {table} (rowid, title, body, publishedAt, school) VALUES (%s, %s, %s, %s, %s)'
+        params = [key, instance.title, body, published_at, instance.school_id]
+    else:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(table=TABLE), params)
+
+
+def unindex(instance):
+    if connection.vendor == 'postgresql' or _has_fts5():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {table} WHERE {key} = %s'.format(
+                table=TABLE, key='id' if connection.vendor == 'postgresql' else 'rowid'), [_key(instance)])
+
+
+def index_missing(model, ids=None):
+    """
+    Indexes the rows of `model` that have no document yet, like rows inserted with raw SQL, or only those of them with
+    primary keys `ids`. Returns their number.
+    """
+    quote = connection.ops.quote_name
+    columns = dict(table=quote(model._meta.db_table), parity=INDEXED_MODELS.index(model), title=quote('title'),
+                   body=quote('body') if model is Bulletin else "''", published_at=quote('publishedAt'),
+                   school=quote('school_id'))
+    if connection.vendor == 'postgresql':
+        sql = ('INSERT INTO {search} (id, document, "publishedAt", school) '
+               'SELECT 2 * id + {parity}, ' + TSVECTOR + ', {published_at}, {school} FROM {table} {where} '
+               'ON CONFLICT (id) DO NOTHING')
+        where = 'WHERE id IN ({ids})'
+    elif _has_fts5():
+        sql = ('INSERT INTO {search} (rowid, title, body, publishedAt, school) '
+               'SELECT 2 * id + {parity}, {title}, {body}, {published_at}, {school} FROM {table} '
+               'WHERE NOT EXISTS (SELECT 1 FROM {search} WHERE rowid = 2 * {table}.id + {parity}) {where}')
+        where = 'AND id IN ({ids})'
+    else:
+        return 0
+    if ids is None:
+        where, ids = '', []
+    elif not ids:
+        return 0
+    else:
+        where = where.format(ids=', '.join(['%s'] * len(ids)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(search=TABLE, where=where, **columns), list(ids))
+        return cursor.rowcount
+
+
+def reindex(model, ids):
+    """
+    Replaces the documents of the rows of `model` with primary keys `ids`, like after a bulk update.
+    """
+    if not ids or not (connection.vendor == 'postgresql' or _has_fts5()):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {table} WHERE {key} IN ({keys})'.format(
+            table=TABLE, key='id' if connection.vendor == 'postgresql' else 'rowid', keys=', '.join(['%s'] * len(ids))),
+            [2 * pk + INDEXED_MODELS.index(model) for pk in ids])
+    index_missing(model, ids)
+
+
+def _has_fts5():
+    # Migration 0014 only creates the table when this SQLite build has FTS5.
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts5:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [TABLE])
+            _fts5[name] = cursor.fetchone() is not None
+    return _fts5[name]
+
+
+def _key(instance):
+    return 2 * instance.pk + INDEXED_MODELS.index(type(instance))
+
+
+def _document(key):
+    return INDEXED_MODELS[key % 2], key // 2
+
+
+def _search_unindexed(school_id, words, published_before, offset, limit):
+    results = []
+    for model in INDEXED_MODELS:
+        selection = model.objects.filter(school=school_id, publishedAt__lt=published_before)
+        for word in words:
+            if model is Bulletin:
+                selection = selection.filter(Q(title__icontains=word) | Q(body__icontains=word))
+            else:
+                selection = selection.filter(title__icontains=word)
+        results.extend((model, pk, published_at) for pk, published_at in
+                       selection.values_list('pk', 'publishedAt')[:offset + limit])
+    results.sort(key=lambda result: result[2], reverse=True)
+    return [(model, pk) for model, pk, _ in results[offset:offset + limit]]
+
+
+def _index_on_save(sender, instance, **kwargs):
+    index(instance)
+
+
+def _unindex_on_delete(sender, instance, **kwargs):
+    unindex(instance)
@@ -1,14 +1,55 @@
 from rest_framework import serializers
-from backend.models import AgendaItem, Bulletin, ContactItem, Newsletter
+from rest_framework.exceptions import ParseError
+from backend.models import AgendaItem, AgendaOccurrence, Bulletin, ContactItem, Newsletter
 from django.contrib.auth import get_user_model
 
 class AgendaItemSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = AgendaItem
-        fields = ('title', 'type', 'start', 'end', 'url')
+        fields = ('title', 'type', 'start', 'end', 'recurrence', 'url')
+
+
+class AgendaOccurrenceSerializer(serializers.ModelSerializer):
+    """
+    An occurrence, shaped like its agenda item but with the start and end of this occurrence.
+    """
+    title = serializers.CharField(source='item.title', read_only=True)
+    type = serializers.CharField(source='item.type', read_only=True)
+    recurrence = serializers.CharField(source='item.recurrence', read_only=True)
+    url = serializers.HyperlinkedRelatedField(source='item', view_name='agendaitem-detail', read_only=True)
+
+    class Meta:
+        model = AgendaOccurrence
+        fields = ('title', 'type', 'start', 'end', 'recurrence', 'url')
+
+
+BODY_FORMATS = ('markdown', 'html')
+
+
+def body_format(request):
+    """
+    The body format asked for with `?body_format=`, 'markdown' by default.
+    """
+    value = request.query_params.get('body_format', 'markdown') if request else 'markdown'
+    if value not in BODY_FORMATS:
+        raise ParseError('body_format must be one of %s.' % ', '.join(BODY_FORMATS))
+    return value
+
+
+class BodyField(serializers.CharField):
+    """
+    The Markdown source of a bulletin, or its pre-rendered HTML when the request has `?body_format=html`.
+    """
+
+    def get_attribute(self, instance):
+        if body_format(self.context.get('request')) == 'html':
+            return instance.bodyHtml
+        return super(BodyField, self).get_attribute(instance)
 
 
 class BulletinSerializer(serializers.HyperlinkedModelSerializer):
+    body = BodyField(style={'base_template': 'textarea.html'})
+
     class Meta:
         model = Bulletin
         fields = ('title', 'body', 'publishedAt', 'url')
@@ -20,6 +61,31 @@ class ContactItemSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('displayName', 'email', 'order', 'detailText', 'url')
 
 
+class PrimaryKeyFromUrl(serializers.HyperlinkedRelatedField):
+    """
+    The primary key of the object a URL points to, without fetching the object.
+    """
+
+    def get_object(self, view_name, view_args, view_kwargs):
+        return int(view_kwargs[self.lookup_url_kwarg])
+
+
+class ContactItemOrderSerializer(serializers.Serializer):
+    """
+    A new ordering of all contact items of the school of the request: their URLs, first one first.
+    """
+    contactItems = serializers.ListField(child=PrimaryKeyFromUrl(view_name='contactitem-detail',
+                                                                 queryset=ContactItem.objects.all()))
+
+    def validate_contactItems(self, value):
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError('Contains a contact item more than once.')
+        school = self.context['request'].school
+        if set(value) != set(ContactItem.objects.filter(school=school).values_list('pk', flat=True)):
+            raise serializers.ValidationError('Must list every contact item.')
+        return value
+
+
 class NewsletterSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Newsletter
@@ -30,7 +96,7 @@ class TimelineSerializer(serializers.Serializer):
     url = serializers.SerializerMethodField()
     type = serializers.CharField()
     title = serializers.CharField()
-    body = serializers.CharField(allow_blank=True)
+    body = BodyField(allow_blank=True)
     documentUrl = serializers.CharField(allow_blank=True)
     publishedAt = serializers.DateTimeField()
 
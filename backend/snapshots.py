@@ -0,0 +1,121 @@
+"""
+Last good copies of the public list responses, to serve while the database is down.
+
+After every successful anonymous GET of one of SNAPSHOT_ROUTES, SnapshotMiddleware saves the response to a file in
+`settings.SNAPSHOT_DIR`: one per host, X-School header, path and body format. It only writes when the content differs
+from what this process saved last. When a view fails because the database can't be reached, a GET gets the snapshot
+of its URL, marked stale with `Age` and `Warning: 110` headers. Other requests get a 503 with Retry-After.
+
+Only URLs without other query parameters than QUERY_PARAMS get snapshots, so their number stays small. Pages of the
+browsable API get none either, as they carry a CSRF token of their own.
+"""
+from __future__ import unicode_literals
+
+import errno
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from hashlib import sha1
+
+from django.conf import settings
+from django.http import HttpResponse
+
+SNAPSHOT_ROUTES = ('agendaitem-list', 'bulletin-list', 'contactitem-list', 'newsletter-list', 'timelineitem-list',
+                   'bootstrap', 'agenda-feed')
+QUERY_PARAMS = ('body_format',)
+RETRY_AFTER = 30    # seconds
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_saved = {}
+
+
+def keep(request, response):
+    """
+    Whether `response` should be saved as the snapshot of `request`.
+    """
+    match = getattr(request, 'resolver_match', None)
+    return (match is not None and match.url_name in SNAPSHOT_ROUTES and response.status_code == 200 and
+            not response.streaming and not response.has_header('Warning') and
+            not response.get('Content-Type', '').startswith('text/html') and _path(request) is not None and
+            not request.user.is_authenticated)
+
+
+def save(request, response):
+    """
+    Writes `response` as the snapshot of `request`. A failed write is logged rather than failing the request.
+    """
+    path = _path(request)
+    digest = sha1(response.content).hexdigest()
+    with _lock:
+        if _saved.get(path) == digest:
+            return
+        _saved[path] = digest
+    try:
+        _write(path, response)
+    except (IOError, OSError):
+        logger.exception('Saving a snapshot of %s failed', request.path_info)
+        with _lock:
+            _saved.pop(path, None)
+
+
+def load(request, now=None):
+    """
+    The snapshot of `request` as a stale response, or None when there's none.
+    """
+    path = _path(request)
+    if path is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            meta = json.loads(f.readline().decode('utf-8'))
+            content = f.read()
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    response = HttpResponse(content, content_type=meta['contentType'])
+    response['Age'] = '%d' % max((now or time.time()) - meta['savedAt'], 0)
+    response['Warning'] = '110 - "Response is Stale"'
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def unavailable():
+    response = HttpResponse(json.dumps({'detail': 'The database is unavailable, try again later.'}), status=503,
+                            content_type='application/json')
+    response['Retry-After'] = '%d' % RETRY_AFTER
+    return response
+
+
+def _path(request):
+    if request.method not in ('GET', 'HEAD') or any(name not in QUERY_PARAMS for name in request.GET):
+        return None
+    if 'text/html' in request.META.get('HTTP_ACCEPT', ''):
+        return None
+    url = ' '.join([request.get_host().lower(), request.META.get('HTTP_X_SCHOOL', ''), request.path_info,
+                    request.GET.get('body_format', '')])
+    return os.path.join(settings.SNAPSHOT_DIR, sha1(url.encode('utf-8')).hexdigest())
+
+
+def _write(path, response):
+    try:
+        os.makedirs(settings.SNAPSHOT_DIR)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    # Write-then-rename, so readers never see half a file.
+    fd, temporary = tempfile.mkstemp(dir=settings.SNAPSHOT_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps({'contentType': response['Content-Type'], 'savedAt': time.time()}).encode('utf-8'))
+            f.write(b'\n')
+            f.write(response.content)
+        os.rename(temporary, path)
+    except Exception:
+        os.remove(temporary)
+        raise
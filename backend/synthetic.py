@@ -0,0 +1,216 @@
+"""
+Synthetic content for benchmarks and scale tests.
+
+Everything in here writes straight into the database with batched INSERTs, bypassing model instances and signals,
+so don't point it at production data.
+"""
+from __future__ import unicode_literals
+
+import random
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.db import connection, models, transaction
+from django.utils import timezone
+from push_notifications.models import APNSDevice, GCMDevice
+
+from backend import cache, expansion, search
+from backend.models import DEFAULT_SCHOOL_ID, AgendaItem, Bulletin, ContactItem, Enrollment, Newsletter
+
+# Used for every synthetic user, so the benchmark can log in as any of them.
+PASSWORD = 'synthetic-device-password'
+USERNAME_FORMAT = 'synthetic-device-%08d'
+USERNAME_PREFIX = 'synthetic-device-'
+
+BATCH_SIZE = 10000
+AGENDA_ITEM_FIELDS = ('title', 'type', 'start', 'end', 'recurrence')
+BULLETIN_FIELDS = ('title', 'body', 'bodyHtml', 'publishedAt')
+
+AGENDA_TYPES = ('Activiteit', 'Studiedag', 'Vakantie', 'Ouderavond', 'Excursie')
+GROUPS = ('Groep 1A en 2A', 'Groep 1B en 2B', 'Groep 3', 'Groep 4', 'Groep 5', 'Groep 6 en 7', 'Groep 8', 'ICT',
+          'Techniek', 'Locatiedirecteur')
+MONTHS = ('Januari', 'Februari', 'Maart', 'April', 'Mei', 'Juni', 'Juli', 'Augustus', 'September', 'Oktober',
+          'November', 'December')
+
+
+def seed(items, users=0, rng=None, contacts=None, school_id=DEFAULT_SCHOOL_ID):
+    """
+    Inserts `items` agenda items, bulletins and newsletters, `contacts` contacts (by default a school-sized list) and
+    `users` self-enrolled users that each have one push registration, all of the school with primary key `school_id`.
+    Returns the list of created usernames.
+    """
+    rng = rng or random.Random(0)
+    if contacts is None:
+        contacts = min(items, 50)
+    now = timezone.now()
+    insert(AgendaItem, AGENDA_ITEM_FIELDS, agenda_items(items, rng, now), school_id=school_id)
+    expansion.expand_all()
+    insert(Bulletin, BULLETIN_FIELDS, bulletins(items, rng, now), school_id=school_id)
+    insert(Newsletter, ('title', 'documentUrl', 'publishedAt'), newsletters(items, rng, now), school_id=school_id)
+    insert(ContactItem, ('displayName', 'email', 'order', 'detailText'), contact_items(contacts, rng),
+           school_id=school_id)
+    first = seed_users(users, rng, school_id=school_id)
+    return [USERNAME_FORMAT % i for i in range(first, first + users)]
+
+
+def insert(model, field_names, rows, batch_size=BATCH_SIZE, school_id=DEFAULT_SCHOOL_ID):
+    """
+    Inserts `rows`, an iterable of value tuples for `field_names`, into the table of `model`, with one executemany()
+    and one transaction per `batch_size` rows. Rows of models that belong to a school get school `school_id`, other
+    missing columns their field's default. Returns the number of rows inserted.
+    """
+    if 'school' not in field_names and any(field.name == 'school' for field in model._meta.concrete_fields):
+        field_names = tuple(field_names) + ('school',)
+        rows = (tuple(row) + (school_id,) for row in rows)
+    # Fill the other columns like a model instance would, as some are NOT NULL with only a Python default.
+    missing = [field for field in model._meta.concrete_fields
+               if field.name not in field_names and not isinstance(field, models.AutoField)]
+    if missing:
+        field_names = tuple(field_names) + tuple(field.name for field in missing)
+        rows = (tuple(row) + tuple(field.get_default() for field in missing) for row in rows)
+    fields = [model._meta.get_field(name) for name in field_names]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)))
+    datetimes = [i for i, field in enumerate(fields) if isinstance(field, models.DateTimeField)]
+    adapt = connection.ops.adapt_datetimefield_value
+    rows = iter(rows)
+    total = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            # No signals fire for raw INSERTs.
+            if total and model in cache.TRACKED_MODELS:
+                cache.bump(school_id, model)
+            if total and model in search.INDEXED_MODELS:
+                search.index_missing(model)
+            return total
+        if datetimes:
+            batch = [list(row) for row in batch]
+            for row in batch:
+                for i in datetimes:
+                    row[i] = adapt(row[i])
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, batch)
+        total += len(batch)
+
+
+def school_time(rng, earliest, latest):
+    """
+    A random moment during school hours on a weekday from `earliest` up to `latest`, outside the summer break.
+    """
+    days = max((latest - earliest).days, 1)
+    midnight = earliest.replace(hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(10):
+        day = midnight + timedelta(days=int(rng.random() * days))
+        summer_break = (day.month == 7 and day.day > 15) or (day.month == 8 and day.day < 25)
+        if day.weekday() < 5 and not summer_break:
+            break
+    return day + timedelta(seconds=7 * 3600 + int(rng.random() * 10 * 3600))
+
+
+def agenda_items(count, rng, now, years=5):
+    """
+    (title, type, start, end, recurrence) of mostly single day activities, some evening events, a few holidays lasting
+    one or two weeks and one in a thousand weekly lessons for a school year. A fifth of them lies in the coming year,
+    the rest in the past `years`. Their occurrences still need `expansion.expand_all()`.
+    """
+    for i in range(count):
+        if rng.random() < 0.2:
+            start = school_time(rng, now, now + timedelta(days=365))
+        else:
+            start = school_time(rng, now - timedelta(days=365 * years), now)
+        kind = rng.random()
+        if kind < 0.001:
+            end = start + timedelta(hours=1)
+            yield 'Gymles %d' % i, 'Les', start, end, 'FREQ=WEEKLY;COUNT=40'
+            continue
+        if kind < 0.7:
+            start = start.replace(hour=0, minute=0, second=0)
+            end = start
+            type = rng.choice(AGENDA_TYPES[:2])
+        elif kind < 0.95:
+            start = start.replace(hour=rng.randint(18, 20), minute=rng.choice((0, 30)), second=0)
+            end = start + timedelta(hours=rng.randint(1, 3))
+            type = rng.choice(AGENDA_TYPES[3:])
+        else:
+            start = start.replace(hour=0, minute=0, second=0)
+            end = start + timedelta(weeks=rng.randint(1, 2))
+            type = AGENDA_TYPES[2]
+        yield '%s %d' % (type, i), type, start, end, ''
+
+
+def bulletins(count, rng, now, years=5):
+    """
+    (title, body, bodyHtml, publishedAt) spread over school days in the past `years`, with one in a hundred scheduled
+    for the coming week. Bodies are a single paragraph of plain text, so their HTML is built directly: rendering
+    Markdown would dominate the insert time.
+    """
+    for i in range(count):
+        if rng.random() < 0.01:
+            published_at = school_time(rng, now, now + timedelta(days=7))
+        else:
+            published_at = school_time(rng, now - timedelta(days=365 * years), now)
+        body = 'Beste ouders, dit is bericht %d. ' % i * rng.randint(1, 20)
+        yield 'Bericht %d' % i, body, '<p>%s</p>' % body, published_at
+
+
+def newsletters(count, rng, now, years=5):
+    """
+    (title, documentUrl, publishedAt) on Friday afternoons in the past `years`.
+    """
+    for i in range(count):
+        published_at = school_time(rng, now - timedelta(days=365 * years), now)
+        published_at -= timedelta(days=(published_at.weekday() - 4) % 7)
+        yield ('Nieuwsbrief %s %d' % (MONTHS[published_at.month - 1], i),
+               'http://example.com/newsletters/%d.pdf' % i,
+               published_at.replace(hour=rng.randint(12, 16)))
+
+
+def contact_items(count, rng):
+    """
+    (displayName, email, order, detailText)
+    """
+    for i in range(count):
+        yield 'Leerkracht %d' % i, 'leerkracht%d@example.com' % i, i, rng.choice(GROUPS)
+
+
+def seed_users(count, rng=None, batch_size=BATCH_SIZE, school_id=DEFAULT_SCHOOL_ID):
+    """
+    Inserts `count` users self-enrolled at school `school_id`, 60% with a GCM and 40% with an APNS registration, of
+    which one in five has push notifications switched off. Usernames continue the numbering of earlier synthetic
+    users. Returns the number of the first new user.
+    """
+    rng = rng or random.Random(0)
+    user_model = get_user_model()
+    first = user_model.objects.filter(username__startswith=USERNAME_PREFIX).count()
+    if not count:
+        return first
+    group, created = Group.objects.get_or_create(name='self-enrolled')
+    password = make_password(PASSWORD)    # Hashing is expensive, so all users share the same hash.
+    now = timezone.now()
+    for start in range(first, first + count, batch_size):
+        stop = min(start + batch_size, first + count)
+        insert(user_model,
+               ('username', 'password', 'first_name', 'last_name', 'email', 'is_superuser', 'is_staff', 'is_active',
+                'date_joined'),
+               ((USERNAME_FORMAT % i, password, 'Self-enrolled via API', '', '', False, False, True, now)
+                for i in range(start, stop)))
+        # Zero-padded usernames sort like their numbers, so a range query finds the new rows.
+        user_ids = list(user_model.objects
+                        .filter(username__gte=USERNAME_FORMAT % start, username__lt=USERNAME_FORMAT % stop)
+                        .values_list('pk', flat=True))
+        insert(user_model.groups.through, ('user', 'group'), ((user_id, group.pk) for user_id in user_ids))
+        insert(Enrollment, ('user',), ((user_id,) for user_id in user_ids), school_id=school_id)
+        gcm, apns = [], []
+        for user_id in user_ids:
+            (gcm if rng.random() < 0.6 else apns).append((user_id, rng.random() >= 0.2, now))
+        insert(GCMDevice, ('user', 'active', 'date_created', 'registration_id'),
+               (device + ('synthetic-gcm-%d' % device[0],) for device in gcm))
+        insert(APNSDevice, ('user', 'active', 'date_created', 'registration_id'),
+               (device + ('synthetic-apns-%d' % device[0],) for device in apns))
+    return first
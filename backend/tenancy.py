@@ -0,0 +1,68 @@
+"""
+Which school a request is for. One process pool serves all schools; every query and cache key is scoped to the
+school of the request.
+
+A request is for the school whose slug is in its X-School header, else for the school whose `host` is the request's
+host, else for `settings.DEFAULT_SCHOOL`. Without a default, requests for unknown hosts get a 404.
+
+The schools are read once per process and again after REFRESH_SECONDS, so resolving costs no query. A school saved in
+one process is seen by the others within that time.
+"""
+from __future__ import unicode_literals
+
+import threading
+from timeit import default_timer
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.http import Http404
+
+from backend.models import School
+
+HEADER = 'HTTP_X_SCHOOL'
+REFRESH_SECONDS = 60
+
+_lock = threading.Lock()
+_schools = {}
+
+
+def track():
+    post_save.connect(_forget_on_change, sender=School, dispatch_uid='tenancy-schools')
+    post_delete.connect(_forget_on_change, sender=School, dispatch_uid='tenancy-schools')
+
+
+def resolve(request):
+    """
+    The School of `request`. Raises Http404 when there's none.
+    """
+    by_slug, by_host = schools()
+    slug = request.META.get(HEADER)
+    if slug:
+        school = by_slug.get(slug)
+    else:
+        school = by_host.get(request.get_host().rsplit(':', 1)[0].lower()) or by_slug.get(settings.DEFAULT_SCHOOL)
+    if school is None:
+        raise Http404('No school here.')
+    return school
+
+
+def schools():
+    """
+    All schools, by slug and by host.
+    """
+    with _lock:
+        if not _schools or default_timer() - _schools['loaded'] > REFRESH_SECONDS:
+            all_schools = list(School.objects.all())
+            _schools.update(loaded=default_timer(),
+                            by_slug=dict((school.slug, school) for school in all_schools),
+                            by_host=dict((school.host.lower(), school) for school in all_schools if school.host))
+        return _schools['by_slug'], _schools['by_host']
+
+
+def forget():
+    with _lock:
+        _schools.clear()
+
+
+def _forget_on_change(sender, **kwargs):
+    forget()
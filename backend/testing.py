@@ -0,0 +1,49 @@
+"""
+Runs the tests with the directories that the app writes to in a temporary directory, rather than under DATA_DIR, which
+is the checkout when developing, or the live data of a deployment. A test run starts with none of them and leaves
+nothing behind. `temporary_data()` does the same for other runs against synthetic data, like `manage.py benchmark`.
+"""
+from __future__ import unicode_literals
+
+import os
+from contextlib import contextmanager
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+DATA_DIR_SETTINGS = ('CACHE_LOCK_DIR', 'DOCUMENT_CACHE_DIR', 'METRICS_DIR', 'PROFILE_DIR', 'SNAPSHOT_DIR')
+
+
+class TemporaryDataRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super(TemporaryDataRunner, self).setup_test_environment(**kwargs)
+        self.data_dir = mkdtemp(prefix='sebastiaanschool-test-')
+        self.data_override = override_settings(**data_settings(self.data_dir))
+        self.data_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.data_override.disable()
+        rmtree(self.data_dir, ignore_errors=True)
+        super(TemporaryDataRunner, self).teardown_test_environment(**kwargs)
+
+
+@contextmanager
+def temporary_data():
+    data_dir = mkdtemp(prefix='sebastiaanschool-')
+    try:
+        with override_settings(**data_settings(data_dir)):
+            yield data_dir
+    finally:
+        rmtree(data_dir, ignore_errors=True)
+
+
+def data_settings(data_dir):
+    overrides = dict((name, os.path.join(data_dir, name[:-len('_DIR')].lower())) for name in DATA_DIR_SETTINGS)
+    # The file-based cache, and with it the throttle history, would otherwise carry over from one test run to the next.
+    overrides['CACHES'] = dict(settings.CACHES, default=dict(settings.CACHES['default'],
+                                                             LOCATION=os.path.join(data_dir, 'cache')))
+    return overrides
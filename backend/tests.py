@@ -1,14 +1,52 @@
-from datetime import timedelta
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from shutil import rmtree
+from tempfile import mkdtemp
 from textwrap import dedent
 from warnings import filterwarnings
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.backends.utils import CursorWrapper
+from django.test import LiveServerTestCase, RequestFactory, SimpleTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import timezone
+from django.utils.six import StringIO
+from django.utils.six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 from push_notifications.models import APNSDevice, GCMDevice
 from pytz import utc
 from rest_framework.test import APITestCase
 
-from models import AgendaItem, Bulletin, ContactItem, Newsletter
+import admission
+import cache
+import documents
+import events
+import expansion
+import ical
+import memory
+import metrics
+import presence
+import profiling
+import recurrence
+import snapshots
+import synthetic
+import tenancy
+import warmer
+import warmup
+from management.commands.benchmark import compare, percentile
+from management.commands.measure_startup import median
+from models import (DEFAULT_SCHOOL_ID, AgendaItem, AgendaOccurrence, Bulletin, ContactItem, Enrollment, Newsletter,
+                    School, render_markdown)
+from testing import temporary_data
 from views import find_device_for_user
 
 
@@ -23,6 +61,13 @@ class Base(APITestCase):
     next_month_str = next_month.astimezone(utc).strftime('%Y-%m-%dT00:00:00Z')
     last_month_str = last_month.astimezone(utc).strftime('%Y-%m-%dT00:00:00Z')
 
+    def setUp(self):
+        # Requests only query the schools when they're reloaded, so do that now rather than while counting queries.
+        tenancy.forget()
+        tenancy.schools()
+        # Nor write when devices were last seen, which happens after one response every few seconds.
+        presence.forget()
+
 
 class AgendaItemTests(Base):
 
@@ -52,19 +97,19 @@ class AgendaItemTests(Base):
         cls.expectations = dict(
             all_agenda_items=dedent("""
                 [{"title":"Next Month","type":"Event","start":"%s","end":"%s"
-                ,"url":"http://testserver/api/agendaItems/3/"},
+                ,"recurrence":"","url":"http://testserver/api/agendaItems/3/"},
                 {"title":"This Month","type":"Event","start":"%s","end":"%s"
-                ,"url":"http://testserver/api/agendaItems/1/"},
+                ,"recurrence":"","url":"http://testserver/api/agendaItems/1/"},
                 {"title":"Last Month","type":"Event","start":"%s","end":"%s"
-                ,"url":"http://testserver/api/agendaItems/2/"}]""").replace('\n', '')
+                ,"recurrence":"","url":"http://testserver/api/agendaItems/2/"}]""").replace('\n', '')
                 % (cls.next_month_str, next_month_end_str,
                    cls.today_str, cls.next_month_str,
                    cls.last_month_str, cls.today_str),
             coming_agenda_items=dedent("""
                 [{"title":"Next Month","type":"Event","start":"%s","end":"%s"
-                ,"url":"http://testserver/api/agendaItems/3/"},
+                ,"recurrence":"","url":"http://testserver/api/agendaItems/3/"},
                 {"title":"This Month","type":"Event","start":"%s","end":"%s"
-                ,"url":"http://testserver/api/agendaItems/1/"}]""").replace('\n', '')
+                ,"recurrence":"","url":"http://testserver/api/agendaItems/1/"}]""").replace('\n', '')
                 % (cls.next_month_str, next_month_end_str,
                    cls.today_str, cls.next_month_str)
         )
@@ -85,6 +130,31 @@ class AgendaItemTests(Base):
         response.render()
         self.assertEqual(response.content, self.expectations['all_agenda_items'])
 
+    def test_agenda_get_agenda_items_from_to_returns_overlapping_items(self):
+        day_after_next_month = (self.next_month + timedelta(days=1)).strftime('%Y-%m-%d')
+        response = self.client.get('/api/agendaItems/', {'from': '2000-01-01', 'to': '2000-02-01'})
+        self.assertEqual([item['title'] for item in response.data], [])
+        response = self.client.get('/api/agendaItems/', {'from': day_after_next_month})
+        self.assertEqual([item['title'] for item in response.data], ['Next Month'])
+        response = self.client.get('/api/agendaItems/', {'from': self.last_month_str, 'to': self.today_str})
+        self.assertEqual([item['title'] for item in response.data], ['Last Month'])
+        response = self.client.get('/api/agendaItems/', {'to': self.today.strftime('%Y-%m-%d')})
+        self.assertEqual([item['title'] for item in response.data], ['Last Month'])
+
+    def test_agenda_get_agenda_items_from_to_rejects_invalid_dates(self):
+        self.assertEqual(self.client.get('/api/agendaItems/', {'from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/agendaItems/', {'to': '2016-02-30'}).status_code, 400)
+
+    def test_agenda_get_agenda_items_from_to_uses_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Checks the SQLite query plan.')
+        queryset = AgendaItem.objects.filter(school=DEFAULT_SCHOOL_ID, end__gte=self.last_month, start__lt=self.today)
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('backend_agendaitem_school_id_', plan)
+
     def test_agenda_post_agenda_item_unauthenticated_is_not_allowed(self):
         response = self.client.post('/api/agendaItems/', {'title': 'Access denied',
                                                           'type': 'Event',
@@ -250,6 +320,69 @@ class BulletinTests(Base):
         self.assertEqual(response.status_code, 405)
         self.assertEqual(Bulletin.objects.count(), 3)
 
+    def test_bulletin_save_renders_markdown_body(self):
+        bulletin = Bulletin.objects.get(title="Today's news")
+        bulletin.body = 'Neem *gymkleren* mee.'
+        bulletin.save()
+        self.assertEqual(Bulletin.objects.get(pk=bulletin.pk).bodyHtml, '<p>Neem <em>gymkleren</em> mee.</p>')
+
+    def test_bulletin_get_bulletins_as_html(self):
+        response = self.client.get('/api/bulletins/', {'body_format': 'html'})
+        html = ['<p>Today is the day</p>', '<p>Then was the day</p>']
+        self.assertEqual([item['body'] for item in response.data], html)
+        response = self.client.get('/api/timeline/', {'body_format': 'html'})
+        self.assertEqual([item['body'] for item in response.data], html)
+        self.assertEqual(self.client.get('/api/bulletins/', {'body_format': 'rtf'}).status_code, 400)
+
+    def test_bulletin_render_bulletins_fills_raw_inserts(self):
+        synthetic.insert(Bulletin, ('title', 'body', 'bodyHtml', 'publishedAt'),
+                         [('Imported', 'Een **oud** bericht', '', self.last_month)])
+        call_command('render_bulletins', stdout=StringIO())
+        self.assertEqual(Bulletin.objects.get(title='Imported').bodyHtml, '<p>Een <strong>oud</strong> bericht</p>')
+
+    def test_bulletin_batch_as_normal_user_is_not_allowed(self):
+        self.client.login(username='mere-mortal', password='I have no power')
+        response = self.client.post('/api/bulletins/batch/', [])
+        self.assertEqual(response.status_code, 403)
+
+    def test_bulletin_batch_as_admin_creates_and_updates(self):
+        self.client.login(username='admin', password='I have the power')
+        token = cache.version(DEFAULT_SCHOOL_ID, Bulletin)
+        batch = [{'title': 'Archief %d' % i, 'body': 'Uit het *archief*', 'publishedAt': '2010-03-10T20:00:00Z'}
+                 for i in range(50)]
+        batch.append({'url': 'http://testserver/api/bulletins/1/', 'title': 'Zwemles', 'body': 'Neem een handdoek mee',
+                      'publishedAt': self.today_str})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/bulletins/batch/', batch)
+        self.assertEqual(response.status_code, 200)
+        # Besides an INSERT per new bulletin where the database can't return the keys of a multi-row INSERT.
+        inserts = 0 if connection.features.can_return_ids_from_bulk_insert else 50
+        self.assertLess(len(queries), 20 + inserts)
+        self.assertEqual([item['title'] for item in response.data], [item['title'] for item in batch])
+        self.assertEqual(response.data[-1]['url'], 'http://testserver/api/bulletins/1/')
+        self.assertEqual(Bulletin.objects.count(), 53)
+        archived = Bulletin.objects.get(pk=int(response.data[0]['url'].split('/')[-2]))
+        self.assertEqual((archived.title, archived.bodyHtml), ('Archief 0', '<p>Uit het <em>archief</em></p>'))
+        updated = Bulletin.objects.get(pk=1)
+        self.assertEqual((updated.title, updated.bodyHtml), ('Zwemles', '<p>Neem een handdoek mee</p>'))
+        self.assertNotEqual(cache.version(DEFAULT_SCHOOL_ID, Bulletin), token)
+        self.assertEqual(len(self.client.get('/api/search', {'q': 'archief'}).data['results']), 20)
+        self.assertEqual(self.client.get('/api/search', {'q': 'handdoek'}).data['results'][0]['title'], 'Zwemles')
+
+    def test_bulletin_batch_reports_errors_per_item_and_writes_nothing(self):
+        self.client.login(username='admin', password='I have the power')
+        batch = [{'title': 'Goed', 'body': 'Geldig', 'publishedAt': self.today_str},
+                 {'body': 'Zonder titel', 'publishedAt': self.today_str},
+                 {'url': 'http://testserver/api/bulletins/99/', 'title': 'Weg', 'body': 'Weg',
+                  'publishedAt': self.today_str}]
+        response = self.client.post('/api/bulletins/batch/', batch)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(list(response.data[1]), ['title'])
+        self.assertEqual(list(response.data[2]), ['url'])
+        self.assertEqual(Bulletin.objects.count(), 3)
+        self.assertEqual(self.client.post('/api/bulletins/batch/', {'title': 'Geen lijst'}).status_code, 400)
+
 
 class ContactItemTests(Base):
 
@@ -349,6 +482,32 @@ class ContactItemTests(Base):
         self.assertEqual(response.status_code, 405)
         self.assertEqual(ContactItem.objects.count(), 3)
 
+    def test_contact_item_reorder_as_normal_user_is_not_allowed(self):
+        self.client.login(username='mere-mortal', password='I have no power')
+        response = self.client.post('/api/contactItems/reorder/', {'contactItems': []})
+        self.assertEqual(response.status_code, 403)
+
+    def test_contact_item_reorder_as_admin_updates_all_in_one_query(self):
+        self.client.login(username='admin', password='I have the power')
+        urls = ['http://testserver/api/contactItems/%d/' % pk for pk in (1, 3, 2)]
+        token = cache.version(DEFAULT_SCHOOL_ID, ContactItem)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/contactItems/reorder/', {'contactItems': urls})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['url'] for item in response.data], urls)
+        self.assertEqual(list(ContactItem.objects.values_list('pk', 'order')), [(1, 1), (3, 2), (2, 3)])
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "backend_contactitem"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotEqual(cache.version(DEFAULT_SCHOOL_ID, ContactItem), token)
+
+    def test_contact_item_reorder_requires_every_item_once(self):
+        self.client.login(username='admin', password='I have the power')
+        for pks in ((1, 2), (1, 2, 3, 3), (1, 2, 4)):
+            urls = ['http://testserver/api/contactItems/%d/' % pk for pk in pks]
+            response = self.client.post('/api/contactItems/reorder/', {'contactItems': urls})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(ContactItem.objects.values_list('pk', flat=True)), [2, 3, 1])
+
 
 class NewsletterTests(Base):
 
@@ -468,6 +627,160 @@ class NewsletterTests(Base):
         self.assertEqual(response.status_code, 405)
         self.assertEqual(Newsletter.objects.count(), 3)
 
+    def test_newsletter_batch_as_admin_creates_newsletters(self):
+        self.client.login(username='admin', password='I have the power')
+        batch = [{'title': 'Nieuwsbrief %d' % i, 'documentUrl': 'http://example.com/%d.pdf' % i,
+                  'publishedAt': '2010-03-10T20:00:00Z'} for i in range(3)]
+        response = self.client.post('/api/newsletters/batch/', batch)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Newsletter.objects.count(), 6)
+        self.assertEqual(Newsletter.objects.get(title='Nieuwsbrief 2').documentUrl, 'http://example.com/2.pdf')
+
+
+class Origin(BaseHTTPRequestHandler):
+    """
+    Stand-in for the site that hosts the newsletter documents.
+    """
+    documents = {'/nieuwsbrief.pdf': b'%PDF-1.4 ' + b''.join(b'%03d ' % i for i in range(200))}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        content = self.documents.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class NewsletterDocumentTests(Base):
+    document = Origin.documents['/nieuwsbrief.pdf']
+
+    @classmethod
+    def setUpClass(cls):
+        cls.origin = HTTPServer(('127.0.0.1', 0), Origin)
+        thread = threading.Thread(target=cls.origin.serve_forever)
+        thread.daemon = True
+        thread.start()
+        super(NewsletterDocumentTests, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.origin.shutdown()
+        cls.origin.server_close()
+        super(NewsletterDocumentTests, cls).tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        origin = 'http://127.0.0.1:%d' % cls.origin.server_port
+        cls.published = Newsletter.objects.create(title='Nieuwsbrief', documentUrl=origin + '/nieuwsbrief.pdf',
+                                                  publishedAt=cls.last_month)
+        cls.missing = Newsletter.objects.create(title='Kwijt', documentUrl=origin + '/kwijt.pdf',
+                                                publishedAt=cls.last_month)
+        cls.future = Newsletter.objects.create(title='Volgende', documentUrl=origin + '/nieuwsbrief.pdf',
+                                               publishedAt=cls.next_month)
+
+    def setUp(self):
+        super(NewsletterDocumentTests, self).setUp()
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        self.settings_override = self.settings(DOCUMENT_CACHE_DIR=directory)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        del Origin.requests[:]
+
+    def get(self, newsletter, **headers):
+        response = self.client.get('/api/newsletters/%d/document' % newsletter.pk, **headers)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+    def test_newsletter_document_is_fetched_once(self):
+        for _ in range(2):
+            response, content = self.get(self.published)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(content, self.document)
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertEqual(response['Content-Length'], str(len(self.document)))
+            self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(Origin.requests, ['/nieuwsbrief.pdf'])
+        self.assertEqual(self.get(self.published, HTTP_IF_NONE_MATCH=response['ETag'])[0].status_code, 304)
+
+    def test_newsletter_document_is_fetched_once_by_concurrent_requests(self):
+        paths = []
+        threads = [threading.Thread(target=lambda: paths.append(documents.fetch(self.published.documentUrl)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(paths, [documents.path(self.published.documentUrl)] * 5)
+        self.assertEqual(Origin.requests, ['/nieuwsbrief.pdf'])
+
+    def test_newsletter_document_outdated_copy_is_fetched_anew(self):
+        etag = self.get(self.published)[0]['ETag']
+        outdated = time.time() - settings.DOCUMENT_MAX_AGE - 60
+        os.utime(documents.path(self.published.documentUrl), (outdated, outdated))
+        response, content = self.get(self.published)
+        self.assertEqual(content, self.document)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(Origin.requests, ['/nieuwsbrief.pdf'] * 2)
+
+    def test_newsletter_document_outdated_copy_is_served_while_origin_fails(self):
+        path = documents.path(self.missing.documentUrl)
+        with open(path, 'wb') as copy:
+            copy.write(self.document)
+        outdated = time.time() - settings.DOCUMENT_MAX_AGE - 60
+        os.utime(path, (outdated, outdated))
+        documents_logger = logging.getLogger('backend.documents')
+        documents_logger.disabled = True
+        self.addCleanup(setattr, documents_logger, 'disabled', False)
+        for _ in range(2):
+            response, content = self.get(self.missing)
+            self.assertEqual((response.status_code, content), (200, self.document))
+        # Tried once, then not again until the copy is outdated anew.
+        self.assertEqual(Origin.requests, ['/kwijt.pdf'])
+
+    def test_newsletter_document_serves_byte_ranges(self):
+        response, content = self.get(self.published, HTTP_RANGE='bytes=9-16')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.document[9:17])
+        self.assertEqual(response['Content-Range'], 'bytes 9-16/%d' % len(self.document))
+        self.assertEqual(response['Content-Length'], '8')
+        response, content = self.get(self.published, HTTP_RANGE='bytes=-4')
+        self.assertEqual(content, self.document[-4:])
+        response, content = self.get(self.published, HTTP_RANGE='bytes=800-')
+        self.assertEqual(content, self.document[800:])
+        response, content = self.get(self.published, HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%d' % len(self.document))
+        response, content = self.get(self.published, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual((response.status_code, content), (200, self.document))
+
+    def test_newsletter_document_unavailable_at_origin(self):
+        response, _ = self.get(self.missing)
+        self.assertEqual(response.status_code, 502)
+        self.assertFalse(os.path.exists(documents.path(self.missing.documentUrl)))
+        self.assertEqual(os.listdir(settings.DOCUMENT_CACHE_DIR), [])
+
+    def test_newsletter_document_of_unpublished_newsletter_is_not_found(self):
+        self.assertEqual(self.get(self.future)[0].status_code, 404)
+        self.assertEqual(Origin.requests, [])
+
+    def test_newsletter_document_byte_range_parsing(self):
+        self.assertIsNone(documents.byte_range(None, 100))
+        self.assertIsNone(documents.byte_range('bytes=0-9,20-29', 100))
+        self.assertIsNone(documents.byte_range('bytes=9-0', 100))
+        self.assertEqual(documents.byte_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(documents.byte_range('bytes=-200', 100), (0, 99))
+        self.assertRaises(documents.UnsatisfiableRange, documents.byte_range, 'bytes=-0', 100)
+
 
 class UserDeviceTests(APITestCase):
 
@@ -803,6 +1116,1112 @@ class UserDeviceTests(APITestCase):
         self.assertEqual(response.content, '{"detail":"name should be <256"}')
 
 
+class RecurrenceTests(SimpleTestCase):
+
+    def starts(self, start, rule, days=400, duration=timedelta(hours=1)):
+        start = datetime(*start, tzinfo=utc)
+        return [(s.strftime('%Y-%m-%d %H:%M'), e - s) for s, e in
+                recurrence.occurrences(start, start + duration, rule, start + timedelta(days=days))]
+
+    def test_recurrence_weekly_on_weekdays_starts_with_item_itself(self):
+        occurrences = self.starts((2016, 9, 1, 8, 30), 'FREQ=WEEKLY;BYDAY=MO,TH;COUNT=4')
+        self.assertEqual([start for start, _ in occurrences],
+                         ['2016-09-01 08:30', '2016-09-05 08:30', '2016-09-08 08:30', '2016-09-12 08:30'])
+        self.assertEqual(set(duration for _, duration in occurrences), {timedelta(hours=1)})
+
+    def test_recurrence_monthly_on_numbered_weekdays(self):
+        self.assertEqual([start for start, _ in self.starts((2016, 9, 2, 8, 30), 'FREQ=MONTHLY;BYDAY=1FR;COUNT=3')],
+                         ['2016-09-02 08:30', '2016-10-07 08:30', '2016-11-04 08:30'])
+        self.assertEqual([start for start, _ in self.starts((2016, 9, 30, 19, 0), 'FREQ=MONTHLY;BYDAY=-1FR',
+                                                            days=70)],
+                         ['2016-09-30 19:00', '2016-10-28 19:00', '2016-11-25 19:00'])
+
+    def test_recurrence_monthly_skips_months_without_the_day_and_stops_at_until(self):
+        self.assertEqual([start for start, _ in self.starts((2016, 1, 31, 12, 0), 'FREQ=MONTHLY;UNTIL=20160531')],
+                         ['2016-01-31 12:00', '2016-03-31 12:00', '2016-05-31 12:00'])
+
+    def test_recurrence_stops_at_horizon(self):
+        self.assertEqual(len(self.starts((2016, 9, 1, 8, 30), 'FREQ=DAILY;INTERVAL=2', days=10)), 5)
+
+    def test_recurrence_rejects_unsupported_rules(self):
+        for rule in ('WEEKLY', 'FREQ=HOURLY', 'FREQ=WEEKLY;BYDAY=1MO', 'FREQ=DAILY;BYDAY=MO', 'FREQ=WEEKLY;COUNT=0',
+                     'FREQ=WEEKLY;COUNT=2;UNTIL=20160101', 'FREQ=WEEKLY;BYMONTH=1', 'FREQ=MONTHLY;BYDAY=6FR'):
+            self.assertRaises(ValueError, recurrence.parse, rule)
+            self.assertRaises(ValidationError, recurrence.validate, rule)
+        recurrence.validate('')
+
+
+class AgendaOccurrenceTests(Base):
+
+    @classmethod
+    def setUpTestData(cls):
+        get_user_model().objects.create_superuser('admin', 'myemail@example.com', 'I have the power')
+        cls.single = AgendaItem.objects.create(title='Studiedag', type='Studiedag', start=cls.next_month,
+                                               end=cls.next_month)
+
+    def titles(self, **params):
+        response = self.client.get('/api/agendaItems/', params)
+        return [(item['title'], item['start']) for item in reversed(response.data)]
+
+    def test_agenda_recurring_item_is_listed_once_per_occurrence(self):
+        self.client.login(username='admin', password='I have the power')
+        response = self.client.post('/api/agendaItems/', {'title': 'Gym', 'type': 'Les', 'start': self.today_str,
+                                                          'end': self.today_str, 'recurrence': 'FREQ=WEEKLY;COUNT=3'})
+        self.assertEqual(response.status_code, 201)
+        week = timedelta(weeks=1)
+        occurrences = [('Gym', (self.today + i * week).strftime('%Y-%m-%dT00:00:00Z')) for i in range(3)]
+        self.assertEqual([title for title in self.titles() if title[0] == 'Gym'], occurrences)
+        second_week = {'from': (self.today + week).isoformat(), 'to': (self.today + 2 * week).isoformat()}
+        self.assertEqual(self.titles(**second_week), occurrences[1:2])
+        response = self.client.get('/api/agendaItems/', {'all': ''})
+        self.assertEqual([item['recurrence'] for item in response.data if item['title'] == 'Gym'],
+                         ['FREQ=WEEKLY;COUNT=3'])
+
+    def test_agenda_saving_item_reexpands_only_that_item(self):
+        single_occurrence = AgendaOccurrence.objects.get(item=self.single).pk
+        item = AgendaItem.objects.create(title='Koffie', type='Ouderavond', start=self.today, end=self.today,
+                                         recurrence='FREQ=MONTHLY;COUNT=2')
+        self.assertEqual(item.occurrences.count(), 2)
+        item.recurrence = 'FREQ=MONTHLY;COUNT=5'
+        item.save()
+        self.assertEqual(item.occurrences.count(), 5)
+        self.assertEqual(AgendaOccurrence.objects.get(item=self.single).pk, single_occurrence)
+
+    def test_agenda_occurrences_are_rewritten_before_the_cache_version_changes(self):
+        counts = []
+        bump = cache.bump
+        def counting_bump(school_id, *models):
+            counts.append(self.single.occurrences.count())
+            bump(school_id, *models)
+        cache.bump = counting_bump
+        self.addCleanup(setattr, cache, 'bump', bump)
+        self.single.recurrence = 'FREQ=DAILY;COUNT=3'
+        self.single.save()
+        # A request for the new version must not find the old occurrences.
+        self.assertEqual(counts, [3])
+
+    def test_agenda_invalid_recurrence_is_rejected(self):
+        self.client.login(username='admin', password='I have the power')
+        response = self.client.post('/api/agendaItems/', {'title': 'Gym', 'type': 'Les', 'start': self.today_str,
+                                                          'end': self.today_str, 'recurrence': 'FREQ=HOURLY'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('recurrence', response.data)
+
+    def test_agenda_expand_all_extends_horizon_and_expands_raw_inserts(self):
+        item = AgendaItem.objects.create(title='Gym', type='Les', start=self.today, end=self.today,
+                                         recurrence='FREQ=WEEKLY')
+        existing = set(item.occurrences.values_list('pk', flat=True))
+        synthetic.insert(AgendaItem, synthetic.AGENDA_ITEM_FIELDS,
+                         [('Raw', 'Event', self.next_month, self.next_month, '')])
+        created = expansion.expand_all(timezone.now() + timedelta(weeks=4))
+        self.assertEqual(created, 4 + 1)
+        self.assertTrue(existing < set(item.occurrences.values_list('pk', flat=True)))
+        self.assertIn(('Raw', self.next_month_str), self.titles())
+        self.assertEqual(expansion.expand_all(timezone.now() + timedelta(weeks=4)), 0)
+
+    def test_agenda_feed_contains_recurrence_rule(self):
+        AgendaItem.objects.create(title='Gym', type='Les', start=self.today, end=self.today,
+                                  recurrence='FREQ=WEEKLY;BYDAY=MO')
+        content = b''.join(self.client.get('/api/agenda.ics').streaming_content).decode('utf-8')
+        self.assertIn('RRULE:FREQ=WEEKLY;BYDAY=MO\r\n', content)
+
+
+class BootstrapTests(Base):
+
+    @classmethod
+    def setUpTestData(cls):
+        Bulletin.objects.create(title='Zwemles', body='Neem een *handdoek* mee', publishedAt=cls.last_month)
+        Newsletter.objects.create(title='Nieuwsbrief', documentUrl='http://example.com/1.pdf', publishedAt=cls.today)
+        ContactItem.objects.create(displayName='Anna Anderson', order=1, email='aa@example.com', detailText='Juf')
+        AgendaItem.objects.create(title='Sportdag', type='event', start=cls.next_month,
+                                  end=cls.next_month + timedelta(hours=6))
+        user = get_user_model().objects.create_user('test-user-numero-uno', None, 'password1')
+        GCMDevice.objects.create(user=user, active=True, registration_id='iid1')
+
+    def test_bootstrap_combines_launch_requests(self):
+        response = self.client.get('/api/bootstrap')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['timeline'], json.loads(self.client.get('/api/timeline/').content))
+        self.assertEqual(data['agenda'], json.loads(self.client.get('/api/agendaItems/').content))
+        self.assertEqual(data['contacts'], json.loads(self.client.get('/api/contactItems/').content))
+        self.assertIsNone(data['pushSettings'])
+        html = json.loads(self.client.get('/api/bootstrap', {'body_format': 'html'}).content)
+        self.assertEqual(html['timeline'][1]['body'], '<p>Neem een <em>handdoek</em> mee</p>')
+        self.assertEqual(self.client.get('/api/bootstrap', {'body_format': 'rtf'}).status_code, 400)
+
+    def test_bootstrap_includes_push_settings_of_device(self):
+        self.client.login(username='test-user-numero-uno', password='password1')
+        device = self.client.get('/api/bootstrap')
+        self.assertEqual(json.loads(device.content)['pushSettings'], {'active': True})
+        self.client.logout()
+        self.assertNotEqual(self.client.get('/api/bootstrap')['ETag'], device['ETag'])
+
+    def test_bootstrap_is_assembled_from_cached_parts(self):
+        first = self.client.get('/api/bootstrap')
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/bootstrap')
+        self.assertEqual(second.content, first.content)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/bootstrap', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        ContactItem.objects.create(displayName='Bernard Benson', order=2, email='bb@example.com', detailText='Meester')
+        response = self.client.get('/api/bootstrap', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['contacts']), 2)
+
+
+class CacheFetchTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.addCleanup(rmtree, self.directory)
+        self.name = self._testMethodName
+
+    def slow_build(self, value):
+        def build():
+            with open(os.path.join(self.directory, 'builds'), 'a') as builds:
+                builds.write('%d\n' % os.getpid())
+            time.sleep(0.3)
+            return value
+        return build
+
+    def builds(self):
+        with open(os.path.join(self.directory, 'builds')) as builds:
+            return len(builds.readlines())
+
+    def test_cache_fetch_burst_of_threads_builds_once(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            cache.fetch(1, self.name, 'v', 'one', self.slow_build('value')))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [('one', 'value')] * 8)
+        self.assertEqual(self.builds(), 1)
+
+    def test_cache_fetch_burst_of_processes_builds_once(self):
+        children = []
+        for _ in range(4):
+            read, write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read)
+                try:
+                    os.write(write, json.dumps(cache.fetch(1, self.name, 'v', 'one', self.slow_build('value'))))
+                finally:
+                    os._exit(0)
+            os.close(write)
+            children.append((pid, read))
+        for pid, read in children:
+            self.assertEqual(json.loads(os.fdopen(read).read()), ['one', 'value'])
+            os.waitpid(pid, 0)
+        self.assertEqual(self.builds(), 1)
+
+    def test_cache_fetch_serves_previous_version_while_rebuilding(self):
+        cache.fetch(1, self.name, 'v', 'one', lambda: 'first')
+        lock = cache.RebuildLock(cache.key(1, self.name, 'v-two'))
+        self.assertTrue(lock.acquire())
+        try:
+            self.assertEqual(cache.fetch(1, self.name, 'v', 'two', self.fail), ('one', 'first'))
+            self.assertEqual(cache.fetch(1, self.name, 'other', 'two', lambda: 'second variant'),
+                             ('two', 'second variant'))
+        finally:
+            lock.release()
+        self.assertEqual(cache.fetch(1, self.name, 'v', 'two', lambda: 'second'), ('two', 'second'))
+
+
+class ScheduledExpiryTests(Base):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.next_bulletin = timezone.now() + timedelta(seconds=90)
+        Bulletin.objects.create(title='Gepland', body='Straks', publishedAt=cls.next_bulletin)
+        Bulletin.objects.create(title='Later', body='Veel later', publishedAt=cls.next_month)
+        get_user_model().objects.create_user('mere-mortal', 'myemail@example.com', 'I have no power')
+
+    def max_age(self, response):
+        self.assertIn('Expires', response)
+        return int(response['Cache-Control'].split('max-age=')[1].split(',')[0])
+
+    def test_scheduled_expiry_at_next_publication(self):
+        response = self.client.get('/api/bulletins/')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertTrue(60 <= self.max_age(response) <= 90)
+        self.assertEqual(self.max_age(self.client.get('/api/newsletters/')), settings.CACHE_MAX_AGE)
+
+    def test_scheduled_expiry_at_midnight(self):
+        with self.settings(CACHE_MAX_AGE=2 * 24 * 3600):
+            for path in ('/api/timeline/', '/api/agendaItems/'):
+                midnight = self.today + timedelta(days=1)
+                self.assertAlmostEqual(self.max_age(self.client.get(path)),
+                                       (midnight - timezone.now()).total_seconds(), delta=5)
+            response = self.client.get('/api/agendaItems/', {'from': '2016-03-01', 'to': '2016-04-01'})
+            self.assertEqual(self.max_age(response), 2 * 24 * 3600)
+
+    def test_scheduled_expiry_is_private_for_logged_in_users(self):
+        self.client.login(username='mere-mortal', password='I have no power')
+        response = self.client.get('/api/bulletins/')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('public', response['Cache-Control'])
+
+
+class TimelineEventTests(Base):
+
+    def setUp(self):
+        super(TimelineEventTests, self).setUp()
+        # A hub that never polls by itself, so tests decide when it does.
+        self.addCleanup(setattr, events, 'hub', events.hub)
+        events.hub = events.Hub(interval=3600)
+
+    def stream(self, **headers):
+        response = self.client.get('/api/timeline/events', **headers)
+        self.addCleanup(response.close)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        response.chunks = iter(response.streaming_content)
+        self.assertEqual(next(response.chunks), b'retry: 5000\n\n')
+        return response
+
+    def parse(self, chunk):
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+        return fields['id'], fields['event'], json.loads(fields['data'])
+
+    def test_timeline_events_hub_announces_publications_once_when_visible(self):
+        hub = events.hub
+        hub.started = hub.checked_until = timezone.now() - timedelta(minutes=2)
+        Bulletin.objects.create(title='Al zichtbaar', body='Oud', publishedAt=hub.started - timedelta(seconds=1))
+        late = Bulletin.objects.create(title='Net gepubliceerd', body='Te laat opgeslagen',
+                                       publishedAt=timezone.now() - timedelta(minutes=1))
+        scheduled = Newsletter.objects.create(title='Nieuwsbrief', documentUrl='http://example.com/1.pdf',
+                                              publishedAt=timezone.now() + timedelta(minutes=1))
+        self.assertEqual([event[2] for event in hub.poll()], [late])
+        self.assertEqual(hub.poll(), [])
+        self.assertEqual([event[2] for event in hub.poll(timezone.now() + timedelta(minutes=2))], [scheduled])
+
+    def test_timeline_events_pushes_new_items(self):
+        response = self.stream()
+        bulletin = Bulletin.objects.create(title='Hitteplan', body='Vrij *vanaf* 12 uur', publishedAt=timezone.now())
+        events.hub.publish([(bulletin.publishedAt, events.key(bulletin), bulletin)])
+        event_id, event, data = self.parse(next(response.chunks))
+        self.assertEqual(event, 'timeline')
+        self.assertEqual(events.parse_id(event_id), (bulletin.publishedAt, events.key(bulletin)))
+        self.assertEqual((data['type'], data['title'], data['body']), ('bulletin', 'Hitteplan', 'Vrij *vanaf* 12 uur'))
+        self.assertEqual(len(events.hub.subscribers), 1)
+        response.close()
+        self.assertEqual(len(events.hub.subscribers), 0)
+
+    def test_timeline_events_replays_missed_events_after_reconnect(self):
+        first = Bulletin.objects.create(title='Eerste', body='1', publishedAt=self.last_month)
+        second = Bulletin.objects.create(title='Tweede', body='2', publishedAt=self.last_month + timedelta(days=1))
+        Bulletin.objects.create(title='Gepland', body='3', publishedAt=self.next_month)
+        chunks = self.stream(HTTP_LAST_EVENT_ID=events.event_id(first.publishedAt, events.key(first))).chunks
+        self.assertEqual(self.parse(next(chunks))[2]['title'], 'Tweede')
+        # Also announced by the hub, but already sent.
+        events.hub.publish([(second.publishedAt, events.key(second), second), (first.publishedAt, 1, first)])
+        self.assertEqual(self.parse(next(chunks))[2]['title'], 'Eerste')
+
+    def test_timeline_events_resets_clients_that_missed_too_much(self):
+        synthetic.insert(Bulletin, synthetic.BULLETIN_FIELDS,
+                         [('Bericht %d' % i, '', '', self.last_month) for i in range(101)])
+        chunks = self.stream(HTTP_LAST_EVENT_ID=events.event_id(self.last_month - timedelta(days=1), 0)).chunks
+        self.assertEqual(next(chunks), b'event: reset\ndata: {}\n\n')
+
+    def test_timeline_events_replays_publications_that_share_a_moment(self):
+        synthetic.insert(Bulletin, synthetic.BULLETIN_FIELDS,
+                         [('Bericht %d' % i, '', '', self.last_month) for i in range(150)])
+        keys = sorted(events.key(bulletin) for bulletin in Bulletin.objects.all())
+        missed, more = events.missed(DEFAULT_SCHOOL_ID, (self.last_month, keys[119]), timezone.now(), 100)
+        self.assertEqual(([event[1] for event in missed], more), (keys[120:], False))
+        missed, more = events.missed(DEFAULT_SCHOOL_ID, (self.last_month, keys[9]), timezone.now(), 100)
+        self.assertEqual(([event[1] for event in missed], more), (keys[10:110], True))
+
+    def test_timeline_events_ends_the_stream_of_a_client_that_fell_behind(self):
+        response = self.stream()
+        bulletin = Bulletin.objects.create(title='Hitteplan', body='Vrij', publishedAt=timezone.now())
+        for _ in range(events.QUEUE_SIZE + 1):
+            events.hub.publish([(bulletin.publishedAt, events.key(bulletin), bulletin)])
+        self.assertEqual(len(events.hub.subscribers), 0)
+        self.assertEqual(len(list(response.chunks)), events.QUEUE_SIZE)
+
+
+class AgendaFeedTests(Base):
+
+    @classmethod
+    def setUpTestData(cls):
+        AgendaItem.objects.create(title='Studiedag', type='Studiedag', start=cls.next_month, end=cls.next_month)
+        AgendaItem.objects.create(title='Ouderavond groep 3, 4; 5', type='Ouderavond',
+                                  start=cls.next_month.replace(hour=19), end=cls.next_month.replace(hour=21))
+
+    def get_feed(self, **headers):
+        response = self.client.get('/api/agenda.ics', **headers)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, content.decode('utf-8')
+
+    def test_agenda_feed_renders_events(self):
+        response, content = self.get_feed()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\nVERSION:2.0\r\n'))
+        self.assertTrue(content.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(content.count('BEGIN:VEVENT'), 2)
+        day = self.next_month.strftime('%Y%m%d')
+        self.assertIn('DTSTART;VALUE=DATE:%s\r\nDTEND;VALUE=DATE:%s\r\n' % (
+            day, (self.next_month + timedelta(days=1)).strftime('%Y%m%d')), content)
+        self.assertIn('DTSTART:%sT190000Z\r\nDTEND:%sT210000Z\r\n' % (day, day), content)
+        self.assertIn('SUMMARY:Ouderavond groep 3\\, 4\\; 5\r\n', content)
+
+    def test_agenda_feed_is_cached_until_agenda_changes(self):
+        cache.bump(DEFAULT_SCHOOL_ID, AgendaItem)    # Earlier tests may have cached the feed of the same items.
+        first, first_content = self.get_feed()
+        self.assertTrue(first.streaming)
+        with self.assertNumQueries(1):
+            second, second_content = self.get_feed()
+        self.assertFalse(second.streaming)
+        self.assertEqual(second_content, first_content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        AgendaItem.objects.create(title='Excursie', type='Excursie', start=self.today, end=self.today)
+        third, third_content = self.get_feed()
+        self.assertNotEqual(third['ETag'], first['ETag'])
+        self.assertIn('SUMMARY:Excursie', third_content)
+
+    def test_agenda_feed_conditional_request_returns_not_modified(self):
+        response, content = self.get_feed()
+        with self.assertNumQueries(1):
+            not_modified, content = self.get_feed(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(content, '')
+        AgendaItem.objects.first().delete()
+        self.assertEqual(self.get_feed(HTTP_IF_NONE_MATCH=response['ETag'])[0].status_code, 200)
+
+    def test_agenda_feed_folds_long_lines_between_characters(self):
+        line = 'SUMMARY:' + '\u00e9' * 60
+        folded = ical.fold(line)
+        self.assertEqual(folded.replace('\r\n ', ''), line)
+        for part in folded.split('\r\n'):
+            self.assertLessEqual(len(part.encode('utf-8')), 75)
+
+
+class SearchTests(Base):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Bulletin.objects.create(title='Schoolreisje naar Artis', body='Alle groepen gaan mee.',
+                                           publishedAt=cls.last_month)
+        cls.mention = Bulletin.objects.create(title='Nieuws', body='Vergeet het schoolreisje niet te betalen.',
+                                              publishedAt=cls.last_month + timedelta(days=1))
+        cls.newsletter = Newsletter.objects.create(title='Nieuwsbrief schoolreis', documentUrl='http://example.com/1',
+                                                   publishedAt=cls.last_month)
+        Bulletin.objects.create(title='Schoolreisje volgend jaar', body='Nog geheim.', publishedAt=cls.next_month)
+
+    def results(self, query, **params):
+        params['q'] = query
+        response = self.client.get('/api/search', params)
+        self.assertEqual(response.status_code, 200)
+        return [(item['type'], item['title']) for item in response.data['results']]
+
+    def test_search_ranks_title_matches_first_and_skips_unpublished(self):
+        self.assertEqual(self.results('schoolreisje'),
+                         [('bulletin', 'Schoolreisje naar Artis'), ('bulletin', 'Nieuws')])
+
+    def test_search_matches_word_prefixes_and_requires_all_words(self):
+        self.assertEqual(sorted(self.results('Schoolreis')), [('bulletin', 'Nieuws'),
+                                                              ('bulletin', 'Schoolreisje naar Artis'),
+                                                              ('newsletter', 'Nieuwsbrief schoolreis')])
+        self.assertEqual(self.results('schoolreis artis'), [('bulletin', 'Schoolreisje naar Artis')])
+        self.assertEqual(self.results('"schoolreis*" -(^:'), self.results('schoolreis'))
+        self.assertEqual(self.results(''), [])
+
+    def test_search_index_follows_saves_and_deletes(self):
+        self.trip.title = 'Excursie naar Artis'
+        self.trip.save()
+        self.assertEqual(self.results('excursie'), [('bulletin', 'Excursie naar Artis')])
+        self.assertEqual(self.results('schoolreisje'), [('bulletin', 'Nieuws')])
+        self.mention.delete()
+        self.assertEqual(self.results('schoolreisje'), [])
+
+    def test_search_indexes_raw_inserts(self):
+        synthetic.insert(Newsletter, ('title', 'documentUrl', 'publishedAt'),
+                         [('Kerstviering', 'http://example.com/2', self.last_month)])
+        self.assertEqual(self.results('kerst'), [('newsletter', 'Kerstviering')])
+
+    def test_search_paginates(self):
+        for i in range(25):
+            Bulletin.objects.create(title='Luizencontrole %d' % i, body='Luizen', publishedAt=self.last_month)
+        with self.assertNumQueries(2):
+            first = self.client.get('/api/search', {'q': 'luizen'}).data
+        self.assertEqual(len(first['results']), 20)
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).data
+        self.assertEqual(len(second['results']), 5)
+        self.assertIsNone(second['next'])
+        self.assertEqual(second['previous'], 'http://testserver/api/search?q=luizen')
+        titles = [item['title'] for item in first['results'] + second['results']]
+        self.assertEqual(len(set(titles)), 25)
+        self.assertEqual(self.client.get('/api/search', {'q': 'luizen', 'page': '0'}).status_code, 400)
+
+
+class TenancyTests(Base):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.other = School.objects.create(slug='de-regenboog', name='De Regenboog', host='api.deregenboog.example')
+        cls.own_bulletin = Bulletin.objects.create(title='Schoolreisje Sebastiaan', body='Naar Artis',
+                                                   publishedAt=cls.last_month)
+        cls.other_bulletin = Bulletin.objects.create(school=cls.other, title='Schoolreisje Regenboog',
+                                                     body='Naar Blijdorp', publishedAt=cls.last_month)
+        ContactItem.objects.create(displayName='Anna Anderson', order=1, email='aa@example.com', detailText='Juf')
+        cls.other_contact = ContactItem.objects.create(school=cls.other, displayName='Bernard Benson', order=1,
+                                                       email='bb@example.com', detailText='Meester')
+        get_user_model().objects.create_superuser('admin', 'myemail@example.com', 'I have the power')
+        staff = get_user_model().objects.create_user('juf', 'juf@example.com', 'I teach here', is_staff=True)
+        staff.user_permissions.set(Permission.objects.filter(
+            codename__in=['add_bulletin', 'change_bulletin', 'delete_bulletin', 'change_contactitem']))
+        Enrollment.objects.create(user=staff, school_id=DEFAULT_SCHOOL_ID)
+
+    def titles(self, path, **headers):
+        response = self.client.get(path, **headers)
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.data]
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'api.deregenboog.example'])
+    def test_tenancy_resolves_school_by_header_then_host_then_default(self):
+        self.assertEqual(self.titles('/api/bulletins/'), ['Schoolreisje Sebastiaan'])
+        self.assertEqual(self.titles('/api/timeline/', HTTP_X_SCHOOL='de-regenboog'), ['Schoolreisje Regenboog'])
+        self.assertEqual(self.titles('/api/timeline/', HTTP_HOST='api.deregenboog.example:443'),
+                         ['Schoolreisje Regenboog'])
+        self.assertEqual(self.titles('/api/timeline/', HTTP_HOST='api.deregenboog.example',
+                                     HTTP_X_SCHOOL='sebastiaanschool'), ['Schoolreisje Sebastiaan'])
+        self.assertEqual(self.client.get('/api/timeline/', HTTP_X_SCHOOL='onbekend').status_code, 404)
+        with self.settings(DEFAULT_SCHOOL=''):
+            self.assertEqual(self.client.get('/api/timeline/').status_code, 404)
+        self.assertIn('X-School', self.client.get('/api/contactItems/')['Vary'])
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_tenancy_school_host_must_be_allowed(self):
+        self.assertRaises(ValidationError, self.other.full_clean)
+        with self.settings(ALLOWED_HOSTS=['testserver', '.deregenboog.example']):
+            self.other.full_clean()
+
+    def test_tenancy_scopes_reads_and_writes_to_the_school(self):
+        headers = {'HTTP_X_SCHOOL': 'de-regenboog'}
+        self.assertEqual(self.client.get('/api/bulletins/%d/' % self.own_bulletin.pk, **headers).status_code, 404)
+        search = self.client.get('/api/search', {'q': 'schoolreisje'}, **headers)
+        self.assertEqual([item['title'] for item in search.data['results']], ['Schoolreisje Regenboog'])
+        bootstrap = json.loads(self.client.get('/api/bootstrap', **headers).content)
+        self.assertEqual([item['displayName'] for item in bootstrap['contacts']], ['Bernard Benson'])
+
+        own_token = cache.version(DEFAULT_SCHOOL_ID, Bulletin)
+        self.client.login(username='admin', password='I have the power')
+        response = self.client.post('/api/bulletins/', {'title': 'Studiedag', 'body': 'Geen school',
+                                                        'publishedAt': self.today_str}, **headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Bulletin.objects.get(title='Studiedag').school, self.other)
+        self.assertEqual(cache.version(DEFAULT_SCHOOL_ID, Bulletin), own_token)
+        url = 'http://testserver/api/contactItems/%d/' % self.other_contact.pk
+        response = self.client.post('/api/contactItems/reorder/', {'contactItems': [url]}, **headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_tenancy_lets_staff_write_the_content_of_their_own_school_only(self):
+        headers = {'HTTP_X_SCHOOL': 'de-regenboog'}
+        self.client.login(username='juf', password='I teach here')
+        bulletin = {'title': 'Studiedag', 'body': 'Geen school', 'publishedAt': self.today_str}
+        self.assertEqual(self.client.post('/api/bulletins/', bulletin, **headers).status_code, 403)
+        self.assertEqual(self.client.post('/api/bulletins/batch/', [bulletin], **headers).status_code, 403)
+        url = 'http://testserver/api/contactItems/%d/' % self.other_contact.pk
+        self.assertEqual(self.client.post('/api/contactItems/reorder/', {'contactItems': [url]},
+                                          **headers).status_code, 403)
+        self.assertEqual(self.client.delete('/api/bulletins/%d/' % self.other_bulletin.pk, **headers).status_code, 403)
+        self.assertEqual(Bulletin.objects.filter(school=self.other).count(), 1)
+        changelist = self.client.get('/admin/backend/bulletin/')
+        self.assertContains(changelist, 'Schoolreisje Sebastiaan')
+        self.assertNotContains(changelist, 'Schoolreisje Regenboog')
+        self.assertEqual(self.client.post('/api/bulletins/', bulletin).status_code, 201)
+        self.assertEqual(self.client.delete('/api/bulletins/%d/' % self.own_bulletin.pk).status_code, 204)
+
+    def test_tenancy_moving_content_changes_both_schools(self):
+        tokens = cache.version(DEFAULT_SCHOOL_ID, Bulletin), cache.version(self.other.pk, Bulletin)
+        bulletin = Bulletin.objects.get(pk=self.own_bulletin.pk)
+        bulletin.school = self.other
+        bulletin.save()
+        self.assertNotEqual(cache.version(DEFAULT_SCHOOL_ID, Bulletin), tokens[0])
+        self.assertNotEqual(cache.version(self.other.pk, Bulletin), tokens[1])
+
+    def test_tenancy_names_the_agenda_feed_after_the_school(self):
+        item = AgendaItem.objects.create(school=self.other, title='Studiedag', type='Studiedag', start=self.today,
+                                         end=self.today)
+        response = self.client.get('/api/agenda.ics', HTTP_X_SCHOOL='de-regenboog')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn('PRODID:-//De Regenboog//Agenda//NL\r\n', content)
+        self.assertIn('X-WR-CALNAME:De Regenboog\r\n', content)
+        self.assertIn('UID:agendaitem-%d@de-regenboog\r\n' % item.pk, content)
+
+        School.objects.filter(pk=self.other.pk).update(name='Regenboog, De')
+        tenancy.forget()
+        renamed = self.client.get('/api/agenda.ics', HTTP_X_SCHOOL='de-regenboog')
+        self.assertNotEqual(renamed['ETag'], response['ETag'])
+        self.assertIn('X-WR-CALNAME:Regenboog\\, De\r\n', b''.join(renamed.streaming_content).decode('utf-8'))
+
+    def test_tenancy_enrolls_devices_at_their_school(self):
+        response = self.client.post('/api/enrollment', {'username': '44444444-4321-1234-abcd-4321abcd1234',
+                                                        'password': 'dddddddd-4321-abcd-1234-4321abcd1234'},
+                                    HTTP_X_SCHOOL='de-regenboog')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Enrollment.objects.get(user__username='44444444-4321-1234-abcd-4321abcd1234').school,
+                         self.other)
+
+
+class WarmerTests(Base):
+
+    @classmethod
+    def setUpTestData(cls):
+        Bulletin.objects.create(title='Zwemles', body='Neem een handdoek mee', publishedAt=cls.last_month)
+        ContactItem.objects.create(displayName='Anna Anderson', order=1, email='aa@example.com', detailText='Juf')
+        AgendaItem.objects.create(title='Sportdag', type='event', start=cls.next_month, end=cls.next_month)
+
+    def setUp(self):
+        super(WarmerTests, self).setUp()
+        # Earlier tests may have cached parts of the same table versions.
+        cache.bump(DEFAULT_SCHOOL_ID, AgendaItem, Bulletin, ContactItem, Newsletter)
+
+    def test_warmer_renders_what_is_missing(self):
+        noon = datetime(2030, 1, 7, 12, tzinfo=utc)
+        self.assertGreater(warmer.warm(noon), 0)
+        self.assertEqual(warmer.warm(noon), 0)
+        Bulletin.objects.create(title='Studiedag', body='Geen school', publishedAt=noon)
+        # The timeline part for each host and body format.
+        self.assertEqual(warmer.warm(noon), len(settings.WARM_CACHE_HOSTS) * 2)
+
+    def test_warmer_renders_coming_day_before_midnight(self):
+        self.assertGreater(warmer.warm(datetime(2030, 1, 8, 23, 55, tzinfo=utc)), 0)
+        self.assertEqual(warmer.warm(datetime(2030, 1, 9, 0, 1, tzinfo=utc)), 0)
+        self.assertGreater(warmer.warm(datetime(2030, 1, 10, 0, 1, tzinfo=utc)), 0)
+
+    def test_warmer_saves_requests_from_rendering(self):
+        with self.settings(WARM_CACHE_HOSTS=['testserver'], WARM_CACHE_SECURE=False):
+            call_command('warm_cache', stdout=StringIO())
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/bootstrap').status_code, 200)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/agenda.ics')
+        self.assertFalse(response.streaming)
+
+
+class PresenceTests(Base):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('test-user-numero-uno', None, 'password1')
+        Enrollment.objects.create(user=cls.user)
+        GCMDevice.objects.create(user=cls.user, active=True, registration_id='iid1')
+
+    def last_seen(self):
+        return Enrollment.objects.get(user=self.user).lastSeen
+
+    def test_presence_buffers_last_seen_of_authenticated_requests(self):
+        self.client.get('/api/push-settings')
+        self.client.login(username='test-user-numero-uno', password='password1')
+        # Session, user and device; nothing written.
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.get('/api/push-settings').status_code, 200)
+        self.assertIsNone(self.last_seen())
+        self.assertEqual(presence.flush(self.today), 1)
+        self.assertEqual(self.last_seen(), self.today)
+        # Seen again within the resolution: not written again.
+        self.client.get('/api/timeline/')
+        self.assertEqual(presence.flush(), 0)
+        self.assertEqual(list(presence.active_users(DEFAULT_SCHOOL_ID, self.today)), [self.user.pk])
+        self.assertEqual(list(presence.active_users(DEFAULT_SCHOOL_ID, self.next_month)), [])
+
+    def test_presence_active_users_uses_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Checks the SQLite query plan.')
+        sql, params = presence.active_users(DEFAULT_SCHOOL_ID, self.last_month).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('backend_enrollment_school_id_', plan)
+
+
+class AdmissionTests(Base):
+
+    def test_admission_classifies_routes(self):
+        factory = RequestFactory()
+        self.assertEqual(admission.route_class(factory.get('/api/bootstrap')), 'read')
+        self.assertEqual(admission.route_class(factory.post('/api/enrollment')), 'enrollment')
+        self.assertEqual(admission.route_class(factory.put('/api/push-settings')), 'enrollment')
+        self.assertEqual(admission.route_class(factory.post('/api/bulletins/')), 'admin')
+        self.assertEqual(admission.route_class(factory.get('/admin/')), 'admin')
+
+    def test_admission_keeps_places_for_reads(self):
+        gate = admission.Gate()
+        with self.settings(ADMISSION_MAX_IN_FLIGHT=4, ADMISSION_LIMITS={'enrollment': 1, 'admin': 2},
+                           ADMISSION_READ_RESERVE=2):
+            self.assertTrue(gate.enter('enrollment'))
+            self.assertFalse(gate.enter('enrollment'))
+            self.assertTrue(gate.enter('admin'))
+            self.assertFalse(gate.enter('admin'))    # Only reads may take the last two places.
+            self.assertTrue(gate.enter('read'))
+            self.assertTrue(gate.enter('read'))
+            self.assertFalse(gate.enter('read'))
+            gate.leave('enrollment')
+            self.assertFalse(gate.enter('enrollment'))
+            self.assertTrue(gate.enter('read'))
+
+    def test_admission_sheds_requests_of_saturated_class(self):
+        gate = admission.gate
+        gate.in_flight['enrollment'] = settings.ADMISSION_LIMITS['enrollment']
+        try:
+            response = self.client.post('/api/enrollment', {'username': '55555555-4321-1234-abcd-4321abcd1234',
+                                                            'password': 'eeeeeeee-4321-abcd-1234-4321abcd1234'})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '%d' % settings.ADMISSION_RETRY_AFTER)
+            self.assertEqual(self.client.get('/api/timeline/').status_code, 200)
+        finally:
+            gate.in_flight['enrollment'] = 0
+        self.assertEqual(gate.in_flight, {'read': 0, 'enrollment': 0, 'admin': 0})
+
+    def test_admission_counts_out_requests_when_later_middleware_fails(self):
+        def maybe_flush():
+            raise ValueError('flush failed')
+        original = presence.maybe_flush
+        presence.maybe_flush = maybe_flush
+        self.addCleanup(setattr, presence, 'maybe_flush', original)
+        with self.assertRaises(ValueError):
+            self.client.get('/api/timeline/')
+        self.assertEqual(admission.gate.in_flight, {'read': 0, 'enrollment': 0, 'admin': 0})
+
+    @override_settings(ADMISSION_TRUST_REQUEST_START=True)
+    def test_admission_sheds_requests_that_queued_too_long(self):
+        def arrived(seconds_ago):
+            return 't=%d' % ((time.time() - seconds_ago) * 10 ** 6)
+        limit = settings.ADMISSION_MAX_QUEUE_SECONDS
+        self.assertEqual(self.client.get('/api/timeline/', HTTP_X_REQUEST_START=arrived(limit + 1)).status_code, 503)
+        self.assertEqual(self.client.get('/api/timeline/', HTTP_X_REQUEST_START=arrived(limit - 1)).status_code, 200)
+        self.assertEqual(self.client.put('/api/push-settings', {'active': True},
+                                         HTTP_X_REQUEST_START=arrived(limit - 1)).status_code, 503)
+        self.assertEqual(admission.queued_for(RequestFactory().get('/', HTTP_X_REQUEST_START='t=1500000000.25'),
+                                              1500000002.0), 1.75)
+
+    def test_admission_ignores_bad_or_untrusted_request_start(self):
+        factory = RequestFactory()
+        with self.settings(ADMISSION_TRUST_REQUEST_START=True):
+            for value in ('t=inf', 'inf', '-inf', 'nan', 't=0', '-5', 't=1e30', 'yesterday'):
+                self.assertIsNone(admission.queued_for(factory.get('/', HTTP_X_REQUEST_START=value)), value)
+        request = factory.get('/', HTTP_X_REQUEST_START='t=%d' % (time.time() * 10 ** 6))
+        self.assertIsNone(admission.queued_for(request))
+        request.META['mod_wsgi.request_start'] = '%d' % ((time.time() - 3) * 10 ** 6)
+        self.assertGreaterEqual(admission.queued_for(request), 3)
+
+
+class SnapshotTests(Base):
+
+    @classmethod
+    def setUpTestData(cls):
+        Bulletin.objects.create(title='Zwemles', body='Neem een handdoek mee', publishedAt=cls.last_month)
+
+    def setUp(self):
+        super(SnapshotTests, self).setUp()
+        self.directory = mkdtemp()
+        self.addCleanup(rmtree, self.directory)
+        self.settings_override = self.settings(SNAPSHOT_DIR=self.directory)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        middleware_logger = logging.getLogger('backend.middleware')
+        middleware_logger.disabled = True
+        self.addCleanup(setattr, middleware_logger, 'disabled', False)
+
+    def database_down(self):
+        def execute(cursor, sql, params=None):
+            raise OperationalError('could not connect to server')
+        original = CursorWrapper.execute
+        CursorWrapper.execute = execute
+        self.addCleanup(setattr, CursorWrapper, 'execute', original)
+
+    def test_snapshot_serves_last_good_list_while_database_is_down(self):
+        good = self.client.get('/api/timeline/')
+        html = self.client.get('/api/timeline/', {'body_format': 'html'})
+        self.client.get('/api/bulletins/', {'page': 2})
+        self.database_down()
+        stale = self.client.get('/api/timeline/')
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(stale.content, good.content)
+        self.assertEqual(stale['Warning'], '110 - "Response is Stale"')
+        self.assertIn('Age', stale)
+        self.assertEqual(self.client.get('/api/timeline/', {'body_format': 'html'}).content, html.content)
+        self.assertEqual(self.client.get('/api/bulletins/', {'page': 2}).status_code, 503)
+        self.assertEqual(self.client.get('/api/bulletins/').status_code, 503)
+
+    def test_snapshot_writes_get_service_unavailable(self):
+        self.database_down()
+        response = self.client.post('/api/enrollment', {'username': '66666666-4321-1234-abcd-4321abcd1234',
+                                                        'password': 'ffffffff-4321-abcd-1234-4321abcd1234'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '%d' % snapshots.RETRY_AFTER)
+
+    def test_snapshot_is_not_kept_of_authenticated_responses(self):
+        get_user_model().objects.create_superuser('admin', 'myemail@example.com', 'I have the power')
+        self.client.login(username='admin', password='I have the power')
+        self.client.get('/api/bulletins/')
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_snapshot_write_failure_leaves_the_response_alone(self):
+        blocked = os.path.join(self.directory, 'blocked')
+        open(blocked, 'w').close()
+        snapshots_logger = logging.getLogger('backend.snapshots')
+        snapshots_logger.disabled = True
+        self.addCleanup(setattr, snapshots_logger, 'disabled', False)
+        with self.settings(SNAPSHOT_DIR=blocked):
+            self.assertEqual(self.client.get('/api/timeline/').status_code, 200)
+        # Not remembered as saved, so the next response is written.
+        self.client.get('/api/timeline/')
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+
+class QueryBudget(object):
+    """
+    Pins the maximum number of SQL queries per request, at several data volumes. Subclasses set `size`.
+
+    When one of these fails, look for a query that runs once per row (N+1) before raising the budget.
+    """
+    size = None
+    username = synthetic.USERNAME_FORMAT % 0
+
+    @classmethod
+    def setUpTestData(cls):
+        synthetic.seed(cls.size, users=2, contacts=cls.size)
+        # Random content may all be in the past (agenda) or future (publications), so add visible ones for detail.
+        tomorrow = timezone.now() + timedelta(days=1)
+        cls.ids = {
+            AgendaItem: AgendaItem.objects.create(title='Tomorrow', type='Event', start=tomorrow, end=tomorrow).pk,
+            Bulletin: Bulletin.objects.create(title='Old news', body='Old', publishedAt=cls.last_month).pk,
+            ContactItem: ContactItem.objects.first().pk,
+            Newsletter: Newsletter.objects.create(title='Old news', documentUrl='x', publishedAt=cls.last_month).pk,
+        }
+
+    def setUp(self):
+        super(QueryBudget, self).setUp()
+        # Large lists grow the memory of the test process, which is expected here rather than worth a warning.
+        middleware_logger = logging.getLogger('backend.middleware')
+        middleware_logger.disabled = True
+        self.addCleanup(setattr, middleware_logger, 'disabled', False)
+
+    def assertMaxQueries(self, budget, method, path, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(path, data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elif hasattr(response, 'render'):
+                response.render()
+        self.assertLess(response.status_code, 400, '%s %s: %d' % (method, path, response.status_code))
+        self.assertLessEqual(
+            len(context), budget, '%s %s took %d queries, budget is %d:\n%s' % (
+                method, path, len(context), budget, '\n'.join(query['sql'] for query in context.captured_queries)))
+        return response
+
+    def test_query_budget_list_endpoints(self):
+        # Bulletins and newsletters also look up the next scheduled publication, for Cache-Control.
+        for budget, path in ((1, '/api/agendaItems/'), (2, '/api/bulletins/'), (1, '/api/contactItems/'),
+                             (2, '/api/newsletters/'), (1, '/api/timeline/')):
+            self.assertMaxQueries(budget, 'get', path)
+            self.assertMaxQueries(budget, 'get', path, {'all': ''})
+
+    def test_query_budget_detail_endpoints(self):
+        for model, path in ((AgendaItem, '/api/agendaItems/%d/'), (Bulletin, '/api/bulletins/%d/'),
+                            (ContactItem, '/api/contactItems/%d/'), (Newsletter, '/api/newsletters/%d/')):
+            self.assertMaxQueries(1, 'get', path % self.ids[model])
+
+    def test_query_budget_agenda_feed(self):
+        cache.bump(DEFAULT_SCHOOL_ID, AgendaItem)
+        self.assertMaxQueries(2, 'get', '/api/agenda.ics')    # Rendered while streaming.
+        self.assertMaxQueries(1, 'get', '/api/agenda.ics')    # Cached.
+
+    def test_query_budget_enrollment(self):
+        self.assertMaxQueries(7, 'post', '/api/enrollment', {'username': '33333333-4321-1234-abcd-4321abcd1234',
+                                                             'password': 'cccccccc-4321-abcd-1234-4321abcd1234'})
+
+    def test_query_budget_push_settings(self):
+        user = get_user_model().objects.get(username=self.username)
+        service = 'gcm' if GCMDevice.objects.filter(user=user).exists() else 'apns'
+        self.client.force_authenticate(user)
+        self.assertMaxQueries(2, 'get', '/api/push-settings')
+        self.assertMaxQueries(3, 'post', '/api/push-settings', {'service': service, 'active': False})
+
+
+class QueryBudgetSizeOneTests(QueryBudget, Base):
+    size = 1
+
+
+class QueryBudgetSizeHundredTests(QueryBudget, Base):
+    size = 100
+
+
+class QueryBudgetSizeTenThousandTests(QueryBudget, Base):
+    size = 10000
+
+
+class MetricsTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        get_user_model().objects.create_user('mere-mortal', 'myemail@example.com', 'I have no power')
+        get_user_model().objects.create_superuser('admin', 'myemail@example.com', 'I have the power')
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.addCleanup(rmtree, self.directory)
+        self.settings_override = self.settings(METRICS_DIR=self.directory)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_metrics_get_unauthenticated_is_not_allowed(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 403)
+
+    def test_metrics_get_as_normal_user_is_not_allowed(self):
+        self.client.login(username='mere-mortal', password='I have no power')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 403)
+
+    def test_metrics_get_as_admin_returns_prometheus_text(self):
+        self.client.get('/api/contactItems/')
+        self.client.login(username='admin', password='I have the power')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('# TYPE sebastiaanschool_http_request_duration_seconds histogram', response.content)
+        self.assertIn('sebastiaanschool_http_request_duration_seconds_bucket{route="contactitem-list",le="+Inf"}',
+                      response.content)
+        self.assertIn('sebastiaanschool_http_requests_total{method="GET",route="contactitem-list",status="200"}',
+                      response.content)
+
+    def test_metrics_sql_can_be_turned_off(self):
+        key = metrics._key('db_queries_total', {'route': 'contactitem-list'})
+        before = metrics.collect()['counters'].get(key, 0)
+        with self.settings(METRICS_SQL=False, PROFILE_SLOW_REQUEST_SECONDS=2):
+            self.client.get('/api/contactItems/')
+            # Nor kept for a profile.
+            self.assertEqual(len(connection.queries_log), 0)
+        self.assertEqual(metrics.collect()['counters'].get(key, 0), before)
+        self.client.get('/api/contactItems/')
+        self.assertEqual(metrics.collect()['counters'][key], before + 1)
+        self.assertFalse(connection.force_debug_cursor)
+
+    def test_metrics_merges_workers_and_archives_exited_ones(self):
+        """
+        Ensures counters of other worker processes are added up, and that the file of a worker that is gone is folded
+        into the archive without changing the totals.
+        """
+        key = metrics._key('enrollments_total', {'action': 'created'})
+        own = metrics.collect()['counters'].get(key, 0)
+        exited_worker = {'counters': {key: 5}, 'histograms': {}}
+        with open(os.path.join(self.directory, '999999999-1.json'), 'w') as f:
+            json.dump(exited_worker, f)
+        self.assertEqual(metrics.collect()['counters'][key], own + 5)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, '999999999-1.json')))
+        self.assertEqual(metrics.collect()['counters'][key], own + 5)
+
+    def test_metrics_render_escapes_label_values(self):
+        data = {'counters': {metrics._key('http_requests_total', {'route': 'a"b'}): 2}, 'histograms': {}}
+        self.assertIn('sebastiaanschool_http_requests_total{route="a\\"b"} 2', metrics.render(data))
+
+
+class ProfilingTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        ContactItem.objects.create(displayName="Connie Carlson", order=1, email="connie@example.com",
+                                   detailText="Teacher")
+        get_user_model().objects.create_user('mere-mortal', 'myemail@example.com', 'I have no power')
+        get_user_model().objects.create_superuser('admin', 'myemail@example.com', 'I have the power')
+
+    def setUp(self):
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        self.settings_override = self.settings(PROFILE_DIR=directory)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_profiling_fast_requests_are_not_saved(self):
+        with self.settings(PROFILE_SLOW_REQUEST_SECONDS=60, PROFILE_SAMPLE_RATE=0):
+            self.client.get('/api/contactItems/')
+        self.assertEqual(profiling.recent(), [])
+
+    def test_profiling_slow_request_is_saved_with_route_and_queries(self):
+        with self.settings(PROFILE_SLOW_REQUEST_SECONDS=0, PROFILE_SAMPLE_RATE=0):
+            self.client.get('/api/contactItems/')
+        summary, = profiling.recent()
+        self.assertEqual(summary['kind'], 'slow')
+        self.assertEqual(summary['route'], 'contactitem-list')
+        profile = profiling.load(summary['name'])
+        self.assertEqual(len(profile['queries']), 1)
+        self.assertIn('backend_contactitem', profile['queries'][0]['sql'])
+
+    def test_profiling_sampled_request_is_saved_with_cprofile_stats(self):
+        with self.settings(PROFILE_SLOW_REQUEST_SECONDS=None, PROFILE_SAMPLE_RATE=1):
+            self.client.get('/api/contactItems/')
+        summary, = profiling.recent()
+        self.assertEqual(summary['kind'], 'sampled')
+        self.assertIn('cumulative', profiling.load(summary['name'])['profile'])
+
+    def test_profiling_list_as_normal_user_is_not_allowed(self):
+        self.client.login(username='mere-mortal', password='I have no power')
+        response = self.client.get('/api/profiles')
+        self.assertEqual(response.status_code, 403)
+
+    def test_profiling_list_and_detail_as_admin(self):
+        with self.settings(PROFILE_SLOW_REQUEST_SECONDS=0, PROFILE_SAMPLE_RATE=0):
+            self.client.get('/api/contactItems/')
+            self.client.login(username='admin', password='I have the power')
+            response = self.client.get('/api/profiles')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['path'], '/api/contactItems/')
+        self.assertNotIn('queries', response.data[0])
+        response = self.client.get('/api/profiles/%s' % response.data[0]['name'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('queries', response.data)
+
+    def test_profiling_collapse_formats_outermost_frame_first(self):
+        frames = profiling.collapse(sys._getframe()).split(';')
+        self.assertTrue(frames[-1].startswith('tests.py:test_profiling_collapse_formats_outermost_frame_first:'))
+        self.assertTrue(len(frames) > 1)
+
+
+class Hoarded(object):
+    pass
+
+
+class MemoryTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        get_user_model().objects.create_user('mere-mortal', 'myemail@example.com', 'I have no power')
+        get_user_model().objects.create_superuser('admin', 'myemail@example.com', 'I have the power')
+
+    def setUp(self):
+        self.addCleanup(memory.stop)
+
+    def test_memory_growth_warnings_are_logged(self):
+        # Without a handler, Python 2 prints "No handlers could be found for logger ..." instead of the warning.
+        self.assertEqual([handler.level for handler in logging.getLogger('backend').handlers], [logging.NOTSET])
+
+    def test_memory_as_normal_user_is_not_allowed(self):
+        self.client.login(username='mere-mortal', password='I have no power')
+        self.assertEqual(self.client.get('/api/memory').status_code, 403)
+        self.assertEqual(self.client.post('/api/memory').status_code, 403)
+
+    def test_memory_tracking_reports_what_grew(self):
+        self.client.login(username='admin', password='I have the power')
+        report = self.client.get('/api/memory').data
+        self.assertEqual(report['pid'], os.getpid())
+        self.assertGreater(report['peakRss'], 0)
+        self.assertFalse(report['tracking'])
+
+        self.assertTrue(self.client.post('/api/memory').data['tracking'])
+        hoard = [Hoarded() for _ in range(10000)]
+        growth = self.client.get('/api/memory').data['growth']
+        # By type on Python 2, by allocation site on Python 3.
+        hoarded = '%s.Hoarded' % Hoarded.__module__
+        self.assertTrue(any(entry.get('type') == hoarded or entry.get('site', '').startswith(__file__)
+                            for entry in growth), growth)
+        del hoard
+
+        self.assertEqual(self.client.delete('/api/memory').status_code, 204)
+        self.assertFalse(self.client.get('/api/memory').data['tracking'])
+
+
+class GenerateLoadDataTests(APITestCase):
+
+    def test_generate_load_data_inserts_requested_volumes(self):
+        call_command('generate_load_data', agenda_items=30, bulletins=20, newsletters=10, contacts=5, users=8,
+                     batch_size=7, stdout=StringIO())
+        self.assertEqual(AgendaItem.objects.count(), 30)
+        self.assertEqual(AgendaOccurrence.objects.count(), 30)
+        self.assertEqual(Bulletin.objects.count(), 20)
+        self.assertEqual(Newsletter.objects.count(), 10)
+        self.assertEqual(ContactItem.objects.count(), 5)
+        self.assertEqual(get_user_model().objects.filter(groups__name='self-enrolled').count(), 8)
+        self.assertEqual(GCMDevice.objects.count() + APNSDevice.objects.count(), 8)
+        for agenda_item in AgendaItem.objects.all():
+            self.assertLessEqual(agenda_item.start, agenda_item.end)
+        for newsletter in Newsletter.objects.all():
+            self.assertEqual(newsletter.publishedAt.weekday(), 4)
+        for bulletin in Bulletin.objects.all():
+            self.assertEqual(bulletin.bodyHtml, render_markdown(bulletin.body))
+
+    def test_generate_load_data_continues_user_numbering(self):
+        call_command('generate_load_data', users=3, stdout=StringIO())
+        call_command('generate_load_data', users=2, stdout=StringIO())
+        self.assertTrue(get_user_model().objects.filter(username=synthetic.USERNAME_FORMAT % 4).exists())
+        self.assertEqual(GCMDevice.objects.count() + APNSDevice.objects.count(), 5)
+
+    def test_generate_load_data_users_can_log_in(self):
+        call_command('generate_load_data', users=1, stdout=StringIO())
+        self.assertTrue(self.client.login(username=synthetic.USERNAME_FORMAT % 0, password=synthetic.PASSWORD))
+
+    def test_synthetic_insert_fills_missing_columns_with_their_defaults(self):
+        # recurrence is NOT NULL with only a Python default.
+        now = timezone.now()
+        synthetic.insert(AgendaItem, ('title', 'type', 'start', 'end'), [('Studiedag', 'Studiedag', now, now)])
+        self.assertEqual(AgendaItem.objects.get().recurrence, '')
+
+
+class BenchmarkTests(SimpleTestCase):
+
+    def test_benchmark_percentile_uses_nearest_rank(self):
+        values = [float(x) for x in range(1, 101)]
+        self.assertEqual(percentile(values, 0.50), 50.0)
+        self.assertEqual(percentile(values, 0.95), 95.0)
+        self.assertEqual(percentile(values, 0.99), 99.0)
+        self.assertEqual(percentile([7.0], 0.99), 7.0)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_benchmark_compare_reports_only_p95_regressions_over_tolerance(self):
+        baseline = {'endpoints': {'timeline': {'p95': 0.100}, 'contactItems': {'p95': 0.010}}}
+        report = {'endpoints': {'timeline': {'p95': 0.150}, 'contactItems': {'p95': 0.011},
+                                'enrollment': {'p95': 0.500}}}
+        regressions = compare(baseline, report, tolerance=0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('timeline: '))
+
+    def test_benchmark_writes_its_data_to_a_temporary_directory(self):
+        with temporary_data() as directory:
+            for name in ('SNAPSHOT_DIR', 'METRICS_DIR', 'PROFILE_DIR', 'CACHE_LOCK_DIR'):
+                self.assertTrue(getattr(settings, name).startswith(directory + os.sep), name)
+            self.assertTrue(settings.CACHES['default']['LOCATION'].startswith(directory + os.sep))
+        self.assertFalse(os.path.exists(directory))
+
+
+class BenchmarkConnectionsTests(LiveServerTestCase):
+
+    def setUp(self):
+        # The live server logs every probe that timed out as a broken pipe.
+        server_logger = logging.getLogger('django.server')
+        server_logger.disabled = True
+        self.addCleanup(setattr, server_logger, 'disabled', False)
+
+    def test_benchmark_connections_single_threaded_server_cannot_serve_while_slow_client_holds_it(self):
+        stdout = StringIO()
+        call_command('benchmark_connections', self.live_server_url + '/api/contactItems/', connections=1, hold=0.5,
+                     timeout=0.2, stdout=stdout)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report['held'], 1)
+        self.assertEqual(report['completed'], 1)
+        self.assertGreater(report['probe_errors'], 0)
+
+
+class WarmupTests(SimpleTestCase):
+
+    def test_warm_up_runs_without_database(self):
+        # SimpleTestCase fails on any query, and a worker must be able to boot while the database is down.
+        warmup.warm_up()
+
+    def test_measure_startup_median(self):
+        self.assertEqual(median([3, 1, 2]), 2)
+        self.assertEqual(median([4, 1, 2, 3]), 2.5)
+
+
 # Make us get stack traces instead of just warnings for "naive datetime".
 filterwarnings(
         'error', r"DateTimeField .* received a naive datetime",
@@ -1,99 +1,569 @@
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
+from hashlib import sha1
 
+from django.conf import settings
 from django.contrib.auth import logout, get_user_model
 from django.contrib.auth.models import Group
+from django.db import connection, transaction
+from django.db.models import Case, Count, IntegerField, Min, Value, When
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.cache import patch_cache_control, patch_response_headers, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from django.utils.six.moves.queue import Empty
+from django.views.decorators.http import require_safe
 from push_notifications.models import APNSDevice, GCMDevice
 from rest_framework import permissions
 from rest_framework import views, viewsets
-from rest_framework.decorators import permission_classes
+from rest_framework.decorators import list_route, permission_classes
+from rest_framework.exceptions import ParseError, ValidationError
 from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-from backend.models import AgendaItem, Bulletin, ContactItem, Newsletter, TimelineItem
-from backend.serializers import AgendaItemSerializer, BulletinSerializer, ContactItemSerializer, NewsletterSerializer, TimelineSerializer
+from backend import cache, documents, events, ical, memory, metrics, profiling, search
+from backend.models import AgendaItem, AgendaOccurrence, Bulletin, ContactItem, Enrollment, Newsletter, TimelineItem
+from backend.serializers import (AgendaItemSerializer, AgendaOccurrenceSerializer, BulletinSerializer,
+                                 ContactItemOrderSerializer, ContactItemSerializer, NewsletterSerializer,
+                                 PrimaryKeyFromUrl, TimelineSerializer, body_format)
 
 
-class AgendaItemViewSet(viewsets.ModelViewSet):
+class IsSchoolStaff(permissions.BasePermission):
+    """
+    Lets only superusers and the users enrolled at the school of the request write its content, so the staff of one
+    school can't edit another through the X-School header. Reads are left to the other permissions.
+    """
+
+    def has_permission(self, request, view):
+        if request.method in permissions.SAFE_METHODS or request.user.is_superuser:
+            return True
+        return (request.user.is_authenticated and
+                Enrollment.objects.filter(user=request.user.pk, school=request.school.pk).exists())
+
+
+class SchoolMixin(object):
+    """
+    Limits a model view set to the objects of the school of the request, see `backend.tenancy`, and creates objects in
+    that school. Only its staff may write them, see IsSchoolStaff.
+    """
+
+    def get_permissions(self):
+        # Also for routes with permissions of their own, like `batch/`.
+        return super(SchoolMixin, self).get_permissions() + [IsSchoolStaff()]
+
+    def get_queryset(self):
+        return self.school_queryset()
+
+    def school_queryset(self):
+        return self.queryset.filter(school=self.request.school.pk)
+
+    def perform_create(self, serializer):
+        serializer.save(school_id=self.request.school.pk)
+
+
+class ScheduledExpiryMixin(object):
+    """
+    Lets clients and shared caches keep successful GET responses until `next_change()`, the moment their content
+    changes by schedule, but no longer than `settings.CACHE_MAX_AGE`, so edits show up within that time as well.
+    Responses to logged in users may only be cached privately.
+    """
+
+    def next_change(self, now):
+        """
+        When the response would change without any edits, or None.
+        """
+        return None
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ScheduledExpiryMixin, self).finalize_response(request, response, *args, **kwargs)
+        if request.method in ('GET', 'HEAD') and response.status_code == 200:
+            now = timezone.now()
+            max_age = settings.CACHE_MAX_AGE
+            change = self.next_change(now)
+            if change is not None:
+                max_age = max(min(max_age, int((change - now).total_seconds())), 0)
+            patch_response_headers(response, max_age)
+            patch_cache_control(response, **{'private' if request.user.is_authenticated else 'public': True})
+        return response
+
+
+def next_midnight(now):
+    return now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+
+def next_publication(view, now):
+    """
+    When the next publication appears in the list of publication view `view`, or None. An index lookup on publishedAt.
+    """
+    request = view.request
+    if view.action != 'list' or (request.user.is_superuser and 'all' in request.query_params):
+        return None
+    return view.school_queryset().filter(publishedAt__gt=now).aggregate(next=Min('publishedAt'))['next']
+
+
+class AgendaItemViewSet(ScheduledExpiryMixin, SchoolMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows agenda items to be viewed or edited.
+
+    Lists the occurrences starting today or later, so a recurring item appears once per repetition, with the start
+    and end of that occurrence. Append `?from=` and/or `?to=` (a date or an ISO 8601 date-time) to get the occurrences
+    overlapping that period instead, e.g. one month: `?from=2016-03-01&to=2016-04-01`. `from` is inclusive, `to`
+    exclusive. Append just `?all` to list the items themselves, past ones included, with their recurrence rules.
     """
     queryset = AgendaItem.objects.all()
     serializer_class = AgendaItemSerializer
 
     def get_queryset(self):
-        if 'all' in self.request.query_params:
-            selection = self.queryset
+        period_start = date_param(self.request, 'from')
+        period_end = date_param(self.request, 'to')
+        if 'all' in self.request.query_params and not (period_start or period_end):
+            return self.school_queryset()
+        if self.lists_occurrences():
+            selection = AgendaOccurrence.objects.select_related('item').filter(school=self.request.school.pk)
+        else:
+            selection = self.school_queryset()
+        if period_start or period_end:
+            # Overlap test; the (school, end, start) index turns it into a range scan over rows ending after `from`.
+            if period_start:
+                selection = selection.filter(end__gte=period_start)
+            if period_end:
+                selection = selection.filter(start__lt=period_end)
         else:
             cutoff_date = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            selection = self.queryset.exclude(start__lt=cutoff_date)
+            selection = selection.exclude(start__lt=cutoff_date)
         return selection
 
+    def get_serializer_class(self):
+        return AgendaOccurrenceSerializer if self.lists_occurrences() else self.serializer_class
+
+    def next_change(self, now):
+        # Occurrences that started before today drop off at midnight.
+        if self.action == 'list' and not any(name in self.request.query_params for name in ('all', 'from', 'to')):
+            return next_midnight(now)
+        return None
+
+    def lists_occurrences(self):
+        params = self.request.query_params
+        return self.action == 'list' and ('all' not in params or bool(params.get('from') or params.get('to')))
+
+
+@require_safe
+def agenda_feed(request):
+    """
+    The agenda as an iCalendar feed, for subscribing from a calendar app. No login required.
+
+    The rendered feed is cached until an agenda item changes. Its ETag is the agenda's table version, so a client that
+    sends back the ETag of its copy in If-None-Match gets a 304 without rendering anything.
+
+    $ http GET http://localhost:8000/api/agenda.ics
+    """
+    school = request.school
+    token = agenda_feed_token(school)
+    etag = quote_etag(token)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    if if_none_match.strip() == '*' or etag in parse_etags(if_none_match):
+        response = HttpResponseNotModified()
+    else:
+        feed = cache.lookup(school.pk, 'agenda.ics', token)
+        if feed is None:
+            response = StreamingHttpResponse(render_agenda_feed(school, token), content_type=ical.CONTENT_TYPE)
+        else:
+            response = HttpResponse(feed, content_type=ical.CONTENT_TYPE)
+    response['ETag'] = etag
+    return response
+
+
+def agenda_feed_token(school):
+    """
+    The version of the feed of `school`: that of its agenda items, plus its slug and name, which the feed shows too.
+    """
+    named = sha1(('%s\n%s' % (school.slug, school.name)).encode('utf-8')).hexdigest()[:8]
+    return '%s-%s' % (cache.version(school.pk, AgendaItem), named)
+
+
+def render_agenda_feed(school, token):
+    """
+    Yields the feed of a school while rendering it, and caches the complete feed under `token` once it has been sent.
+    """
+    chunks = []
+    items = AgendaItem.objects.filter(school=school.pk).order_by('start')
+    for chunk in ical.feed(items.iterator(), timezone.now(), school):
+        chunks.append(chunk)
+        yield chunk
+    cache.store(school.pk, 'agenda.ics', token, b''.join(chunks))
+
+
+def date_param(request, name):
+    """
+    Parses query parameter `name` as a date (midnight in the current time zone) or a date-time. Returns None when it's
+    absent.
+    """
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = day and datetime(day.year, day.month, day.day)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ParseError('Expected a date or date-time for "%s", got "%s".' % (name, value))
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class BatchWriteMixin(object):
+    """
+    Adds `batch/` to a model view set with SchoolMixin: admins POST a list of objects to create and update them all in
+    one request and one transaction.
+
+    Objects with the `url` of an existing object replace it; the others are created. When any object is invalid,
+    nothing is written and the response is a 400 with a list of errors per object, in payload order (empty for valid
+    objects). Otherwise it's the list of written objects. No model signals are sent: the cache version and the search
+    index are updated once for the whole batch.
+    """
+    MAX_BATCH_SIZE = 500
+
+    @list_route(methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def batch(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise ParseError('Expected a list of objects.')
+        if len(items) > self.MAX_BATCH_SIZE:
+            raise ParseError('Expected at most %d objects.' % self.MAX_BATCH_SIZE)
+        model = self.queryset.model
+        serializer = self.get_serializer(data=items, many=True)
+        serializer.is_valid()
+        errors = [dict(item_errors) for item_errors in serializer.errors] or [{} for _ in items]
+        pks = self.batch_references(items, errors)
+        if any(errors):
+            return Response(errors, status=400)
+
+        school_id = request.school.pk
+        instances = [model(pk=pk, school_id=school_id, **data) for pk, data in zip(pks, serializer.validated_data)]
+        self.prepare_batch(instances)
+        created = [instance for instance in instances if instance.pk is None]
+        updated = [instance for instance in instances if instance.pk is not None]
+        with transaction.atomic():
+            bulk_insert(created)
+            bulk_update(updated, [field.name for field in model._meta.concrete_fields if not field.primary_key])
+            cache.bump(school_id, model)
+            if model in search.INDEXED_MODELS:
+                search.index_missing(model, [instance.pk for instance in created])
+                search.reindex(model, [instance.pk for instance in updated])
+        return Response(self.get_serializer(instances, many=True).data)
+
+    def batch_references(self, items, errors):
+        """
+        The primary keys of the existing objects that `items` refer to by `url`, None for new ones. Adds an error for
+        bad references to `errors`.
+        """
+        model = self.queryset.model
+        field = PrimaryKeyFromUrl(view_name='%s-detail' % model._meta.model_name, queryset=self.queryset)
+        pks = []
+        for item, item_errors in zip(items, errors):
+            url = item.get('url') if isinstance(item, dict) else None
+            pk = None
+            if url:
+                try:
+                    pk = field.to_internal_value(url)
+                except ValidationError as e:
+                    item_errors['url'] = e.detail
+                else:
+                    if pk in pks:
+                        item_errors['url'] = ['Appears more than once in this batch.']
+            pks.append(pk)
+        existing = set(self.school_queryset().filter(pk__in=[ref for ref in pks if ref]).values_list('pk', flat=True))
+        for pk, item_errors in zip(pks, errors):
+            if pk and pk not in existing and 'url' not in item_errors:
+                item_errors['url'] = ['No %s with this URL.' % model._meta.verbose_name]
+        return pks
+
+    def prepare_batch(self, instances):
+        """
+        Hook to fill in fields that `save()` would, as the batch is written without it.
+        """
+
 
-class BulletinViewSet(viewsets.ModelViewSet):
+def bulk_insert(instances):
+    """
+    Inserts `instances` of one model and sets their primary keys. Sends no signals.
+    """
+    if not instances:
+        return
+    model = type(instances[0])
+    if connection.features.can_return_ids_from_bulk_insert:
+        model.objects.bulk_create(instances)
+        return
+    # Only PostgreSQL returns the primary keys of a multi-row INSERT. Elsewhere, recovering them afterwards would
+    # need the table locked, so insert the rows one by one.
+    fields = [field for field in model._meta.local_concrete_fields if field is not model._meta.auto_field]
+    for instance in instances:
+        instance.pk = model.objects._insert([instance], fields=fields, return_id=True)
+        instance._state.adding = False
+        instance._state.db = connection.alias
+
+
+def bulk_update(instances, field_names, per_query=100):
+    """
+    Writes `field_names` of `instances` of one model with an UPDATE per `per_query` instances. Sends no signals.
+    """
+    for start in range(0, len(instances), per_query):
+        chunk = instances[start:start + per_query]
+        meta = chunk[0]._meta
+        values = {}
+        for name in field_names:
+            field = meta.get_field(name)
+            values[name] = Case(*[When(pk=instance.pk, then=Value(getattr(instance, field.attname), output_field=field))
+                                  for instance in chunk], output_field=field)
+        type(chunk[0]).objects.filter(pk__in=[instance.pk for instance in chunk]).update(**values)
+
+
+class BulletinViewSet(ScheduledExpiryMixin, BatchWriteMixin, SchoolMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows bulletins to be viewed or edited.
 
     Shows only bulletins where the publishedAt date is not in the future. Append `?all` to the request path to include
-    future bulletins (admins only).
+    future bulletins (admins only). Append `?body_format=html` to get bodies as HTML rather than Markdown.
+
+    Admins can create and update many bulletins at once by POSTing a list to `/api/bulletins/batch/`.
     """
     queryset = Bulletin.objects.all()
     serializer_class = BulletinSerializer
 
     def get_queryset(self):
         if self.request.user.is_superuser and 'all' in self.request.query_params:
-            selection = self.queryset
+            selection = self.school_queryset()
         else:
-            selection = self.queryset.exclude(publishedAt__gt=timezone.now())
+            selection = self.school_queryset().exclude(publishedAt__gt=timezone.now())
         return selection
 
+    def next_change(self, now):
+        return next_publication(self, now)
 
-class ContactItemViewSet(viewsets.ModelViewSet):
+    def prepare_batch(self, bulletins):
+        for bulletin in bulletins:
+            bulletin.render_body()
+
+
+class ContactItemViewSet(SchoolMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows contact items to be viewed or edited.
+
+    To move contact items around, POST the URLs of all of them in their new order to `/api/contactItems/reorder/`
+    (admins only), rather than updating their `order` one by one.
     """
     queryset = ContactItem.objects.all()
     serializer_class = ContactItemSerializer
 
+    @list_route(methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def reorder(self, request):
+        """
+        Gives the contact items `order` 1, 2, 3... in the order of the list, in a single UPDATE. Responds with the
+        reordered list.
 
-class NewsletterViewSet(viewsets.ModelViewSet):
+        $ http --auth admin POST http://localhost:8000/api/contactItems/reorder/ \
+              contactItems:='["http://localhost:8000/api/contactItems/2/", "http://localhost:8000/api/contactItems/1/"]'
+        """
+        serializer = ContactItemOrderSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['contactItems']
+        with transaction.atomic():
+            if ids:
+                self.school_queryset().update(order=Case(*[When(pk=pk, then=Value(order)) for order, pk in
+                                                           enumerate(ids, 1)], output_field=IntegerField()))
+            # update() sends no signals.
+            cache.bump(request.school.pk, ContactItem)
+        contact_items = self.get_queryset()
+        return Response(self.get_serializer(contact_items, many=True).data)
+
+
+class NewsletterViewSet(ScheduledExpiryMixin, BatchWriteMixin, SchoolMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows news letters to be viewed or edited.
 
     Shows only bulletins where the publishedAt date is not in the future. Append `?all` to the request path to include
-    future newsletters (admins only).
+    future newsletters (admins only). `/api/newsletters/<id>/document` serves a local copy of a newsletter's document.
+
+    Admins can create and update many newsletters at once by POSTing a list to `/api/newsletters/batch/`.
     """
     queryset = Newsletter.objects.all()
     serializer_class = NewsletterSerializer
 
     def get_queryset(self):
         if self.request.user.is_superuser and 'all' in self.request.query_params:
-            selection = self.queryset
+            selection = self.school_queryset()
         else:
-            selection = self.queryset.exclude(publishedAt__gt=timezone.now())
+            selection = self.school_queryset().exclude(publishedAt__gt=timezone.now())
         return selection
 
+    def next_change(self, now):
+        return next_publication(self, now)
+
+
+@require_safe
+def newsletter_document(request, pk):
+    """
+    The document of a published newsletter, served from a local copy that's fetched from its `documentUrl` on the
+    first request and again when it's outdated, see `backend.documents`. Supports single byte ranges, so PDF viewers
+    can load pages as they're needed. Responds 502 Bad Gateway when there's no copy yet and the origin can't deliver
+    one.
+
+    $ http GET http://localhost:8000/api/newsletters/1/document Range:bytes=0-1023
+    """
+    try:
+        newsletter = Newsletter.objects.exclude(publishedAt__gt=timezone.now()).get(school=request.school.pk, pk=pk)
+    except Newsletter.DoesNotExist:
+        raise Http404('No published newsletter %s.' % pk)
+    try:
+        path = documents.fetch(newsletter.documentUrl)
+    except documents.DocumentUnavailable:
+        return HttpResponse('The newsletter document is temporarily unavailable.', status=502,
+                            content_type='text/plain; charset=utf-8')
+    document = open(path, 'rb')
+    stat = os.fstat(document.fileno())
+    size = stat.st_size
+    # A copy downloaded anew may differ, even under the same URL.
+    etag = quote_etag('%s-%x' % (os.path.basename(path), int(stat.st_mtime * 1000)))
+    header = request.META.get('HTTP_RANGE')
+    if header and request.META.get('HTTP_IF_RANGE', etag) != etag:
+        header = None    # The client's partial copy is of another version: send it all.
+    try:
+        requested = documents.byte_range(header, size)
+    except documents.UnsatisfiableRange:
+        document.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+    if requested is None:
+        response = FileResponse(document, content_type=documents.content_type(newsletter.documentUrl))
+        response['Content-Length'] = size
+    else:
+        first, last = requested
+        document.seek(first)
+        response = FileResponse(documents.FileRange(document, last - first + 1), status=206,
+                                content_type=documents.content_type(newsletter.documentUrl))
+        response['Content-Length'] = last - first + 1
+        response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    return response
+
+
+class TimelineViewSet(ScheduledExpiryMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that returns newsletters and bulletins in a combined timeline. Append `?body_format=html` to get
+    bulletin bodies as HTML rather than Markdown.
+    """
+    queryset = TimelineItem.objects.none()
+    serializer_class = TimelineSerializer
+
+    def get_queryset(self):
+        # A new RawQuerySet per request: iterating a shared one races on its cursor between threads.
+        return timeline(self.request.school.pk)
+
+    def next_change(self, now):
+        # Publications of tomorrow appear at midnight.
+        return next_midnight(now)
+
 
-class TimelineViewSet(viewsets.ReadOnlyModelViewSet):
+def timeline(school_id, limit=None, cutoff_date=None):
     """
-    API endpoint that returns newsletters and bulletins in a combined timeline.
+    Bulletins and newsletters of a school published before `cutoff_date`, by default tomorrow, newest first, as
+    TimelineItems. At most `limit` of them.
     """
-    from datetime import timedelta
-    cutoff_date = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
-    queryset = TimelineItem.objects.raw(
+    if cutoff_date is None:
+        cutoff_date = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    return TimelineItem.objects.raw(
         """
         SELECT
-          id, 'bulletin' AS type, title, body, NULL AS documentUrl, publishedAt
+          id, 'bulletin' AS type, title, body, bodyHtml, NULL AS documentUrl, publishedAt
           FROM backend_bulletin
-          WHERE publishedAt < %s
+          WHERE school_id = %s AND publishedAt < %s
         UNION SELECT
-          id, 'newsletter' AS type, title AS title, NULL AS body, documentUrl, publishedAt
+          id, 'newsletter' AS type, title AS title, NULL AS body, NULL AS bodyHtml, documentUrl, publishedAt
           FROM backend_newsletter
-          WHERE publishedAt < %s
+          WHERE school_id = %s AND publishedAt < %s
         ORDER BY
           publishedAt DESC
-        """, [cutoff_date, cutoff_date])
-    serializer_class = TimelineSerializer
+        """ + ('LIMIT %s' if limit else ''),
+        [school_id, cutoff_date, school_id, cutoff_date] + ([limit] if limit else []))
+
+
+EVENT_RETRY_MILLISECONDS = 5000
+EVENT_HEARTBEAT_SECONDS = 15
+EVENT_REPLAY_LIMIT = 100
+
+
+@require_safe
+def timeline_events(request):
+    """
+    Server-sent events (text/event-stream) announcing each bulletin and newsletter as it becomes visible, so apps
+    don't have to poll the timeline, see `backend.events`. The data of an event is the new timeline item. Append
+    `?body_format=html` to get bulletin bodies as HTML.
+
+    A client that reconnects with a Last-Event-ID header first gets the events it missed. When it missed more than
+    EVENT_REPLAY_LIMIT, it gets a `reset` event instead, and should reload the timeline.
+
+    Every connection holds a worker thread, so serve these with `sebastiaanschool/gevent_wsgi.py`, on PostgreSQL: on
+    other databases its queries block all connections.
+
+    $ http --stream GET http://localhost:8000/api/timeline/events
+    """
+    request = Request(request)
+    try:
+        body_format(request)
+    except ParseError as e:
+        return HttpResponse(e.detail, status=400, content_type='text/plain; charset=utf-8')
+    last = events.parse_id(request.META.get('HTTP_LAST_EVENT_ID', ''))
+    response = StreamingHttpResponse(timeline_event_stream(request, request.school.pk, last),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'    # Keeps nginx from holding back events.
+    return response
+
+
+def timeline_event_stream(request, school_id, last):
+    queue = events.hub.subscribe()
+    try:
+        yield b'retry: %d\n\n' % EVENT_RETRY_MILLISECONDS
+        replayed = set()
+        if last:
+            missed, more = events.missed(school_id, last, timezone.now(), EVENT_REPLAY_LIMIT)
+            if more:
+                yield b'event: reset\ndata: {}\n\n'
+            else:
+                for event in missed:
+                    replayed.add(event[1])
+                    yield timeline_event(request, *event)
+        if not connection.in_atomic_block:
+            connection.close()    # Don't hold on to a database connection while waiting.
+        while True:
+            if queue.dropped and queue.empty():
+                return    # Too far behind: the client reconnects for the rest, see `backend.events`.
+            try:
+                found = queue.get(timeout=EVENT_HEARTBEAT_SECONDS)
+            except Empty:
+                # Comments keep proxies from closing the connection, and reveal clients that are gone.
+                yield b': keep-alive\n\n'
+                continue
+            for event in found:
+                if event[2].school_id == school_id and event[1] not in replayed:
+                    yield timeline_event(request, *event)
+    finally:
+        events.hub.unsubscribe(queue)
+
+
+def timeline_event(request, published_at, key, publication):
+    data = JSONRenderer().render(TimelineSerializer(timeline_item(publication), context={'request': request}).data)
+    return b'id: %s\nevent: timeline\ndata: %s\n\n' % (events.event_id(published_at, key).encode('ascii'), data)
 
 
 @permission_classes((permissions.AllowAny,))
@@ -144,6 +614,8 @@ class UserEnrollmentRPC(views.APIView):
         user.set_password(password)
         user.groups.add(group)
         user.save()
+        Enrollment.objects.create(user=user, school_id=request.school.pk)
+        metrics.inc('enrollments_total', action='created')
         return Response(data=None, status=204)
 
     @staticmethod
@@ -161,6 +633,7 @@ class UserEnrollmentRPC(views.APIView):
         user = request.user
         logout(request)
         user.delete()
+        metrics.inc('enrollments_total', action='deleted')
         return Response(data=None, status=204)
 
     @staticmethod
@@ -268,6 +741,219 @@ class UserPushSettingsRPC(views.APIView):
         return Response(data={'detail': reason}, status=400)
 
 
+@permission_classes((permissions.AllowAny,))
+class BootstrapView(views.APIView):
+    """
+    Everything the app shows on launch, in one response: the TIMELINE_SIZE newest timeline items, the agenda of the
+    coming AGENDA_DAYS, the contacts and, for a logged in device, its push settings. Saves the round trips to
+    `/api/timeline/`, `/api/agendaItems/`, `/api/contactItems/` and `/api/push-settings`. Append `?body_format=html` to
+    get bulletin bodies as HTML.
+
+    The public parts are cached as rendered JSON until their tables change or the day ends, so usually only the table
+    versions and the push settings are read from the database. When a part has changed, one request renders it and
+    concurrent ones get its previous version meanwhile, see `cache.fetch()`. The ETag covers the parts served: a client
+    that sends it back in If-None-Match gets a 304.
+
+    Allowed URL patterns:
+    - GET     /api/bootstrap
+
+    HTTPie test command:
+    $ http --auth zeventien-letters:zeventien-letters GET http://localhost:8000/api/bootstrap
+    """
+    TIMELINE_SIZE = 20
+    AGENDA_DAYS = 60
+
+    def get(self, request):
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        variant = self.variant(request)
+        fragments = self.fragments(request.school.pk, today)
+        push_settings = self.push_settings(request)
+        push_settings = b'null' if push_settings is None else JSONRenderer().render(push_settings)
+        etag = self.etag(variant, [token for _, token, _ in fragments], push_settings)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            parts, served = [], []
+            for name, token, render in fragments:
+                # While another request renders a changed part, this one may get the previous version.
+                token, fragment = cache.fetch(request.school.pk, name, variant, token,
+                                              lambda: JSONRenderer().render(render(request, today)))
+                parts.append(fragment)
+                served.append(token)
+            response = HttpResponse(b'{"timeline":%s,"agenda":%s,"contacts":%s,"pushSettings":%s}' % (
+                tuple(parts) + (push_settings,)), content_type='application/json')
+            etag = self.etag(variant, served, push_settings)
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization', 'Cookie'))
+        return response
+
+    @staticmethod
+    def variant(request):
+        # Besides the table versions and the day, the public parts depend on the host in their URLs and the body format.
+        return sha1(('%s %s' % (request.build_absolute_uri('/'), body_format(request))).encode('utf-8')).hexdigest()
+
+    def fragments(self, school_id, today):
+        """
+        (cache name, token, render) of each public part of a school on the day starting at `today`.
+        """
+        tokens = cache.versions(school_id, AgendaItem, Bulletin, ContactItem, Newsletter)
+        return (
+            ('bootstrap-timeline', '%s-%s-%s' % (today.date(), tokens[Bulletin], tokens[Newsletter]),
+             self.render_timeline),
+            ('bootstrap-agenda', '%s-%s' % (today.date(), tokens[AgendaItem]), self.render_agenda),
+            ('bootstrap-contacts', tokens[ContactItem], self.render_contacts),
+        )
+
+    @staticmethod
+    def etag(variant, tokens, push_settings):
+        return quote_etag(sha1(' '.join([variant] + tokens + [push_settings])).hexdigest())
+
+    def render_timeline(self, request, today):
+        # Cut off by `today` rather than the clock, so a part can be rendered ahead of its day, see backend/warmer.py.
+        items = timeline(request.school.pk, self.TIMELINE_SIZE, today + timedelta(days=1))
+        return TimelineSerializer(items, many=True, context={'request': request}).data
+
+    def render_agenda(self, request, today):
+        occurrences = (AgendaOccurrence.objects.select_related('item')
+                       .filter(school=request.school.pk, start__gte=today,
+                               start__lt=today + timedelta(days=self.AGENDA_DAYS)))
+        return AgendaOccurrenceSerializer(occurrences, many=True, context={'request': request}).data
+
+    def render_contacts(self, request, today):
+        contact_items = ContactItem.objects.filter(school=request.school.pk)
+        return ContactItemSerializer(contact_items, many=True, context={'request': request}).data
+
+    def push_settings(self, request):
+        """
+        What GET /api/push-settings would return, or None for anonymous requests.
+        """
+        if not request.user.is_authenticated:
+            return None
+        device = find_device_for_user(user=request.user)
+        return {UserPushSettingsRPC.JSON_ACTIVE: device is not None and device.active}
+
+
+@permission_classes((permissions.AllowAny,))
+class SearchView(views.APIView):
+    """
+    Full-text search over published bulletins and newsletters, best matches first, see `backend.search`. Every word of
+    the query must occur, possibly as the start of a longer word.
+
+    Results look like timeline items, PAGE_SIZE per page, with links to the next and previous page.
+
+    Allowed URL patterns:
+    - GET     /api/search?q=schoolreisje&page=2
+
+    HTTPie test command:
+    $ http GET http://localhost:8000/api/search q==schoolreisje
+    """
+    PAGE_SIZE = 20
+
+    def get(self, request):
+        page = request.query_params.get('page', '1')
+        if not page.isdigit() or int(page) < 1:
+            raise ParseError('Expected a page number, got "%s".' % page)
+        page = int(page)
+        # One extra result tells whether there's a next page, without counting all matches.
+        documents = search.search(request.school.pk, request.query_params.get('q', ''), timezone.now(),
+                                  (page - 1) * self.PAGE_SIZE, self.PAGE_SIZE + 1)
+        publications = {}
+        for model in search.INDEXED_MODELS:
+            ids = [pk for document_model, pk in documents[:self.PAGE_SIZE] if document_model is model]
+            publications[model] = model.objects.in_bulk(ids) if ids else {}
+        items = [timeline_item(publications[model][pk]) for model, pk in documents[:self.PAGE_SIZE]
+                 if pk in publications[model]]
+        url = request.build_absolute_uri()
+        if page == 1:
+            previous = None
+        elif page == 2:
+            previous = remove_query_param(url, 'page')
+        else:
+            previous = replace_query_param(url, 'page', page - 1)
+        return Response({
+            'next': replace_query_param(url, 'page', page + 1) if len(documents) > self.PAGE_SIZE else None,
+            'previous': previous,
+            'results': TimelineSerializer(items, many=True, context={'request': request}).data,
+        })
+
+
+def timeline_item(publication):
+    return TimelineItem(id=publication.pk, type=type(publication).__name__.lower(), title=publication.title,
+                        body=getattr(publication, 'body', None), bodyHtml=getattr(publication, 'bodyHtml', None),
+                        documentUrl=getattr(publication, 'documentUrl', None), publishedAt=publication.publishedAt)
+
+
+@permission_classes((permissions.IsAdminUser,))
+class MetricsView(views.APIView):
+    """
+    Prometheus scrape endpoint (admins only). Merges the metrics of all worker processes.
+
+    HTTPie test command:
+    $ http --auth admin:<password> GET http://localhost:8000/metrics
+    """
+
+    @staticmethod
+    def get(request):
+        gauges = []
+        for service, device_class in (('apns', APNSDevice), ('gcm', GCMDevice)):
+            for row in device_class.objects.order_by().values('active').annotate(count=Count('id')):
+                gauges.append(('push_devices', {'service': service, 'active': '%s' % row['active']}, row['count']))
+        return HttpResponse(metrics.render(metrics.collect(), gauges), content_type='text/plain; version=0.0.4')
+
+
+@permission_classes((permissions.IsAdminUser,))
+class ProfilesView(views.APIView):
+    """
+    Recent request profiles (admins only), see `backend.profiling`.
+
+    Allowed URL patterns:
+    - GET     /api/profiles          Summaries of the most recent profiles, newest first.
+    - GET     /api/profiles/<name>   One profile, including its SQL queries.
+
+    HTTPie test command:
+    $ http --auth admin:<password> GET http://localhost:8000/api/profiles
+    """
+
+    @staticmethod
+    def get(request, name=None):
+        if name is None:
+            return Response(data=profiling.recent(), status=200)
+        data = profiling.load(name)
+        if data is None:
+            return Response(data=None, status=404)
+        return Response(data=data, status=200)
+
+
+@permission_classes((permissions.IsAdminUser,))
+class MemoryView(views.APIView):
+    """
+    Memory use of the worker process that serves the request (admins only), see `backend.memory`. Each process
+    tracks on its own, so compare reports with the same `pid`.
+
+    Allowed URL patterns:
+    - GET     /api/memory    Resident and peak memory and, while tracking, what grew most since tracking started.
+    - POST    /api/memory    Starts tracking, or starts over.
+    - DELETE  /api/memory    Stops tracking.
+
+    HTTPie test command:
+    $ http --auth admin:<password> POST http://localhost:8000/api/memory
+    """
+
+    @staticmethod
+    def get(request):
+        return Response(data=memory.report(), status=200)
+
+    @staticmethod
+    def post(request):
+        memory.start()
+        return Response(data=memory.report(), status=200)
+
+    @staticmethod
+    def delete(request):
+        memory.stop()
+        return Response(data=None, status=204)
+
+
 def find_device_for_user(user):
     try:
         return APNSDevice.objects.get(user=user)
@@ -0,0 +1,106 @@
+"""
+Renders the cached public responses before anyone asks for them, so that the first app launches of the day and after
+an edit find them ready: the public parts of /api/bootstrap of every school, for every host and body format, and the
+agenda feeds.
+
+The timeline and agenda parts are cached per day, so at midnight all of them are missed at once. Within LEAD of
+midnight, `warm()` also renders those of the coming day; their keys aren't used before midnight. An edit changes the
+token of its table, so the next `warm()` renders the parts of that table anew. Run it every minute from cron, or keep
+`watch()` running to catch edits within WATCH_INTERVAL. It renders what's missing only, so a run without changes costs
+a query per school.
+
+The default cache is shared between the processes of one host, see backend/cache.py, so run the warmer on every host
+that serves requests.
+"""
+from __future__ import unicode_literals
+
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from backend import cache
+from backend.models import School
+from backend.serializers import BODY_FORMATS
+from backend.views import BootstrapView, agenda_feed_token, render_agenda_feed
+
+LEAD = timedelta(minutes=10)
+WATCH_INTERVAL = 5    # seconds
+
+logger = logging.getLogger(__name__)
+
+
+def warm(now=None):
+    """
+    Renders every cached public response that's missing. Returns the number rendered.
+    """
+    now = now or timezone.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    days = [today]
+    if today + timedelta(days=1) - now <= LEAD:
+        days.append(today + timedelta(days=1))
+    rendered = 0
+    for school in School.objects.all():
+        rendered += warm_agenda_feed(school)
+        for request in requests(school):
+            for day in days:
+                rendered += warm_bootstrap(request, day)
+    return rendered
+
+
+def watch(interval=WATCH_INTERVAL):
+    """
+    Calls `warm()` every `interval` seconds, forever.
+    """
+    while True:
+        try:
+            rendered = warm()
+            if rendered:
+                logger.info('Rendered %d cached responses', rendered)
+        except Exception:
+            logger.exception('Warming the cache failed')
+            connection.close()
+        time.sleep(interval)
+
+
+def warm_bootstrap(request, today):
+    view = BootstrapView()
+    variant = view.variant(request)
+    rendered = []
+    for name, token, render in view.fragments(request.school.pk, today):
+        def build(render=render):
+            rendered.append(name)
+            return JSONRenderer().render(render(request, today))
+        # Leaves the part alone when a request is rendering it already.
+        cache.fetch(request.school.pk, name, variant, token, build)
+    return len(rendered)
+
+
+def warm_agenda_feed(school):
+    token = agenda_feed_token(school)
+    if cache.lookup(school.pk, 'agenda.ics', token) is not None:
+        return 0
+    for _ in render_agenda_feed(school, token):
+        pass
+    return 1
+
+
+def requests(school):
+    """
+    A request for /api/bootstrap in each body format for every host through which a school is reached: its own, and
+    with an X-School header, those in `settings.WARM_CACHE_HOSTS`.
+    """
+    factory = RequestFactory()
+    hosts = ([school.host] if school.host else []) + [host for host in settings.WARM_CACHE_HOSTS if host != school.host]
+    for host in hosts:
+        for format in BODY_FORMATS:
+            request = factory.get('/api/bootstrap', {'body_format': format}, HTTP_HOST=host,
+                                  secure=settings.WARM_CACHE_SECURE)
+            request.school = school
+            yield Request(request)
@@ -0,0 +1,51 @@
+"""
+Does the work a fresh worker would otherwise do during its first requests, so it happens at boot instead.
+
+The WSGI entry point calls `warm_up()` unless SEBASTIAAN_WARMUP is `off`. Nothing in here touches the database, so a
+worker still boots while the database is down.
+"""
+from __future__ import unicode_literals
+
+import inspect
+
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.test.client import RequestFactory
+from django.urls import get_resolver, reverse
+from rest_framework.request import Request
+from rest_framework.serializers import BaseSerializer
+from rest_framework.settings import api_settings
+
+TEMPLATES = (
+    'rest_framework/api.html',
+    'rest_framework/login.html',
+)
+
+
+def warm_up():
+    """
+    Imports the URLconf and compiles the resolver, instantiates all renderer, parser and authentication classes,
+    builds the fields of every serializer in `backend.serializers` and loads the browsable API templates.
+    """
+    resolver = get_resolver()
+    # Populating imports the URLconf, with the views and serializers, and compiles every pattern.
+    resolver.reverse_dict
+    for setting in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_AUTHENTICATION_CLASSES',
+                    'DEFAULT_PERMISSION_CLASSES', 'DEFAULT_THROTTLE_CLASSES'):
+        for cls in getattr(api_settings, setting):
+            cls()
+    warm_up_serializers()
+    for name in TEMPLATES:
+        try:
+            get_template(name)
+        except TemplateDoesNotExist:
+            pass
+
+
+def warm_up_serializers():
+    from backend import serializers
+
+    request = Request(RequestFactory().get(reverse('api-root')))
+    for name, cls in inspect.getmembers(serializers, inspect.isclass):
+        if issubclass(cls, BaseSerializer) and cls.__module__ == serializers.__name__:
+            cls(context={'request': request}).fields
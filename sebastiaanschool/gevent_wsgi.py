@@ -0,0 +1,71 @@
+"""
+Serves the WSGI application from a single gevent process, as an alternative to mod_wsgi.
+
+Every connection gets a greenlet instead of a worker thread, so clients on slow mobile networks no longer hold on
+to a worker while they trickle in their request or read the response. The views stay synchronous: after monkey
+patching, their socket waits yield to other connections. Requires `pip install gevent`.
+
+    python -m sebastiaanschool.gevent_wsgi
+
+Database drivers are C code that monkey patching doesn't reach. On PostgreSQL, a wait callback like psycogreen's makes
+psycopg2 yield while it waits for the server. Other databases, SQLite included, block the whole process for every
+query, so they only suit development; with them, each open /api/timeline/events stream stalls all connections once a
+second while it polls.
+
+Listens on OPENSHIFT_PYTHON_IP:OPENSHIFT_PYTHON_PORT (default 127.0.0.1:8080) and accepts at most
+GEVENT_MAX_CONNECTIONS (default 10000) connections at a time.
+"""
+from __future__ import absolute_import
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import logging
+import os
+
+from django.conf import settings
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from gevent.socket import wait_read, wait_write
+
+from sebastiaanschool.wsgi import application
+
+logger = logging.getLogger(__name__)
+
+
+def serve():
+    if not patch_psycopg2():
+        logger.warning('Not on PostgreSQL: every database query blocks all connections of this process')
+    address = (os.getenv('OPENSHIFT_PYTHON_IP', '127.0.0.1'), int(os.getenv('OPENSHIFT_PYTHON_PORT', '8080')))
+    pool = Pool(int(os.getenv('GEVENT_MAX_CONNECTIONS', '10000')))
+    WSGIServer(address, application, spawn=pool, log=None).serve_forever()
+
+
+def patch_psycopg2():
+    """
+    Makes psycopg2 yield to other greenlets while it waits for PostgreSQL. Returns whether the database is PostgreSQL.
+    """
+    if 'postgresql' not in settings.DATABASES['default']['ENGINE']:
+        return False
+    from psycopg2 import extensions
+    extensions.set_wait_callback(wait)
+    return True
+
+
+def wait(connection, timeout=None):
+    from psycopg2 import OperationalError, extensions
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            return
+        elif state == extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise OperationalError('Bad result from poll: %r' % state)
+
+
+if __name__ == '__main__':
+    serve()
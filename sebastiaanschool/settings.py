@@ -76,14 +76,20 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'backend.middleware.MetricsMiddleware',
+    'backend.middleware.AdmissionMiddleware',
+    'backend.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'backend.middleware.SchoolMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+    'backend.middleware.LastSeenMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'backend.middleware.SnapshotMiddleware',
 ]
 if 'OPENSHIFT_REPO_DIR' in os.environ:
     # redirect http to https when running on openshift
@@ -110,6 +116,16 @@ TEMPLATES = [
     },
 ]
 
+if not DEBUG:
+    # Parse each template once per process instead of on every request of the browsable API.
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'sebastiaanschool.wsgi.application'
 
 
@@ -121,6 +137,68 @@ DATABASES = {
     'default': database.config()
 }
 
+# Shared by all worker processes on this host, so a value rendered by one serves them all. See backend/cache.py.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(database.DATA_DIR, 'cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+CACHE_LOCK_DIR = os.path.join(database.DATA_DIR, 'locks')
+
+# Hosts, besides those of the schools, for which backend/warmer.py renders responses before they're asked for, and
+# whether clients reach them over HTTPS.
+WARM_CACHE_HOSTS = [host for host in ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+WARM_CACHE_SECURE = 'OPENSHIFT_REPO_DIR' in os.environ
+
+# Every worker process writes its metrics here; /metrics merges them.
+METRICS_DIR = os.path.join(database.DATA_DIR, 'metrics')
+# Whether to count SQL queries and their time per route. It keeps the SQL of every query of a request in memory until
+# the request ends (Django keeps at most 9000), so set METRICS_SQL=0 for requests that run many queries.
+METRICS_SQL = os.getenv('METRICS_SQL', '1') == '1'
+
+# Requests slower than PROFILE_SLOW_REQUEST_SECONDS (set it empty to disable) and one in every PROFILE_SAMPLE_RATE
+# requests (0 disables) get their profile saved to PROFILE_DIR. See backend/profiling.py.
+PROFILE_DIR = os.path.join(database.DATA_DIR, 'profiles')
+PROFILE_KEEP = 100
+PROFILE_SLOW_REQUEST_SECONDS = os.getenv('PROFILE_SLOW_REQUEST_SECONDS', '2')
+PROFILE_SLOW_REQUEST_SECONDS = float(PROFILE_SLOW_REQUEST_SECONDS) if PROFILE_SLOW_REQUEST_SECONDS else None
+PROFILE_SAMPLE_RATE = int(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+
+# Requests that raise the peak memory of their worker process by more than this many megabytes are logged. See
+# backend/memory.py.
+MEMORY_LOG_GROWTH_MB = float(os.getenv('MEMORY_LOG_GROWTH_MB', '16'))
+
+# Slug of the school that requests are for when neither their X-School header nor their host names one, see
+# backend/tenancy.py. Set it empty to answer those requests with a 404.
+DEFAULT_SCHOOL = os.getenv('DEFAULT_SCHOOL', 'sebastiaanschool')
+
+# Last good public list responses, served while the database is down. See backend/snapshots.py.
+SNAPSHOT_DIR = os.path.join(database.DATA_DIR, 'snapshots')
+
+# Load shedding, see backend/admission.py. Requests that one worker process handles at once, in all and per route class
+# besides `read`, the places kept for reads, and the longest wait in the web server's queue, in seconds. Beyond these,
+# requests get a 503 with Retry-After. Set ADMISSION_MAX_IN_FLIGHT or ADMISSION_MAX_QUEUE_SECONDS to 0 to disable.
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '50'))
+ADMISSION_LIMITS = {'enrollment': 4, 'admin': 8}
+ADMISSION_READ_RESERVE = 10
+ADMISSION_MAX_QUEUE_SECONDS = float(os.getenv('ADMISSION_MAX_QUEUE_SECONDS', '10'))
+# Only turn on behind a proxy that sets X-Request-Start on every request, overwriting what clients send.
+ADMISSION_TRUST_REQUEST_START = os.getenv('ADMISSION_TRUST_REQUEST_START', '0') == '1'
+ADMISSION_RETRY_AFTER = 5
+
+# Longest time clients and caches may keep API responses, see ScheduledExpiryMixin in backend/views.py. Responses that
+# change by schedule sooner, like the bulletins when the next one is published, expire at that moment instead.
+CACHE_MAX_AGE = int(os.getenv('CACHE_MAX_AGE', '300'))
+
+# Local copies of the documents that newsletters link to, served by /api/newsletters/<id>/document. See
+# backend/documents.py.
+DOCUMENT_CACHE_DIR = os.path.join(database.DATA_DIR, 'documents')
+DOCUMENT_FETCH_TIMEOUT = 10
+DOCUMENT_MAX_AGE = int(os.getenv('DOCUMENT_MAX_AGE', '86400'))    # seconds
+DOCUMENT_MAX_BYTES = 50 * 1024 * 1024
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -180,3 +258,23 @@ PUSH_NOTIFICATIONS_SETTINGS = {
     # "WNS_PACKAGE_SECURITY_ID": "[your package security id, e.g: 'ms-app://e-3-4-6234...']",
     # "WNS_SECRET_KEY": "[your app secret key, e.g.: 'KDiejnLKDUWodsjmewuSZkk']",
 }
+
+# Warnings of the app, like slow or memory-hungry requests and failed background writes, go to stderr, which the web
+# server adds to its error log. Set LOG_LEVEL=INFO to see what the cache warmer does, too.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '[%(asctime)s] %(levelname)s %(name)s %(process)d: %(message)s'},
+    },
+    'handlers': {
+        'stderr': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'backend': {'handlers': ['stderr'], 'level': os.getenv('LOG_LEVEL', 'WARNING')},
+        'sebastiaanschool': {'handlers': ['stderr'], 'level': os.getenv('LOG_LEVEL', 'WARNING')},
+    },
+}
+
+# Tests keep the directories that the app writes to under DATA_DIR in a temporary directory, see backend/testing.py.
+TEST_RUNNER = 'backend.testing.TemporaryDataRunner'
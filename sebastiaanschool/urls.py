@@ -28,9 +28,18 @@ router.register(r'timeline', views.TimelineViewSet)
 
 urlpatterns = [
     url(r'^$', lambda r: HttpResponseRedirect('/api/')),
-    url(r'^api/enrollment$', views.UserEnrollmentRPC.as_view()),
-    url(r'^api/push-settings$', views.UserPushSettingsRPC.as_view()),
+    url(r'^api/enrollment$', views.UserEnrollmentRPC.as_view(), name='enrollment'),
+    url(r'^api/push-settings$', views.UserPushSettingsRPC.as_view(), name='push-settings'),
+    url(r'^api/agenda\.ics$', views.agenda_feed, name='agenda-feed'),
+    url(r'^api/bootstrap$', views.BootstrapView.as_view(), name='bootstrap'),
+    url(r'^api/timeline/events$', views.timeline_events, name='timeline-events'),
+    url(r'^api/search$', views.SearchView.as_view(), name='search'),
+    url(r'^api/newsletters/(?P<pk>[0-9]+)/document$', views.newsletter_document, name='newsletter-document'),
     url(r'^api/', include(router.urls)),
+    url(r'^api/profiles$', views.ProfilesView.as_view(), name='profiles'),
+    url(r'^api/profiles/(?P<name>[0-9-]+)$', views.ProfilesView.as_view(), name='profile'),
+    url(r'^api/memory$', views.MemoryView.as_view(), name='memory'),
+    url(r'^metrics$', views.MetricsView.as_view(), name='metrics'),
     url(r'^admin/', admin.site.urls),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
@@ -26,3 +26,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sebastiaanschool.settings")
 
 application = get_wsgi_application()
+
+# Compile URL patterns, serializers and templates now rather than during the first requests of this worker.
+if os.getenv('SEBASTIAAN_WARMUP', 'on') != 'off':
+    from backend.warmup import warm_up
+    warm_up()